@@ -1,6 +1,7 @@
 import customtkinter as ctk
 from tkinter import ttk, messagebox
 import database
+from virtual_table import VirtualTable, TableSource
 import pdf_generator
 import sales_pdf_generator
 import os
@@ -16,7 +17,7 @@ class AllBillsFrame(ctk.CTkFrame):
         search_frame = ctk.CTkFrame(self)
         search_frame.pack(fill="x", pady=10)
         
-        ctk.CTkLabel(search_frame, text="Search (ID or Party Name):", font=("Arial", 12)).pack(side="left", padx=15, pady=15)
+        ctk.CTkLabel(search_frame, text="Search (Bill No, Party or Lorry):", font=("Arial", 12)).pack(side="left", padx=15, pady=15)
         
         self.search_entry = ctk.CTkEntry(search_frame, width=250)
         self.search_entry.pack(side="left", padx=5)
@@ -29,7 +30,7 @@ class AllBillsFrame(ctk.CTkFrame):
         self.filter_var.pack(side="right", padx=15)
         self.filter_var.set("ALL")
 
-        # --- DATA GRID (Standard Table) ---
+        # --- DATA GRID (Virtualized: only the visible rows are drawn) ---
         table_frame = ctk.CTkFrame(self)
         table_frame.pack(fill="both", expand=True, pady=10)
         
@@ -40,22 +41,14 @@ class AllBillsFrame(ctk.CTkFrame):
         style.configure("Treeview.Heading", font=("Arial", 11, "bold"), background="#333", foreground="white", relief="flat")
         style.map("Treeview", background=[('selected', '#1f538d')])
 
-        cols = ("TYPE", "ID", "DATE", "PARTY NAME", "TOTAL BAGS", "NET AMOUNT")
-        self.tree = ttk.Treeview(table_frame, columns=cols, show="headings", height=15)
+        cols = [("type", "TYPE", 100, "center"), ("bill_no", "ID", 80, "center"), ("bill_date", "DATE", 100, "center"),
+                ("party_name", "PARTY NAME", 250, "w"), ("total_bags", "TOTAL BAGS", 100, "center"), ("net_payable", "NET AMOUNT", 120, "e")]
+        self.table = VirtualTable(table_frame, cols, on_activate=lambda row: self.open_bill(), row_height=28)
+        self.table.pack(fill="both", expand=True, padx=5, pady=5)
         
-        # Configure Columns
-        self.tree.heading("TYPE", text="TYPE"); self.tree.column("TYPE", width=100, anchor="center")
-        self.tree.heading("ID", text="ID"); self.tree.column("ID", width=80, anchor="center")
-        self.tree.heading("DATE", text="DATE"); self.tree.column("DATE", width=100, anchor="center")
-        self.tree.heading("PARTY NAME", text="PARTY NAME"); self.tree.column("PARTY NAME", width=250, anchor="w")
-        self.tree.heading("TOTAL BAGS", text="TOTAL BAGS"); self.tree.column("TOTAL BAGS", width=100, anchor="center")
-        self.tree.heading("NET AMOUNT", text="NET AMOUNT"); self.tree.column("NET AMOUNT", width=120, anchor="e")
-            
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
-        scrollbar.pack(side="right", fill="y", padx=(0, 5), pady=5)
-        self.tree.pack(fill="both", expand=True, padx=(5, 0), pady=5)
+        # Define Colors
+        self.table.tree.tag_configure("purchase", foreground="#4fc3f7") # Light Blue for Purchase
+        self.table.tree.tag_configure("sale", foreground="#2CC985")    # Green for Sales
 
         # --- ACTION BUTTONS ---
         btn_frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -72,69 +65,26 @@ class AllBillsFrame(ctk.CTkFrame):
         self.load_data()
 
     def load_data(self):
-        """Fetches data from DB and populates the table"""
-        query = self.search_entry.get().lower()
-        filter_type = self.filter_var.get()
-        
-        # Clear existing data
-        self.tree.delete(*self.tree.get_children())
-        
-        conn = database.sqlite3.connect(database.DATABASE_FILE)
-        cursor = conn.cursor()
-        
-        records = []
-        
-        # 1. Fetch Purchases (Bills)
-        if filter_type in ["ALL", "PURCHASE"]:
-            try:
-                # Note: We only select columns that definitely exist to avoid errors
-                cursor.execute("SELECT b.bill_no, b.bill_date, p.party_name, b.total_bags, b.net_payable FROM bills b JOIN parties p ON b.party_id = p.party_id")
-                for r in cursor.fetchall():
-                    if query in str(r[0]).lower() or query in str(r[2]).lower():
-                        records.append(("PURCHASE", r[0], r[1], r[2], r[3], r[4]))
-            except Exception as e:
-                print(f"Error fetching purchases: {e}")
+        """Points the table at the current search/filter; rows are fetched page by page as they scroll into view"""
+        kind, search = self.filter_var.get(), self.search_entry.get().strip()
+        self.table.set_source(TableSource(
+            lambda after, limit, sort, desc: database.get_transactions_page(kind, search, after, limit, sort, desc),
+            lambda: database.count_transactions(kind, search),
+            format_row=self.format_row, sortable=database.ARCHIVE_SORT_COLUMNS, sort="bill_date"))
 
-        # 2. Fetch Sales (Sales Bills)
-        if filter_type in ["ALL", "SALE"]:
-            try:
-                cursor.execute("SELECT b.bill_no, b.bill_date, p.party_name, b.total_bags, b.net_payable FROM sales_bills b JOIN parties p ON b.party_id = p.party_id")
-                for r in cursor.fetchall():
-                    if query in str(r[0]).lower() or query in str(r[2]).lower():
-                        records.append(("SALE", r[0], r[1], r[2], r[3], r[4]))
-            except Exception as e:
-                print(f"Error fetching sales: {e}")
-        
-        conn.close()
-        
-        # Sort by Date (Newest first)
-        records.sort(key=lambda x: x[2], reverse=True)
-        
-        # Insert into table with color coding
-        for r in records:
-            # Format Amount with Currency Symbol
-            formatted_amt = f"₹ {r[5]:,.0f}"
-            
-            # Apply tags for color
-            tag = "purchase" if r[0] == "PURCHASE" else "sale"
-            
-            self.tree.insert("", "end", values=(r[0], r[1], r[2], r[3], r[4], formatted_amt), tags=(tag,))
-        
-        # Define Colors
-        self.tree.tag_configure("purchase", foreground="#4fc3f7") # Light Blue for Purchase
-        self.tree.tag_configure("sale", foreground="#2CC985")    # Green for Sales
+    @staticmethod
+    def format_row(r):
+        # Format Amount with Currency Symbol; tag for color
+        return (r[0], r[1], r[2], r[3], r[4], f"₹ {r[5]:,.0f}"), ("purchase" if r[0] == "PURCHASE" else "sale",)
 
     def open_bill(self):
         """Opens the PDF for the selected bill"""
-        item = self.tree.selection()
-        if not item:
+        row = self.table.selected_row()
+        if row is None:
             messagebox.showinfo("Info", "Please select a record to open.")
             return
             
-        vals = self.tree.item(item[0])['values']
-        bill_type = vals[0]
-        bill_no = vals[1]
-        party_name = vals[3]
+        bill_type, bill_no, party_name = row[0], row[1], row[3]
         
         try:
             if bill_type == "PURCHASE":
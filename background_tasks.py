@@ -0,0 +1,120 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+# ======================================================================================
+# BACKGROUND QUERY EXECUTOR (KEEPS THE TK MAIN LOOP RESPONSIVE)
+# ======================================================================================
+# Slow report work (SQL + pandas) runs on a small shared worker pool. Tk widgets may
+# only be touched from the main thread, so workers never call back directly: finished
+# jobs are queued and delivered by pump(), which an after() poll runs on the Tk thread.
+# Each job has a key (one per screen action); submitting the same key again supersedes
+# the earlier job, whose result is then dropped instead of overwriting the newer one.
+
+WORKER_COUNT = 2     # report screens rarely run more than two queries at once
+POLL_MS = 40         # how often the Tk thread checks for finished jobs
+
+_executor = None
+_lock = threading.Lock()
+_finished = queue.Queue()        # (key, token, result, error, on_done, on_error)
+_latest = {}                     # key -> token of the newest submission still outstanding
+_futures = {}                    # token -> Future, so superseded jobs can be cancelled
+_tokens = itertools.count(1)
+_poll_scheduled = False
+_stats = {"submitted": 0, "delivered": 0, "stale": 0, "cancelled": 0, "errors": 0}
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKER_COUNT, thread_name_prefix="db-worker")
+        return _executor
+
+def submit(widget, key, fn, *args, on_done, on_error=None, **kwargs):
+    """Runs fn(*args, **kwargs) on a worker; on_done(result) / on_error(exc) later run on the Tk thread.
+
+    `widget` is any Tk widget (used for after() polling). Pass None to deliver results by
+    calling pump() yourself. Returns the job's token.
+    """
+    token = next(_tokens)
+    with _lock:
+        superseded = _latest.get(key); _latest[key] = token
+        _stats["submitted"] += 1
+        old_future = _futures.pop(superseded, None)
+    if old_future is not None and old_future.cancel():
+        with _lock: _stats["cancelled"] += 1
+    future = _get_executor().submit(_run, key, token, fn, args, kwargs, on_done, on_error)
+    with _lock:
+        if _latest.get(key) == token: _futures[token] = future
+    if widget is not None: _schedule_poll(widget)
+    return token
+
+def _run(key, token, fn, args, kwargs, on_done, on_error):
+    with _lock:
+        if _latest.get(key) != token:  # superseded while queued
+            _stats["stale"] += 1; _futures.pop(token, None); return
+    try: _finished.put((key, token, fn(*args, **kwargs), None, on_done, on_error))
+    except Exception as e: _finished.put((key, token, None, e, on_done, on_error))
+    finally:
+        with _lock: _futures.pop(token, None)
+
+def is_pending(key):
+    """True while a job submitted under `key` has not been delivered yet."""
+    with _lock: return key in _latest
+
+def cancel(key):
+    """Forgets the outstanding job for `key`; its result will be dropped."""
+    with _lock:
+        token = _latest.pop(key, None)
+        future = _futures.pop(token, None)
+    if future is not None and future.cancel():
+        with _lock: _stats["cancelled"] += 1
+
+def pump():
+    """Delivers finished jobs. Must be called on the Tk thread; returns the number of callbacks run."""
+    delivered = 0
+    while True:
+        try: key, token, result, error, on_done, on_error = _finished.get_nowait()
+        except queue.Empty: return delivered
+        with _lock:
+            _futures.pop(token, None)
+            current = _latest.get(key) == token
+            if current: del _latest[key]
+            _stats["stale" if not current else "errors" if error else "delivered"] += 1
+        if not current: continue
+        delivered += 1
+        if error is None: on_done(result)
+        elif on_error is not None: on_error(error)
+        else: print(f"Background Task Error ({key}): {error}")
+
+def _schedule_poll(widget):
+    global _poll_scheduled
+    with _lock:
+        if _poll_scheduled: return
+        _poll_scheduled = True
+    try: widget.after(POLL_MS, lambda: _poll(widget))
+    except Exception:  # widget already destroyed (window closing)
+        with _lock: _poll_scheduled = False
+
+def _poll(widget):
+    global _poll_scheduled
+    with _lock: _poll_scheduled = False
+    pump()
+    with _lock: busy = bool(_latest) or not _finished.empty()
+    if busy: _schedule_poll(widget)
+
+def get_stats():
+    """Counters for tuning: jobs submitted, delivered, dropped as stale, cancelled before running, failed."""
+    with _lock: return dict(_stats, pending=len(_latest))
+
+def shutdown():
+    """Stops the worker pool (pending jobs are abandoned) and closes the workers' connections."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+        _latest.clear(); _futures.clear()
+    if executor is not None: executor.shutdown(wait=True, cancel_futures=True)
+    database.close_all_connections()
@@ -0,0 +1,189 @@
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import database
+
+# ======================================================================================
+# ONLINE BACKUP (SNAPSHOTS WHILE THE COUNTERS KEEP SAVING)
+# ======================================================================================
+# create_backup() copies DATABASE_FILE with the sqlite3 backup API, PAGES_PER_STEP pages at a
+# time with a short pause after every step, on its own connection. In WAL mode the copy holds
+# one read snapshot for its whole run: WAL readers never block writers, so saves carry on at full
+# speed and the copy is exactly the database as of the moment it started. In DELETE mode (network
+# share) a held read lock would stop every commit until the copy finished, so the steps run
+# unlocked and billing gets in between them; SQLite restarts the copy when another connection
+# saves, and after MAX_RESTARTS the last attempt copies everything in one step (one stall of about
+# the copy time). Each snapshot gets PRAGMA integrity_check before it is gzipped next to the
+# others in BACKUP_DIR; only the newest KEEP_BACKUPS are kept. Closed-year archive files never
+# change, so each one is compressed once and never rotated.
+# To restore, close the app and gunzip a snapshot over rice_mill.db.
+
+BACKUP_DIR = "backups"          # relative to the folder of DATABASE_FILE
+KEEP_BACKUPS = 14               # newest snapshots kept, older ones are deleted
+PAGES_PER_STEP = 256            # pages copied per backup step (1 MB at the default 4 KB page size)
+STEP_PAUSE_MS = 2               # pause after each step so the copy doesn't hog the disk
+MAX_RESTARTS = 3                # DELETE mode: copies restarted by other counters' saves before one-step copy
+BACKUP_EVERY_MIN = 60           # start(): minutes between automatic snapshots
+
+_lock = threading.Lock()        # one backup at a time
+_thread = None
+_stop = threading.Event()
+_last = {}
+
+def backup_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(database.DATABASE_FILE)), BACKUP_DIR)
+
+def _snapshot_pattern():
+    base = re.escape(os.path.splitext(os.path.basename(database.DATABASE_FILE))[0])
+    return re.compile(rf"^{base}_\d{{8}}-\d{{6}}\.db\.gz$")
+
+class _RestartLimit(Exception):
+    pass
+
+def _copy(src, dest, progress):
+    """Stepped sqlite3 backup. Returns (steps, restarts, one_step)."""
+    stats = {"steps": 0, "restarts": 0, "remaining": None}
+    wal = src.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+    def step(status, remaining, total):
+        if stats["remaining"] is not None and remaining > stats["remaining"]:
+            stats["restarts"] += 1
+            if stats["restarts"] > MAX_RESTARTS: raise _RestartLimit()
+        stats["remaining"] = remaining; stats["steps"] += 1
+        if progress: progress(total - remaining, total)
+        time.sleep(STEP_PAUSE_MS / 1000)
+    if wal: src.execute("BEGIN"); src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # pins the snapshot
+    try: src.backup(dest, pages=PAGES_PER_STEP, progress=step)
+    except _RestartLimit:
+        src.backup(dest, pages=-1)
+        return stats["steps"], stats["restarts"], True
+    finally:
+        if wal: src.execute("COMMIT")
+    return stats["steps"], stats["restarts"], False
+
+def _gzip(path, target):
+    with open(path, "rb") as f, gzip.open(target + ".part", "wb", compresslevel=6) as out: shutil.copyfileobj(f, out, 1024 * 1024)
+    os.replace(target + ".part", target)
+
+def create_backup(progress=None):
+    """Takes one snapshot now. Returns its .db.gz path or "Error: ...". progress(done_pages, total_pages) runs after each step."""
+    if not _lock.acquire(blocking=False): return "Error: A backup is already running."
+    started, src, dest, folder = time.perf_counter(), None, None, backup_dir()
+    name = f"{os.path.splitext(os.path.basename(database.DATABASE_FILE))[0]}_{datetime.now():%Y%m%d-%H%M%S}.db"
+    part = os.path.join(folder, name + ".part")
+    try:
+        os.makedirs(folder, exist_ok=True)
+        src, dest = database._open_connection(database.DATABASE_FILE), sqlite3.connect(part)
+        steps, restarts, one_step = _copy(src, dest, progress)
+        check = dest.execute("PRAGMA integrity_check").fetchone()[0]
+        if check != "ok": raise sqlite3.DatabaseError(f"snapshot failed integrity_check: {check}")
+        pages = dest.execute("PRAGMA page_count").fetchone()[0]
+        dest.execute("PRAGMA journal_mode=DELETE")  # a restored or verified copy is one self-contained file
+        has_archives = dest.execute("SELECT 1 FROM sqlite_master WHERE name = 'year_archives'").fetchone()
+        closed = [r[0] for r in dest.execute("SELECT path FROM year_archives")] if has_archives else []
+        dest.close(); dest = None
+        target = os.path.join(folder, name + ".gz")
+        _gzip(part, target)
+        archives = _backup_archives(folder, closed)
+        removed = rotate()
+        _last.clear(); _last.update(path=target, at=datetime.now().isoformat(timespec="seconds"), seconds=time.perf_counter() - started,
+                                    pages=pages, steps=steps, restarts=restarts, one_step=one_step, bytes=os.path.getsize(part),
+                                    gz_bytes=os.path.getsize(target), archives=archives, removed=removed, error=None)
+        return target
+    except Exception as e:
+        _last.clear(); _last.update(at=datetime.now().isoformat(timespec="seconds"), error=str(e))
+        return f"Error: {e}"
+    finally:
+        for conn in (src, dest):
+            if conn is not None: conn.close()
+        if os.path.exists(part): os.remove(part)
+        _lock.release()
+
+def _backup_archives(folder, paths):
+    """Compresses closed-year archive files that have no copy in the backup folder yet."""
+    copied = []
+    for path in map(database._resolve_archive, paths):
+        target = os.path.join(folder, os.path.basename(path) + ".gz")
+        if os.path.exists(path) and not os.path.exists(target): _gzip(path, target); copied.append(target)
+    return copied
+
+def list_backups():
+    """[(path, bytes, modified datetime)] of the rotated snapshots, newest first."""
+    folder, pattern = backup_dir(), _snapshot_pattern()
+    if not os.path.isdir(folder): return []
+    found = [os.path.join(folder, f) for f in os.listdir(folder) if pattern.match(f)]
+    return [(p, os.path.getsize(p), datetime.fromtimestamp(os.path.getmtime(p))) for p in sorted(found, reverse=True)]
+
+def rotate():
+    """Deletes all but the newest KEEP_BACKUPS snapshots. Returns the deleted paths."""
+    old = [p for p, _, _ in list_backups()[KEEP_BACKUPS:]]
+    for p in old: os.remove(p)
+    return old
+
+def verify_backup(path):
+    """Unpacks a snapshot to a temp file and runs integrity_check on it. Returns "ok" or "Error: ..."."""
+    plain = path + ".verify"
+    try:
+        with gzip.open(path, "rb") as f, open(plain, "wb") as out: shutil.copyfileobj(f, out, 1024 * 1024)
+        conn = sqlite3.connect(Path(plain).resolve().as_uri() + "?mode=ro", uri=True)
+        try: check = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally: conn.close()
+        return "ok" if check == "ok" else f"Error: {check}"
+    except Exception as e: return f"Error: {e}"
+    finally:
+        if os.path.exists(plain): os.remove(plain)
+
+def get_last_backup():
+    """Result of the last create_backup(): path, seconds, pages, steps, restarts, sizes, or error."""
+    return dict(_last)
+
+# --- AUTOMATIC SNAPSHOTS ---
+def start(every_min=BACKUP_EVERY_MIN):
+    """Starts a daemon thread that takes a snapshot every `every_min` minutes. Safe to call twice."""
+    global _thread
+    if _thread is not None: return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, args=(every_min * 60,), name="db-backup", daemon=True)
+    _thread.start()
+
+def stop():
+    """Stops the automatic snapshots; a copy in progress is finished first."""
+    global _thread
+    thread, _thread = _thread, None
+    if thread is None: return
+    _stop.set(); thread.join()
+
+def _run(every_s):
+    while not _stop.wait(every_s):
+        result = create_backup()
+        if result.startswith("Error"): print(f"Backup {result}")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Rice mill database backups")
+    parser.add_argument("--db", default=database.DATABASE_FILE, help="database file (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("now", help="take a snapshot now (safe while the app is running)")
+    sub.add_parser("list", help="list the kept snapshots")
+    check = sub.add_parser("verify", help="integrity-check a snapshot (default: the newest)"); check.add_argument("path", nargs="?")
+    args = parser.parse_args()
+    database.DATABASE_FILE = args.db
+    if args.command == "now":
+        path = create_backup()
+        if path.startswith("Error"): print(path)
+        else:
+            s = get_last_backup()
+            print(f"{path}: {s['pages']:,} pages in {s['seconds']:.1f}s, {s['bytes'] / 1e6:,.1f} MB -> {s['gz_bytes'] / 1e6:,.1f} MB, {s['restarts']} restarts")
+    elif args.command == "list":
+        for path, size, modified in list_backups(): print(f"{modified:%Y-%m-%d %H:%M}  {size / 1e6:8.1f} MB  {path}")
+    elif args.command == "verify":
+        backups = list_backups()
+        path = args.path or (backups[0][0] if backups else None)
+        print(f"{path}: {verify_backup(path)}" if path else "No backups yet")
+    database.close_all_connections()
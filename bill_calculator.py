@@ -0,0 +1,70 @@
+# ======================================================================================
+# BILL ARITHMETIC (SHARED BY BILLING SCREENS, EDIT SCREEN AND BULK IMPORT)
+# ======================================================================================
+# `fields` holds the raw header inputs: bill_no, party_name, date, lorry_no, total_bags,
+# truck_weight1_kg, truck_weight2_kg, truck_weight3_kg, discount_percent, brokerage,
+# hamali, others_desc, others_amount.
+
+MOISTURE_BASE = 14  # % moisture above which the purchase rate is deducted point for point
+
+def final_weight(*weights):
+    """Lowest non-zero weighbridge reading (QTL), or 0.0 if none was entered."""
+    weights = [w for w in weights if w > 0]
+    return min(weights) if weights else 0.0
+
+def _distribution_bags(fields, rows):
+    tot_bags_items = sum(r['bags'] for r in rows)
+    return tot_bags_items if tot_bags_items > 0 else (fields['total_bags'] if fields['total_bags'] > 0 else 1)
+
+def _net_payable(fields, gross):
+    disc = int(round((gross * fields['discount_percent']) / 100))
+    return int(round((gross - disc) + fields['brokerage'] + fields['hamali'] + fields['others_amount']))
+
+def _common_header(fields):
+    return {
+        "bill_no": fields['bill_no'], "party_name": fields['party_name'].upper(), "bill_date": fields['date'],
+        "date": fields['date'], "lorry_no": (fields.get('lorry_no') or "").upper(), "total_bags": fields['total_bags'],
+        "discount_percent": fields['discount_percent'], "brokerage": fields['brokerage'], "hamali": fields['hamali'],
+        "others_desc": (fields.get('others_desc') or "").upper(), "others_amount": fields['others_amount'],
+    }
+
+def calculate_purchase_bill(fields, rows):
+    """rows: [{paddy_type, bags, moisture, base_rate}]. Returns (header, items) ready for database.add_bill()."""
+    final_w = final_weight(fields['truck_weight1_kg'], fields['truck_weight2_kg'], fields['truck_weight3_kg'])
+    dist_bags = _distribution_bags(fields, rows)
+    calc_gross, items = 0, []
+    for r in rows:
+        bags, rate, moist = r['bags'], r['base_rate'], r['moisture']
+        deduct = (moist - MOISTURE_BASE) if moist > MOISTURE_BASE else 0
+        calc_rate = rate * (1 - (deduct / 100))
+        wt = (bags / dist_bags) * final_w
+        amt = int(round(wt * calc_rate))
+        calc_gross += amt
+        items.append({"paddy_type": r['paddy_type'].upper(), "bags": bags, "moisture": moist, "base_rate": rate,
+                      "calculated_rate": calc_rate, "calculated_weight_kg": wt, "item_amount": amt})
+
+    header = _common_header(fields)
+    header.update({"truck_weight1_kg": fields['truck_weight1_kg'], "truck_weight2_kg": fields['truck_weight2_kg'],
+                   "truck_weight3_kg": fields['truck_weight3_kg'], "final_truck_weight_kg": final_w,
+                   "total_gross_amount": calc_gross, "net_payable": _net_payable(fields, calc_gross)})
+    return header, items
+
+def calculate_sales_bill(fields, rows):
+    """rows: [{paddy_type, bags, rate}]. Returns (header, items) ready for database.add_sales_bill()."""
+    final_w = final_weight(fields['truck_weight1_kg'], fields['truck_weight2_kg'], fields['truck_weight3_kg'])
+    dist_bags = _distribution_bags(fields, rows)
+    calc_gross, items = 0, []
+    for r in rows:
+        bags, rate = r['bags'], r['rate']
+        wt = (bags / dist_bags) * final_w
+        amt = int(round(wt * rate))
+        calc_gross += amt
+        items.append({"paddy_type": r['paddy_type'].upper(), "bags": bags, "rate": rate,
+                      "calculated_weight_kg": wt, "item_amount": amt})
+
+    header = _common_header(fields)
+    header.update({"final_weight_kg": final_w, "total_gross_amount": calc_gross,
+                   "net_payable": _net_payable(fields, calc_gross),
+                   # Extra fields for PDF generation
+                   "gst_no": "N/A", "address": "N/A", "mobile_no": "N/A"})
+    return header, items
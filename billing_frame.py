@@ -4,6 +4,7 @@ from tkcalendar import Calendar
 from datetime import datetime
 import os
 import database
+import bill_calculator
 import pdf_generator
 
 # ======================================================
@@ -273,52 +274,15 @@ class BillingFrame(ctk.CTkFrame):
             s_float = lambda e: float(e.get()) if e.get().strip() else 0.0
             s_int = lambda e: int(e.get()) if e.get().strip() else 0
             
-            b_no = s_int(self.bill_no) 
-            weights = [s_float(self.w1), s_float(self.w2), s_float(self.w3)]
-            final_w = min([w for w in weights if w > 0]) if any(w > 0 for w in weights) else 0.0
-            
-            tot_bags = s_int(self.total_bags)
-            calc_gross = 0
-            items_data = []
-            
-            tot_bags_items = sum(s_int(r['bags']) for r in self.item_rows)
-            # Allocation logic
-            dist_bags = tot_bags_items if tot_bags_items > 0 else (tot_bags if tot_bags > 0 else 1)
-
-            for r in self.item_rows:
-                bags = s_int(r['bags'])
-                rate = s_float(r['rate'])
-                moist = s_float(r['moist'])
-                deduct = (moist - 14) if moist > 14 else 0
-                calc_rate = rate * (1 - (deduct / 100))
-                wt = (bags / dist_bags) * final_w
-                amt = int(round(wt * calc_rate))
-                calc_gross += amt
-                
-                items_data.append({
-                    "paddy_type": r["type"].get().upper(),
-                    "bags": bags,
-                    "moisture": moist,
-                    "base_rate": rate,
-                    "calculated_rate": calc_rate,
-                    "calculated_weight_kg": wt,
-                    "item_amount": amt
-                })
-
-            disc = int(round((calc_gross * s_float(self.discount)) / 100))
-            net = int(round((calc_gross - disc) + s_float(self.brokerage) + s_float(self.hamali) + s_float(self.others_a)))
-
-            header = {
-                "bill_no": b_no, "party_name": self.party.get().upper(), "bill_date": self.date.get(), 
-                "date": self.date.get(), "lorry_no": self.lorry.get().upper(), "total_bags": tot_bags, 
-                "truck_weight1_kg": s_float(self.w1), "truck_weight2_kg": s_float(self.w2), 
-                "truck_weight3_kg": s_float(self.w3), "final_truck_weight_kg": final_w,
-                "total_gross_amount": calc_gross, "discount_percent": s_float(self.discount), 
-                "brokerage": s_float(self.brokerage), "hamali": s_float(self.hamali), 
-                "others_desc": self.others_d.get().upper(), "others_amount": s_float(self.others_a),
-                "net_payable": net
+            fields = {
+                "bill_no": s_int(self.bill_no), "party_name": self.party.get(), "date": self.date.get(),
+                "lorry_no": self.lorry.get(), "total_bags": s_int(self.total_bags),
+                "truck_weight1_kg": s_float(self.w1), "truck_weight2_kg": s_float(self.w2), "truck_weight3_kg": s_float(self.w3),
+                "discount_percent": s_float(self.discount), "brokerage": s_float(self.brokerage), "hamali": s_float(self.hamali),
+                "others_desc": self.others_d.get(), "others_amount": s_float(self.others_a)
             }
-            return header, items_data
+            rows = [{"paddy_type": r["type"].get(), "bags": s_int(r['bags']), "moisture": s_float(r['moist']), "base_rate": s_float(r['rate'])} for r in self.item_rows]
+            return bill_calculator.calculate_purchase_bill(fields, rows)
         except Exception as e:
             messagebox.showerror("Error", f"Calculation Error: {str(e)}")
             return None, None
@@ -341,7 +305,8 @@ class BillingFrame(ctk.CTkFrame):
         if header["total_bags"] == 0: return messagebox.showerror("Error", "Total Bags 0")
         
         try:
-            res = database.add_bill(header, items)
+            # The number on screen is only a preview; the save takes the next free one
+            res = database.add_bill(dict(header, bill_no=None), items)
             if isinstance(res, int):
                 # Fetch full data to ensure PDF is perfect
                 saved_bill = database.get_bill_details(res)
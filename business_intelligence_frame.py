@@ -2,6 +2,7 @@ import customtkinter as ctk
 from tkinter import ttk
 import pandas as pd
 import database
+import background_tasks
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import calendar
@@ -16,7 +17,11 @@ class BusinessIntelligenceFrame(ctk.CTkFrame):
         super().__init__(master, fg_color="transparent")
         
         # --- HEADER ---
-        ctk.CTkLabel(self, text="BUSINESS INTELLIGENCE & DEEP INSIGHTS", font=("Arial", 22, "bold"), text_color=ACCENT).pack(pady=(10, 20), anchor="w", padx=20)
+        header = ctk.CTkFrame(self, fg_color="transparent")
+        header.pack(fill="x", padx=20, pady=(10, 20))
+        ctk.CTkLabel(header, text="BUSINESS INTELLIGENCE & DEEP INSIGHTS", font=("Arial", 22, "bold"), text_color=ACCENT).pack(side="left")
+        self.loading_lbl = ctk.CTkLabel(header, text="", font=("Arial", 12, "bold"), text_color="#f1c40f")
+        self.loading_lbl.pack(side="left", padx=15)
 
         # --- GRID LAYOUT ---
         self.grid_columnconfigure((0, 1), weight=1)
@@ -60,16 +65,33 @@ class BusinessIntelligenceFrame(ctk.CTkFrame):
         card.lbl_sub = lbl_sub
         return card
 
+    def set_loading(self, busy):
+        self.loading_lbl.configure(text="LOADING..." if busy else "")
+
     def load_insights(self):
+        self.set_loading(True)
+        background_tasks.submit(self, "bi.insights", self.fetch_insights, on_done=self.show_insights, on_error=self.on_load_error)
+
+    @staticmethod
+    def fetch_insights():
+        """Runs on a worker thread: the three insight queries, no widget access."""
+        return database.get_supplier_rankings(), database.get_moisture_insights(), database.get_seasonal_buying_stats()
+
+    def on_load_error(self, e):
+        self.set_loading(False)
+        self.clear_chart(self.left_chart, f"FAILED TO LOAD: {e}")
+
+    def show_insights(self, data):
+        self.set_loading(False)
+        df_rank, df_moist, df_season = data
+
         # 1. Supplier Rankings
-        df_rank = database.get_supplier_rankings()
         if not df_rank.empty:
             best = df_rank.iloc[0]
             self.card1.lbl_main.configure(text=best['party_name'])
             self.card1.lbl_sub.configure(text=f"Avg Rate: ₹{best['avg_rate']:.0f} (Vol: {best['vol']})")
         
         # 2. Moisture Analysis
-        df_moist = database.get_moisture_insights()
         if not df_moist.empty:
             wettest = df_moist.iloc[0]
             self.card2.lbl_main.configure(text=wettest['party_name'])
@@ -79,7 +101,6 @@ class BusinessIntelligenceFrame(ctk.CTkFrame):
             self.clear_chart(self.left_chart, "NO DATA")
 
         # 3. Seasonal Patterns
-        df_season = database.get_seasonal_buying_stats()
         if not df_season.empty:
             peak = df_season.loc[df_season['total_bags'].idxmax()]
             month_name = calendar.month_name[int(peak['month'])]
@@ -1,41 +1,229 @@
+import json
+import os
+import random
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from functools import wraps
+from pathlib import Path
 import pandas as pd
 from datetime import datetime
+import bill_calculator
 
 DATABASE_FILE = "rice_mill.db"
 
+# Connection tuning (shared by every thread's long-lived connection)
+JOURNAL_MODE = "WAL"            # readers never block the writer. Use "DELETE" if rice_mill.db sits on a
+                                # network share: WAL's shared-memory index only works within one PC
+BUSY_TIMEOUT_MS = 3000          # how long a writer waits for another counter's lock before retrying
+WRITE_RETRIES = 4               # extra attempts after a busy timeout, with exponential backoff
+RETRY_BACKOFF_S = 0.05
+STATEMENT_CACHE_SIZE = 256      # prepared statements kept per connection
+CACHE_SIZE_KB = 16000           # page cache (PRAGMA cache_size, negative = KiB)
+MMAP_SIZE_BYTES = 64 * 1024 * 1024
+
+# ======================================================================================
+# CONNECTION MANAGER
+# ======================================================================================
+
+_local = threading.local()
+_open_connections = []
+_connections_lock = threading.Lock()
+_pool_epoch = 0                 # bumped by close_all_connections(): connections of an older epoch are closed
+
+def _open_connection(path):
+    """Opens and tunes a new connection. Autocommit mode: writers issue their own BEGIN."""
+    # check_same_thread=False only so close_all_connections() can close other threads' connections; each is used by its own thread
+    conn = sqlite3.connect(path, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE, timeout=BUSY_TIMEOUT_MS / 1000,
+                           uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def get_connection():
+    """Returns this thread's reused connection to DATABASE_FILE, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.epoch != _pool_epoch: conn = _local.conn = _local.data_version = None  # closed by close_all_connections()
+    if conn is not None and _local.path == DATABASE_FILE: return conn
+    if conn is not None: close_connection(); bump_generation()  # DATABASE_FILE was switched
+    conn = _open_connection(DATABASE_FILE)
+    _local.conn, _local.path, _local.attached, _local.epoch = conn, DATABASE_FILE, {}, _pool_epoch
+    with _connections_lock: _open_connections.append(conn)
+    return conn
+
+def close_connection():
+    """Closes the calling thread's connection (e.g. when a worker thread exits)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None: return
+    with _connections_lock:
+        if conn in _open_connections: _open_connections.remove(conn)
+    conn.close(); _local.conn = None; _local.data_version = None
+
+def close_all_connections():
+    """Closes every thread's pooled connection. Call on shutdown or before replacing the DB file, with no
+    query running; each thread opens a fresh connection on its next get_connection()."""
+    global _pool_epoch
+    with _connections_lock:
+        conns = list(_open_connections); _open_connections.clear(); _pool_epoch += 1
+    for conn in conns: conn.close()
+    _local.conn = _local.data_version = None
+
+# ======================================================================================
+# WRITE TRANSACTIONS (SEVERAL COUNTERS SHARING ONE DATABASE FILE)
+# ======================================================================================
+# Every write takes the write lock up front with BEGIN IMMEDIATE on the calling thread's one
+# connection, and does all its work (party auto-insert included) through that connection. A
+# deferred BEGIN that reads first and then writes fails outright ("database is locked") when
+# another counter committed in between, and the busy timeout cannot help it. When the lock is
+# still held after BUSY_TIMEOUT_MS we back off and retry WRITE_RETRIES times before giving up.
+
+class DatabaseBusyError(sqlite3.OperationalError):
+    """The write lock stayed busy through every retry. Nothing was written."""
+
+_write_stats = {"transactions": 0, "retries": 0, "busy_failures": 0, "max_wait_ms": 0.0}
+_write_stats_lock = threading.Lock()
+
+def _is_busy(e):
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in str(e) or "busy" in str(e))
+
+def _with_retry(step):
+    started = time.perf_counter()
+    for attempt in range(WRITE_RETRIES + 1):
+        try: result = step(); break
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e): raise
+            if attempt == WRITE_RETRIES:
+                with _write_stats_lock: _write_stats["busy_failures"] += 1
+                raise DatabaseBusyError("Database is busy: another counter is saving. Nothing was saved, please try again.") from e
+            with _write_stats_lock: _write_stats["retries"] += 1
+            time.sleep(RETRY_BACKOFF_S * 2 ** attempt * random.uniform(0.5, 1.5))
+    with _write_stats_lock:
+        _write_stats["max_wait_ms"] = max(_write_stats["max_wait_ms"], (time.perf_counter() - started) * 1000)
+    return result
+
+def begin_write(conn, cursor=None):
+    """Starts a write transaction on `conn` with BEGIN IMMEDIATE (retrying while busy). Returns the cursor."""
+    cursor = cursor or conn.cursor()
+    _with_retry(lambda: cursor.execute("BEGIN IMMEDIATE"))
+    with _write_stats_lock: _write_stats["transactions"] += 1
+    return cursor
+
+def commit(conn):
+    """Commits, retrying while busy (rollback-journal mode waits for readers here; the transaction stays open)."""
+    _with_retry(conn.commit)
+
+def get_write_stats():
+    """Write transactions started, lock retries, saves given up as busy and the longest lock wait."""
+    with _write_stats_lock: return dict(_write_stats)
+
 # ======================================================================================
 # CORE DATABASE SETUP & HELPER FUNCTIONS
 # ======================================================================================
 
 def execute_query(query, params=(), fetch=None):
-    """Executes a SQL query safely."""
-    conn = None
+    """Executes a SQL query safely. Without `fetch` it is a write, run in its own BEGIN IMMEDIATE transaction."""
+    conn = get_connection()
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        
         if fetch == "one":
-            result = cursor.fetchone()
+            result = conn.execute(query, params).fetchone()
         elif fetch == "all":
-            result = cursor.fetchall()
+            result = conn.execute(query, params).fetchall()
         else:
-            conn.commit()
+            cursor = begin_write(conn)
+            try: cursor.execute(query, params); commit(conn)
+            except Exception: conn.rollback(); raise
             result = cursor.lastrowid
+            bump_generation()
         return result
     except sqlite3.Error as e:
         print(f"DB Error: {e}")
         return None if fetch else f"DB Error: {e}"
-    finally:
-        if conn:
-            conn.close()
+
+# ======================================================================================
+# QUERY RESULT CACHE (INVALIDATED BY WRITES)
+# ======================================================================================
+
+CACHE_MAX_ENTRIES = 128
+
+_cache = OrderedDict()          # (function, args, kwargs) -> (generation, result), oldest first
+_cache_lock = threading.Lock()
+_generation = 0
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+def bump_generation():
+    """Invalidates every cached result. Every write path calls this once its changes are committed."""
+    global _generation
+    with _cache_lock:
+        _generation += 1; _cache_stats["invalidations"] += 1
+        _cache.clear()
+
+def _check_external_writes():
+    """PRAGMA data_version moves when another connection (another thread or counter PC) commits."""
+    version = get_connection().execute("PRAGMA data_version").fetchone()[0]
+    if getattr(_local, "data_version", None) not in (None, version): bump_generation()
+    _local.data_version = version
+
+def _copy_result(result):
+    if isinstance(result, pd.DataFrame): return result.copy()
+    if isinstance(result, list): return list(result)
+    if isinstance(result, tuple): return tuple(_copy_result(r) for r in result)
+    return result
+
+def cached_query(fn):
+    """Caches a read function's result by arguments until the next write (bounded LRU)."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        _check_external_writes()
+        key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry is not None and entry[0] == _generation:
+                _cache.move_to_end(key); _cache_stats["hits"] += 1
+                return _copy_result(entry[1])
+            _cache_stats["misses"] += 1
+            generation = _generation
+        result = fn(*args, **kwargs)
+        with _cache_lock:
+            if generation == _generation:
+                _cache[key] = (generation, result); _cache.move_to_end(key)
+                while len(_cache) > CACHE_MAX_ENTRIES: _cache.popitem(last=False); _cache_stats["evictions"] += 1
+        return _copy_result(result)
+    return wrapper
+
+def writes(fn):
+    """Marks a write function: cached results are dropped after it runs, whatever its outcome."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        try: return fn(*args, **kwargs)
+        finally: bump_generation()
+    return wrapper
+
+def get_cache_stats():
+    """Hit/miss/eviction counters plus current size, for tuning CACHE_MAX_ENTRIES."""
+    with _cache_lock:
+        stats = dict(_cache_stats, size=len(_cache), generation=_generation)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
 
 def setup_database():
-    """Creates all necessary tables if they don't exist."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    
+    """Brings the schema up to date (see MIGRATIONS) and syncs the inventory ledger."""
+    migrate_database()
+    sync_inventory()
+
+# ======================================================================================
+# SCHEMA MIGRATIONS (VERSION TRACKED IN PRAGMA user_version)
+# ======================================================================================
+
+def _create_base_tables(c):
+    """Version 1: the original schema. IF NOT EXISTS keeps it safe on pre-migration databases."""
     # 1. Master Tables
     c.execute("""CREATE TABLE IF NOT EXISTS parties (
         party_id INTEGER PRIMARY KEY, party_name TEXT NOT NULL UNIQUE, 
@@ -91,40 +279,651 @@ def setup_database():
         bags INTEGER NOT NULL, avg_weight_kg REAL NOT NULL, total_weight_kg REAL NOT NULL, 
         FOREIGN KEY (batch_id) REFERENCES processing_batches (batch_id));""")
 
-    conn.commit()
-    conn.close()
-    rebuild_inventory_from_bills()
+    c.execute("""CREATE TABLE IF NOT EXISTS app_meta (
+        key TEXT PRIMARY KEY, value TEXT);""")
 
-def rebuild_inventory_from_bills():
-    """Wipes inventory log and recalculates everything to fix sync issues."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM inventory_log")
-    
-    # 1. Purchase (+)
-    purchases = pd.read_sql("SELECT b.bill_date, b.bill_no, i.paddy_type, i.bags, i.calculated_weight_kg FROM bills b JOIN bill_items i ON b.bill_no = i.bill_no", conn)
-    for _, r in purchases.iterrows():
-        c.execute("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg) VALUES (?, 'PURCHASE', ?, ?, ?, ?)", 
-                  (r['bill_date'], r['bill_no'], r['paddy_type'], r['bags'], r['calculated_weight_kg'] * 100))
-    
-    # 2. Sales (-)
+    # 5. Materialized per-variety stock (kept in step with inventory_log by every write)
+    c.execute("""CREATE TABLE IF NOT EXISTS stock_balances (
+        paddy_type TEXT PRIMARY KEY, bags INTEGER NOT NULL DEFAULT 0, weight_kg REAL NOT NULL DEFAULT 0, 
+        in_weight_kg REAL NOT NULL DEFAULT 0, out_weight_kg REAL NOT NULL DEFAULT 0, 
+        purchase_value REAL NOT NULL DEFAULT 0, purchase_qtl REAL NOT NULL DEFAULT 0);""")
+
+def _add_columns(table, *column_defs):
+    """Migration step adding columns to an existing table, e.g. _add_columns("bills", "vehicle_owner TEXT")."""
+    def step(c):
+        existing = {r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()}
+        for col_def in column_defs:
+            if col_def.split()[0] not in existing: c.execute(f"ALTER TABLE {table} ADD COLUMN {col_def}")
+    return step
+
+def _create_indexes(*index_defs):
+    """Migration step creating indexes given as (name, "table(columns)")."""
+    def step(c):
+        for name, target in index_defs: c.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    return step
+
+# Global search: one FTS5 document per bill, sale, party and processing batch; `ref` is what the
+# screens open it by. rowid = (kind code << SEARCH_KEY_BITS) + source key, so a document is replaced
+# or removed by rowid alone and each kind is one rowid range FTS5 can scan newest-first.
+SEARCH_KINDS = {"PURCHASE": 1, "SALE": 2, "PARTY": 3, "BATCH": 4}
+SEARCH_KEY_BITS = 40
+SEARCH_DOCS = {  # kind -> (source table, key column, SELECT rowid, ref, date, title, detail ... WHERE {where}); source aliased `s`
+    "PURCHASE": ("bills", "bill_no", "SELECT s.bill_no + {base}, s.bill_no, s.bill_date, 'BILL ' || s.bill_no || ' ' || p.party_name, COALESCE(s.lorry_no, '') || ' ' || REPLACE(COALESCE(s.lorry_no, ''), ' ', '') FROM bills s JOIN parties p ON s.party_id = p.party_id WHERE {where}"),
+    "SALE": ("sales_bills", "bill_no", "SELECT s.bill_no + {base}, s.bill_no, s.bill_date, 'SALE ' || s.bill_no || ' ' || p.party_name, COALESCE(s.lorry_no, '') || ' ' || REPLACE(COALESCE(s.lorry_no, ''), ' ', '') FROM sales_bills s JOIN parties p ON s.party_id = p.party_id WHERE {where}"),
+    "PARTY": ("parties", "party_id", "SELECT s.party_id + {base}, s.party_id, '', s.party_name, COALESCE(s.gst_no, '') || ' ' || COALESCE(s.mobile_no, '') FROM parties s WHERE {where}"),
+    "BATCH": ("processing_batches", "batch_id", "SELECT s.batch_id + {base}, s.batch_no, s.date, 'BATCH ' || s.batch_no, (SELECT COALESCE(GROUP_CONCAT(i.paddy_type, ' '), '') FROM processing_batch_items i WHERE i.batch_id = s.batch_id) FROM processing_batches s WHERE {where}"),
+}
+
+def search_rowid_range(kind):
+    """(first, last) rowid of `kind` documents in search_index."""
+    base = SEARCH_KINDS[kind] << SEARCH_KEY_BITS
+    return base, base + (1 << SEARCH_KEY_BITS) - 1
+
+def _index_docs(kind, where, replace=True):
+    """SQL (re-)indexing the `kind` documents whose source rows match `where` (a condition on alias s)."""
+    (table, key, doc), base = SEARCH_DOCS[kind], search_rowid_range(kind)[0]
+    insert = f"INSERT INTO search_index (rowid, ref, date, title, detail) {doc.format(where=where, base=base)};"
+    if not replace: return insert
+    return f"DELETE FROM search_index WHERE rowid IN (SELECT s.{key} + {base} FROM {table} s WHERE {where}); {insert}"
+
+def _unindex_doc(kind, key_expr):
+    return f"DELETE FROM search_index WHERE rowid = {key_expr} + {search_rowid_range(kind)[0]};"
+
+def _search_triggers():
+    """(name, body) of the triggers keeping search_index in step with every write path, bulk import included."""
+    triggers = []
+    for kind, (table, key, _) in SEARCH_DOCS.items():
+        short = table.replace("processing_", "")
+        triggers += [(f"trg_search_{short}_ai", f"AFTER INSERT ON {table} BEGIN {_index_docs(kind, f's.{key} = NEW.{key}', replace=False)} END"),
+                     (f"trg_search_{short}_au", f"AFTER UPDATE ON {table} BEGIN {_unindex_doc(kind, f'OLD.{key}')} {_index_docs(kind, f's.{key} = NEW.{key}')} END"),
+                     (f"trg_search_{short}_ad", f"AFTER DELETE ON {table} BEGIN {_unindex_doc(kind, f'OLD.{key}')} END")]
+    # Bill documents carry the party name; batch documents carry their varieties
+    triggers += [("trg_search_party_rename", "AFTER UPDATE OF party_name ON parties WHEN OLD.party_name IS NOT NEW.party_name BEGIN "
+                  f"{_index_docs('PURCHASE', 's.party_id = NEW.party_id')} {_index_docs('SALE', 's.party_id = NEW.party_id')} END"),
+                 ("trg_search_batch_items_ai", f"AFTER INSERT ON processing_batch_items BEGIN {_index_docs('BATCH', 's.batch_id = NEW.batch_id')} END"),
+                 ("trg_search_batch_items_ad", f"AFTER DELETE ON processing_batch_items BEGIN {_index_docs('BATCH', 's.batch_id = OLD.batch_id')} END")]
+    return triggers
+
+def rebuild_search_index(cursor):
+    """Re-derives every search document from the source tables (call inside a transaction)."""
+    cursor.execute("DELETE FROM search_index")
+    for kind in SEARCH_DOCS: cursor.execute(_index_docs(kind, "1", replace=False))
+
+def _create_search_index(c):
+    """Version 3: FTS5 global search over bills, sales, parties (name, GST, mobile), lorry numbers and batches."""
+    c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(ref UNINDEXED, date UNINDEXED, title, detail, prefix='2 3')")
+    for name, body in _search_triggers(): c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    rebuild_search_index(c)
+
+# Daily rollups: per day x party x variety sums that the report screens read instead of joining raw bills.
+# paddy_type '' rows hold the bill (batch) totals, the other rows the item lines, so bill-level figures
+# (truck weight, net payable, brokerage) are never split across varieties. Every day x variety is also
+# kept summed over all parties under party_id 0 (a mill sees most parties at most once a day, so the
+# per-party rows are nearly as many as the bills); processing has no party and only has those rows.
+ROLLUP_COLUMNS = ("bills", "items", "bags", "weight_kg", "gross", "net", "brokerage", "rate_sum", "moisture_sum", "rate_wt", "moisture_wt")
+ROLLUP_SOURCES = {  # source -> (SELECT day, party_id, paddy_type, <ROLLUP_COLUMNS> for the totals, same for the item lines); header aliased `b`
+    "PURCHASE": ("SELECT b.bill_date, b.party_id, '', 1, 0, b.total_bags, b.final_truck_weight_kg, b.total_gross_amount, b.net_payable, b.brokerage, 0, 0, 0, 0 FROM bills b WHERE {where}",
+                 "SELECT b.bill_date, b.party_id, i.paddy_type, 0, 1, i.bags, i.calculated_weight_kg, i.item_amount, 0, 0, i.base_rate, COALESCE(i.moisture, 0), "
+                 "i.base_rate * i.calculated_weight_kg, COALESCE(i.moisture, 0) * i.calculated_weight_kg FROM bills b JOIN bill_items i ON i.bill_no = b.bill_no WHERE {where}"),
+    "SALE": ("SELECT b.bill_date, b.party_id, '', 1, 0, b.total_bags, b.final_weight_kg, b.total_gross_amount, b.net_payable, b.brokerage, 0, 0, 0, 0 FROM sales_bills b WHERE {where}",
+             "SELECT b.bill_date, b.party_id, i.paddy_type, 0, 1, i.bags, i.weight_kg, i.amount, 0, 0, i.rate, 0, i.rate * i.weight_kg, 0 "
+             "FROM sales_bills b JOIN sales_bill_items i ON i.bill_no = b.bill_no WHERE {where}"),
+    "PROCESS": ("SELECT b.date, 0, '', 1, 0, b.total_input_bags, b.total_input_weight_kg, 0, 0, 0, 0, 0, 0, 0 FROM processing_batches b WHERE {where}",
+                "SELECT b.date, 0, i.paddy_type, 0, 1, i.bags, i.total_weight_kg, 0, 0, 0, 0, 0, 0, 0 "
+                "FROM processing_batches b JOIN processing_batch_items i ON i.batch_id = b.batch_id WHERE {where}"),
+}
+_ROLLUP_CTE = f"WITH u(day, party_id, paddy_type, {', '.join(ROLLUP_COLUMNS)}) AS ({{rows}})"
+
+def _apply_rollup(cursor, source, where, params=(), sign=1):
+    """Adds (sign=1) or backs out (sign=-1) the `source` bills / batches matching `where` (a condition on alias b).
+    Call with sign=-1 before a bill is rewritten and sign=1 once its new items are in, inside the same transaction."""
+    totals, lines = (sql.format(where=where) for sql in ROLLUP_SOURCES[source])
+    cols = ", ".join(ROLLUP_COLUMNS)
+    sums = ", ".join(f"{sign} * SUM({c})" for c in ROLLUP_COLUMNS)
+    cursor.execute(_ROLLUP_CTE.format(rows=f"{totals} UNION ALL {lines}") + f""" INSERT INTO daily_rollup (source, day, party_id, paddy_type, {cols})
+        SELECT * FROM (SELECT '{source}', day, party_id, paddy_type, {sums} FROM u GROUP BY day, party_id, paddy_type
+                       UNION ALL SELECT '{source}', day, 0, paddy_type, {sums} FROM u WHERE party_id <> 0 GROUP BY day, paddy_type) WHERE 1
+        ON CONFLICT DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in ROLLUP_COLUMNS)}""", tuple(params) * 2)
+    if sign < 0:  # drop rows that no longer count anything
+        cursor.execute(_ROLLUP_CTE.format(rows=totals) + f" DELETE FROM daily_rollup WHERE source = '{source}' AND party_id IN (SELECT party_id FROM u UNION SELECT 0) "
+                       "AND day IN (SELECT day FROM u) AND bills = 0 AND items = 0", tuple(params))
+
+def rebuild_daily_rollups(cursor):
+    """Re-derives daily_rollup from every bill and batch (call inside a transaction)."""
+    cursor.execute("DELETE FROM daily_rollup")
+    for source in ROLLUP_SOURCES: _apply_rollup(cursor, source, "1")
+
+def _create_daily_rollups(c):
+    """Version 4: daily_rollup for the report screens, backfilled from the existing bills and batches."""
+    c.execute(f"""CREATE TABLE IF NOT EXISTS daily_rollup (
+        source TEXT NOT NULL, day TEXT NOT NULL, party_id INTEGER NOT NULL, paddy_type TEXT NOT NULL,
+        {', '.join(f"{col} {'INTEGER' if col in ('bills', 'items', 'bags') else 'REAL'} NOT NULL DEFAULT 0" for col in ROLLUP_COLUMNS)},
+        PRIMARY KEY (source, party_id, day, paddy_type)) WITHOUT ROWID;""")
+    rebuild_daily_rollups(c)
+
+# ======================================================================================
+# PARTY AGGREGATES (PARTY DASHBOARD KPIs, ONE ROW PER PARTY x SOURCE x FINANCIAL YEAR)
+# ======================================================================================
+# Same figures as the per-party rows of daily_rollup, summed per financial year. A new bill is added
+# from the same row SELECTs as the rollup (_apply_party_aggregates); an edited bill re-derives the
+# (party, year) rows it left and joined from daily_rollup, an index range, so first / last bill dates
+# stay exact when it moves to another party or date. A year close leaves its rows here while the bills
+# move to the archive, so the KPIs cover the party's whole history.
+
+PARTY_AGGREGATE_COLUMNS = ("bills", "net", "item_weight_kg", "rate_wt", "moisture_wt", "first_date", "last_date")
+_FY_SQL = "CASE WHEN substr({d}, 6, 2) >= '04' THEN substr({d}, 1, 4) || '-' || (substr({d}, 1, 4) + 1) ELSE (substr({d}, 1, 4) - 1) || '-' || substr({d}, 1, 4) END"
+PARTY_AGGREGATE_SOURCE_SQL = f"""SELECT r.party_id, r.source, {_FY_SQL.format(d="r.day")} AS fy, SUM(r.bills), SUM(r.net),
+        SUM(CASE WHEN r.paddy_type <> '' THEN r.weight_kg ELSE 0 END), SUM(r.rate_wt), SUM(r.moisture_wt), MIN(r.day), MAX(r.day)
+    FROM daily_rollup r WHERE r.source IN ('PURCHASE', 'SALE') AND r.party_id <> 0 AND {{where}} GROUP BY r.party_id, r.source, fy"""
+_PARTY_AGGREGATE_INSERT = f"INSERT INTO party_aggregates (party_id, source, financial_year, {', '.join(PARTY_AGGREGATE_COLUMNS)}) "
+
+def _apply_party_aggregates(cursor, source, where, params=()):
+    """Adds the new "PURCHASE" / "SALE" bills matching `where` (a condition on alias b) once their items are in."""
+    totals, lines = (sql.format(where=where) for sql in ROLLUP_SOURCES[source])
+    cursor.execute(_ROLLUP_CTE.format(rows=f"{totals} UNION ALL {lines}") + f""" {_PARTY_AGGREGATE_INSERT}
+        SELECT party_id, '{source}', {_FY_SQL.format(d="day")}, SUM(bills), SUM(net), SUM(CASE WHEN paddy_type <> '' THEN weight_kg ELSE 0 END),
+            SUM(rate_wt), SUM(moisture_wt), MIN(day), MAX(day) FROM u WHERE 1 GROUP BY 1, 3
+        ON CONFLICT DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in PARTY_AGGREGATE_COLUMNS[:-2])},
+            first_date = MIN(first_date, excluded.first_date), last_date = MAX(last_date, excluded.last_date)""", tuple(params) * 2)
+
+def _refresh_party_aggregates(cursor, source, bills):
+    """Re-derives the party_aggregates rows of `source` for the (party_id, bill date) pairs given, from daily_rollup.
+    Call after an edit's _apply_rollup, with the bill's old party and date as well as the new ones."""
+    for party_id, fy in {(party_id, get_financial_year(day)) for party_id, day in bills}:
+        cursor.execute("DELETE FROM party_aggregates WHERE party_id = ? AND source = ? AND financial_year = ?", (party_id, source, fy))
+        cursor.execute(_PARTY_AGGREGATE_INSERT + PARTY_AGGREGATE_SOURCE_SQL.format(where="r.source = ? AND r.party_id = ? AND r.day BETWEEN ? AND ?"),
+                       (source, party_id, *fy_bounds(fy)))
+
+def rebuild_party_aggregates(cursor):
+    """Re-derives the party_aggregates rows of the years still in the live DB (call inside a transaction)."""
+    cursor.execute("DELETE FROM party_aggregates WHERE financial_year NOT IN (SELECT fy FROM year_archives)")
+    cursor.execute(_PARTY_AGGREGATE_INSERT + PARTY_AGGREGATE_SOURCE_SQL.format(where="1"))
+
+def _create_party_aggregates(c):
+    """Version 12: party_aggregates (closed years summed from their archive files) and the (party_id, bill_date)
+    indexes the party's bill history pages through."""
+    _create_indexes(("idx_bills_party_date", "bills(party_id, bill_date)"), ("idx_sales_bills_party_date", "sales_bills(party_id, bill_date)"))(c)
+    c.execute("""CREATE TABLE IF NOT EXISTS party_aggregates (
+        party_id INTEGER NOT NULL, source TEXT NOT NULL, financial_year TEXT NOT NULL, bills INTEGER NOT NULL DEFAULT 0,
+        net REAL NOT NULL DEFAULT 0, item_weight_kg REAL NOT NULL DEFAULT 0, rate_wt REAL NOT NULL DEFAULT 0, moisture_wt REAL NOT NULL DEFAULT 0,
+        first_date TEXT, last_date TEXT, PRIMARY KEY (party_id, source, financial_year)) WITHOUT ROWID;""")
+    for (path,) in c.execute("SELECT path FROM year_archives ORDER BY fy").fetchall():  # ATTACH is not allowed inside the migration's transaction
+        if not os.path.exists(_resolve_archive(path)): continue
+        with closing(sqlite3.connect(Path(_resolve_archive(path)).resolve().as_uri() + "?mode=ro", uri=True)) as archive:
+            rows = archive.execute(PARTY_AGGREGATE_SOURCE_SQL.format(where="1")).fetchall()
+        c.executemany(_PARTY_AGGREGATE_INSERT + f"VALUES ({', '.join('?' * (len(PARTY_AGGREGATE_COLUMNS) + 3))})", rows)
+    rebuild_party_aggregates(c)
+
+@cached_query
+def get_party_kpis(party_id):
+    """One party's lifetime figures (closed years included) from party_aggregates: total_bills, total_business
+    (net payable of its purchases and sales), first_bill_date / last_bill_date (None without bills), and per
+    side purchase_bills / purchase_business / sale_bills / sale_business, avg_rate and avg_moisture of its
+    purchases and avg_sale_rate (weight-weighted)."""
+    rows = {r[0]: r[1:] for r in get_connection().execute("""SELECT source, SUM(bills), SUM(net), SUM(item_weight_kg), SUM(rate_wt),
+        SUM(moisture_wt), MIN(first_date), MAX(last_date) FROM party_aggregates WHERE party_id = ? GROUP BY source""", (party_id,))}
+    empty = (0, 0.0, 0.0, 0.0, 0.0, None, None)
+    (p_bills, p_net, p_wt, p_rate, p_moist, p_first, p_last), (s_bills, s_net, s_wt, s_rate, _, s_first, s_last) = rows.get("PURCHASE", empty), rows.get("SALE", empty)
+    firsts, lasts = [d for d in (p_first, s_first) if d], [d for d in (p_last, s_last) if d]
+    return {"total_bills": p_bills + s_bills, "total_business": p_net + s_net,
+            "first_bill_date": min(firsts) if firsts else None, "last_bill_date": max(lasts) if lasts else None,
+            "purchase_bills": p_bills, "purchase_business": p_net, "sale_bills": s_bills, "sale_business": s_net,
+            "avg_rate": p_rate / p_wt if p_wt else 0.0, "avg_moisture": p_moist / p_wt if p_wt else 0.0,
+            "avg_sale_rate": s_rate / s_wt if s_wt else 0.0}
+
+# Number series handed out on save. Each maps to the SELECT of the highest number already on file
+# (the batch series runs per financial year, bound as ?), so imported or hand-entered numbers are
+# never issued again even if they ran ahead of the sequence row.
+SEQUENCES = {
+    "PURCHASE": "SELECT COALESCE(MAX(bill_no), 0) FROM bills",
+    "SALE": "SELECT COALESCE(MAX(bill_no), 0) FROM sales_bills",
+    "BATCH": "SELECT COALESCE(MAX(batch_seq), 0) FROM processing_batches WHERE financial_year = ?",
+}
+
+def _create_sequences(c):
+    """Version 5: sequences table + numeric processing_batches.batch_seq parsed from the "N/YY-YY" batch numbers."""
+    c.execute("CREATE TABLE IF NOT EXISTS sequences (series TEXT PRIMARY KEY, last_value INTEGER NOT NULL) WITHOUT ROWID;")
+    _add_columns("processing_batches", "batch_seq INTEGER")(c)
+    c.execute("UPDATE processing_batches SET batch_seq = CAST(substr(batch_no, 1, instr(batch_no, '/') - 1) AS INTEGER) WHERE batch_seq IS NULL")
+    c.execute("DROP INDEX IF EXISTS idx_processing_batches_fy")  # covered by the (financial_year, batch_seq) index
+    c.execute("CREATE INDEX IF NOT EXISTS idx_processing_batches_fy_seq ON processing_batches(financial_year, batch_seq)")
+    for series in ("PURCHASE", "SALE"):
+        c.execute(f"INSERT OR IGNORE INTO sequences (series, last_value) VALUES (?, ({SEQUENCES[series]}))", (series,))
+    c.execute("INSERT OR IGNORE INTO sequences (series, last_value) SELECT 'BATCH ' || financial_year, COALESCE(MAX(batch_seq), 0) FROM processing_batches GROUP BY financial_year")
+
+def _create_year_archives(c):
+    """Version 6: registry of closed financial years and the stock they carried into the live DB."""
+    c.execute("""CREATE TABLE IF NOT EXISTS year_archives (
+        fy TEXT PRIMARY KEY, path TEXT NOT NULL, start_date TEXT NOT NULL, end_date TEXT NOT NULL,
+        bills INTEGER NOT NULL DEFAULT 0, sales INTEGER NOT NULL DEFAULT 0, batches INTEGER NOT NULL DEFAULT 0, closed_at TEXT);""")
+    c.execute("""CREATE TABLE IF NOT EXISTS opening_stock (
+        paddy_type TEXT PRIMARY KEY, as_of TEXT NOT NULL, bags INTEGER NOT NULL DEFAULT 0, weight_kg REAL NOT NULL DEFAULT 0,
+        in_weight_kg REAL NOT NULL DEFAULT 0, out_weight_kg REAL NOT NULL DEFAULT 0,
+        purchase_value REAL NOT NULL DEFAULT 0, purchase_qtl REAL NOT NULL DEFAULT 0);""")
+
+# Export change tracking: triggers mark each (source, month) a write touches in export_changes, so the
+# Parquet export (parquet_export.py) rewrites only those months. Item rows are not watched: every write
+# path that changes items also writes their bill / batch row. `changes` counts the marks, so the exporter
+# clears only marks it has read and a save landing mid-export leaves its month marked.
+EXPORT_SOURCES = {"PURCHASE": ("bills", "bill_date"), "SALE": ("sales_bills", "bill_date"),
+                  "PROCESS": ("processing_batches", "date"), "LEDGER": ("inventory_log", "date")}
+
+def _export_triggers():
+    """(name, body) of the triggers filling export_changes."""
+    mark = "INSERT INTO export_changes (source, month) VALUES ('{source}', substr({row}.{col}, 1, 7)) ON CONFLICT DO UPDATE SET changes = changes + 1;"
+    triggers = []
+    for source, (table, col) in EXPORT_SOURCES.items():
+        new, old = mark.format(source=source, row="NEW", col=col), mark.format(source=source, row="OLD", col=col)
+        triggers += [(f"trg_export_{table}_ai", f"AFTER INSERT ON {table} BEGIN {new} END"),
+                     (f"trg_export_{table}_au", f"AFTER UPDATE ON {table} BEGIN {old} {new} END"),
+                     (f"trg_export_{table}_ad", f"AFTER DELETE ON {table} BEGIN {old} END")]
+    return triggers
+
+def _create_export_changes(c):
+    """Version 7: export_changes, the months the Parquet export has to rewrite."""
+    c.execute("""CREATE TABLE IF NOT EXISTS export_changes (
+        source TEXT NOT NULL, month TEXT NOT NULL, changes INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (source, month)) WITHOUT ROWID;""")
+    for name, body in _export_triggers(): c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+def _create_stock_values(c):
+    """Version 8: inventory_log.value_change and stock_balances.stock_value (moving-average cost, see _revalue_stock).
+    Purchases are valued at their bill line, OPENING rows of already closed years at the average purchase rate."""
+    _add_columns("inventory_log", "value_change REAL NOT NULL DEFAULT 0")(c)
+    _add_columns("stock_balances", "stock_value REAL NOT NULL DEFAULT 0")(c)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_inventory_log_paddy_type_date ON inventory_log(paddy_type, type, date)")  # first issue after a date
+    c.execute("""UPDATE inventory_log SET value_change = weight_change_kg / 100 * COALESCE((SELECT SUM(i.item_amount) / SUM(i.calculated_weight_kg)
+        FROM bill_items i WHERE i.bill_no = inventory_log.ref_id AND i.paddy_type = inventory_log.paddy_type AND i.calculated_weight_kg <> 0), 0)
+        WHERE type = 'PURCHASE'""")
+    c.execute("""UPDATE inventory_log SET value_change = MAX(weight_change_kg, 0) / 100 * COALESCE((SELECT o.purchase_value / o.purchase_qtl
+        FROM opening_stock o WHERE o.paddy_type = inventory_log.paddy_type AND o.purchase_qtl <> 0), 0) WHERE type = 'OPENING'""")
+    _revalue_stock(c)
+
+def _create_stock_checkpoints(c):
+    """Version 9: stock_checkpoints, each variety's closing stock per month (see get_stock_as_of)."""
+    c.execute("""CREATE TABLE IF NOT EXISTS stock_checkpoints (
+        paddy_type TEXT NOT NULL, month TEXT NOT NULL, bags INTEGER NOT NULL DEFAULT 0, weight_kg REAL NOT NULL DEFAULT 0,
+        in_weight_kg REAL NOT NULL DEFAULT 0, out_weight_kg REAL NOT NULL DEFAULT 0, stock_value REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (paddy_type, month)) WITHOUT ROWID;""")
+    # years closed before this have no checkpoints: the history starts at the opening stock
+    set_meta(c, "stock_checkpoints_from", c.execute("SELECT COALESCE(substr(MIN(as_of), 1, 7), '') FROM opening_stock").fetchone()[0])
+    rebuild_stock_checkpoints(c)
+
+def _create_latest_prices(c):
+    """Version 10: latest_prices, the newest purchase and sale rate of each variety (see get_latest_prices)."""
+    c.execute("""CREATE TABLE IF NOT EXISTS latest_prices (
+        paddy_type TEXT PRIMARY KEY, rate REAL, bill_no INTEGER, bill_date TEXT,
+        sale_rate REAL, sale_bill_no INTEGER, sale_date TEXT) WITHOUT ROWID;""")
+    rebuild_latest_prices(c)
+
+def _create_market_signals(c):
+    """Version 11: market_signals, the evaluated BUY/HOLD signal of each variety per purchase day (see save_market_signals)."""
+    c.execute(f"""CREATE TABLE IF NOT EXISTS market_signals (
+        paddy_type TEXT NOT NULL, as_of TEXT NOT NULL, {', '.join(f'{col} REAL' if col != 'signal' else 'signal TEXT NOT NULL' for col in MARKET_SIGNAL_COLUMNS)},
+        computed_at TEXT NOT NULL, PRIMARY KEY (paddy_type, as_of)) WITHOUT ROWID;""")
+
+# Append only: each entry is (description, step(cursor)); its position + 1 is the schema version.
+MIGRATIONS = [
+    ("base tables", _create_base_tables),
+    ("report indexes", _create_indexes(
+        ("idx_inventory_log_paddy_date", "inventory_log(paddy_type, date)"),
+        ("idx_inventory_log_type_ref", "inventory_log(type, ref_id)"),
+        ("idx_inventory_log_date", "inventory_log(date)"),
+        ("idx_bills_date", "bills(bill_date)"),
+        ("idx_bill_items_bill", "bill_items(bill_no)"),
+        ("idx_bill_items_paddy", "bill_items(paddy_type)"),
+        ("idx_sales_bills_date", "sales_bills(bill_date)"),
+        ("idx_sales_bill_items_bill", "sales_bill_items(bill_no)"),
+        ("idx_sales_bill_items_paddy", "sales_bill_items(paddy_type)"),
+        ("idx_processing_batches_fy", "processing_batches(financial_year)"),
+        ("idx_processing_batches_date", "processing_batches(date)"),
+        ("idx_processing_batches_no", "processing_batches(batch_no)"),
+        ("idx_processing_batch_items_batch", "processing_batch_items(batch_id)"),
+    )),
+    ("search index", _create_search_index),
+    ("daily rollups", _create_daily_rollups),
+    ("number sequences", _create_sequences),
+    ("year archives", _create_year_archives),
+    ("export change tracking", _create_export_changes),
+    ("moving-average stock value", _create_stock_values),
+    ("monthly stock checkpoints", _create_stock_checkpoints),
+    ("latest prices", _create_latest_prices),
+    ("market signals", _create_market_signals),
+    ("party aggregates", _create_party_aggregates),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate_database():
+    """Applies every pending migration, each in its own transaction. Returns the schema version."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, (desc, step) in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            begin_write(conn, cursor)
+            step(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+            commit(conn)
+        except Exception as e:
+            conn.rollback(); raise RuntimeError(f"Migration {number} ({desc}) failed: {e}") from e
+    if version < SCHEMA_VERSION: cursor.execute("PRAGMA optimize")
+    return SCHEMA_VERSION
+
+# ======================================================================================
+# INVENTORY LEDGER SYNC (SET-BASED, WATERMARKED)
+# ======================================================================================
+
+# ledger type -> (item table, item id column, INSERT ... SELECT deriving the ledger rows).
+# Issues are inserted at value 0; _revalue_stock re-costs them.
+INVENTORY_SOURCES = {
+    "PURCHASE": ("bill_items", "item_id", """INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg, value_change)
+        SELECT b.bill_date, 'PURCHASE', b.bill_no, i.paddy_type, i.bags, i.calculated_weight_kg * 100, i.item_amount
+        FROM bills b JOIN bill_items i ON b.bill_no = i.bill_no"""),
+    "SALE": ("sales_bill_items", "item_id", """INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg)
+        SELECT b.bill_date, 'SALE', b.bill_no, i.paddy_type, -i.bags, -(i.weight_kg * 100)
+        FROM sales_bills b JOIN sales_bill_items i ON b.bill_no = i.bill_no"""),
+    "PROCESS_IN": ("processing_batch_items", "item_id", """INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg)
+        SELECT b.date, 'PROCESS_IN', b.batch_id, i.paddy_type, -i.bags, -i.total_weight_kg
+        FROM processing_batches b JOIN processing_batch_items i ON b.batch_id = i.batch_id"""),
+}
+# ledger type -> SQL counting the source rows the ledger should hold
+INVENTORY_SOURCE_COUNTS = {
+    "PURCHASE": "SELECT COUNT(*) FROM bills b JOIN bill_items i ON b.bill_no = i.bill_no",
+    "SALE": "SELECT COUNT(*) FROM sales_bills b JOIN sales_bill_items i ON b.bill_no = i.bill_no",
+    "PROCESS_IN": "SELECT COUNT(*) FROM processing_batches b JOIN processing_batch_items i ON b.batch_id = i.batch_id",
+}
+# ledger type -> column of the source header that ref_id points at
+INVENTORY_REF_COLUMNS = {"PURCHASE": "bill_no", "SALE": "bill_no", "PROCESS_IN": "batch_id"}
+
+def get_meta(cursor, key, default=None):
+    row = cursor.execute("SELECT value FROM app_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_meta(cursor, key, value):
+    cursor.execute("INSERT INTO app_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+def _source_watermarks(cursor):
+    """Highest item id per ledger source. Edits re-insert items, so new ids mark changed bills."""
+    return {t: cursor.execute(f"SELECT COALESCE(MAX({col}), 0) FROM {table}").fetchone()[0] for t, (table, col, _) in INVENTORY_SOURCES.items()}
+
+def _stored_watermarks(cursor):
+    return {t: int(get_meta(cursor, f"inventory_watermark_{t}", -1)) for t in INVENTORY_SOURCES}
+
+def _store_watermarks(cursor, marks):
+    for t, v in marks.items(): set_meta(cursor, f"inventory_watermark_{t}", v)
+
+def _watermark_is_current(cursor, ledger_type):
+    """True when the ledger source's watermark covers every item line so far. Check before a write adds lines."""
+    table, col, _ = INVENTORY_SOURCES[ledger_type]
+    return int(get_meta(cursor, f"inventory_watermark_{ledger_type}", -1)) == cursor.execute(f"SELECT COALESCE(MAX({col}), 0) FROM {table}").fetchone()[0]
+
+def _advance_watermark(cursor, ledger_type):
+    """Moves the watermark past the item lines a write just added and logged itself, so startup sync skips them."""
+    table, col, _ = INVENTORY_SOURCES[ledger_type]
+    set_meta(cursor, f"inventory_watermark_{ledger_type}", cursor.execute(f"SELECT COALESCE(MAX({col}), 0) FROM {table}").fetchone()[0])
+
+def inventory_is_consistent(cursor):
+    """Cheap check: every ledger type holds exactly one row per source item line."""
+    for t, sql in INVENTORY_SOURCE_COUNTS.items():
+        ledger = cursor.execute("SELECT COUNT(*) FROM inventory_log WHERE type = ?", (t,)).fetchone()[0]
+        if ledger != cursor.execute(sql).fetchone()[0]: return False
+    return True
+
+def _rebuild_all(cursor):
+    cursor.execute(f"DELETE FROM inventory_log WHERE type IN ({','.join('?' * len(INVENTORY_SOURCES))})", tuple(INVENTORY_SOURCES))
+    for _, _, insert_sql in INVENTORY_SOURCES.values(): cursor.execute(insert_sql)
+    _store_watermarks(cursor, _source_watermarks(cursor))
+    rebuild_stock_balances(cursor)
+
+def _rebuild_changed(cursor, since):
+    """Re-derives ledger rows only for bills/batches owning item lines added after the watermark, moving the
+    balances and checkpoints by the rows it replaced. Returns the earliest date touched per variety."""
+    touched = {}
+    for t, (table, col, insert_sql) in INVENTORY_SOURCES.items():
+        ref = INVENTORY_REF_COLUMNS[t]
+        changed = f"SELECT DISTINCT {ref} FROM {table} WHERE {col} > ?"
+        ledger_rows = f"SELECT date, type, paddy_type, bags_change, weight_change_kg, value_change FROM inventory_log WHERE type = ? AND ref_id IN ({changed})"
+        old = cursor.execute(ledger_rows, (t, since[t])).fetchall()
+        cursor.execute(f"DELETE FROM inventory_log WHERE type = ? AND ref_id IN ({changed})", (t, since[t]))
+        cursor.execute(f"{insert_sql} WHERE b.{ref} IN ({changed})", (since[t],))
+        new = cursor.execute(ledger_rows, (t, since[t])).fetchall()
+        for rows, sign in ((old, -1), (new, 1)):
+            for day, _, p_type, bags, weight_kg, value_change in rows:
+                value, qtl = (value_change, weight_kg / 100) if t == 'PURCHASE' else (0, 0)
+                _apply_stock_delta(cursor, t, p_type, sign * bags, sign * weight_kg, sign * value, sign * qtl, sign * value_change)
+                touched[p_type] = min(touched.get(p_type, day), day)
+            _apply_checkpoints(cursor, _checkpoint_deltas(rows, sign))
+        _drop_empty_checkpoints(cursor, _checkpoint_deltas(old))
+    return touched
+
+@writes
+def sync_inventory():
+    """Startup sync. Returns 'skipped', 'incremental' or 'full' depending on the work needed."""
+    conn = get_connection()
     try:
-        sales = pd.read_sql("SELECT b.bill_date, b.bill_no, i.paddy_type, i.bags, i.weight_kg FROM sales_bills b JOIN sales_bill_items i ON b.bill_no = i.bill_no", conn)
-        for _, r in sales.iterrows():
-            c.execute("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg) VALUES (?, 'SALE', ?, ?, ?, ?)", 
-                      (r['bill_date'], r['bill_no'], r['paddy_type'], -r['bags'], -(r['weight_kg'] * 100)))
-    except: pass
+        cursor = begin_write(conn)
+        stored, current = _stored_watermarks(cursor), _source_watermarks(cursor)
+        if stored == current and inventory_is_consistent(cursor): mode = "skipped"
+        else:
+            touched = _rebuild_changed(cursor, stored) if min(stored.values()) >= 0 else None  # no watermark yet: nothing to go by
+            if touched is None or not inventory_is_consistent(cursor): _rebuild_all(cursor); mode = "full"
+            else:
+                _store_watermarks(cursor, current); mode = "incremental"
+                if touched: _revalue_stock(cursor, list(touched), min(touched.values()))  # re-derived issues come in at value 0
+        commit(conn); return mode
+    except Exception as e: conn.rollback(); return f"Error: {e}"
+
+# ======================================================================================
+# STOCK BALANCES (O(VARIETIES) STOCK CHECKS)
+# ======================================================================================
+
+# Closed years are in the ledger as one OPENING row per variety; their in/out weights and purchase
+# value come from opening_stock (see close_financial_year).
+STOCK_BALANCE_SOURCE_SQL = """SELECT l.paddy_type, SUM(l.bags_change), SUM(l.weight_change_kg), 
+        SUM(CASE WHEN l.type = 'PURCHASE' THEN l.weight_change_kg ELSE 0 END) + COALESCE(MAX(o.in_weight_kg), 0), 
+        SUM(CASE WHEN l.type IN ('SALE', 'PROCESS_IN') THEN ABS(l.weight_change_kg) ELSE 0 END) + COALESCE(MAX(o.out_weight_kg), 0), 
+        COALESCE(v.amount, 0) + COALESCE(MAX(o.purchase_value), 0), COALESCE(v.qtl, 0) + COALESCE(MAX(o.purchase_qtl), 0), SUM(l.value_change)
+    FROM inventory_log l 
+    LEFT JOIN (SELECT paddy_type, SUM(item_amount) AS amount, SUM(calculated_weight_kg) AS qtl FROM bill_items GROUP BY paddy_type) v ON v.paddy_type = l.paddy_type 
+    LEFT JOIN opening_stock o ON o.paddy_type = l.paddy_type
+    GROUP BY l.paddy_type"""
+STOCK_BALANCE_COLUMNS = "paddy_type, bags, weight_kg, in_weight_kg, out_weight_kg, purchase_value, purchase_qtl, stock_value"
+
+# Stock value is a perpetual moving average per variety: receipts (PURCHASE, OPENING) add their cost,
+# an issue (SALE, PROCESS_IN) takes out its share of the value at the average cost just before it, and
+# the last issue that empties the stock takes whatever value is left. Each ledger row keeps its
+# value_change, so stock_balances.stock_value is their sum and the SALE / PROCESS_IN rows are the cost
+# of what was sold or milled. A movement posted before later ones changes the cost of the issues after
+# it, so those are re-costed from its date on (_revalue_stock).
+STOCK_ISSUE_TYPES = ("SALE", "PROCESS_IN")
+STOCK_LEDGER_ORDER = "date, type <> 'OPENING', log_id"
+
+def _issue_value(weight_kg, value, change_kg):
+    """value_change of an issue of change_kg (negative) out of weight_kg worth value."""
+    return -value if weight_kg + change_kg <= 0 else value * change_kg / weight_kg
+
+def _revalue_stock(cursor, paddy_types=None, since=""):
+    """Re-costs the issues dated `since` or later in ledger order and stores the varieties' stock_value.
+    Varieties default to all of them. Only the rows from the first issue on or after `since` are read: the
+    stock before them is the stored balance less their sum (since="" starts from zero, for rebuilds)."""
+    if since:  # receipts never change each other's value, so re-costing starts at the first issue
+        firsts = [cursor.execute("SELECT MIN(date) FROM inventory_log WHERE paddy_type = ? AND type = ? AND date >= ?", (p, t, since)).fetchone()[0]
+                  for p in paddy_types or [r[0] for r in cursor.execute("SELECT paddy_type FROM stock_balances").fetchall()] for t in STOCK_ISSUE_TYPES]
+        if not any(firsts): return 0
+        since = min(d for d in firsts if d)
+    varieties, params = "", ()
+    if paddy_types: varieties, params = f" AND paddy_type IN ({','.join('?' * len(paddy_types))})", tuple(paddy_types)
+    rows = cursor.execute(f"""SELECT log_id, date, paddy_type, type, weight_change_kg, value_change FROM inventory_log
+        WHERE date >= ?{varieties} ORDER BY {STOCK_LEDGER_ORDER}""", (since, *params)).fetchall()
+    state = {}
+    if since:
+        state = {p: [w, v] for p, w, v in cursor.execute(f"SELECT paddy_type, weight_kg, stock_value FROM stock_balances WHERE 1{varieties}", params)}
+        for _, _, p_type, _, change_kg, value_change in rows:
+            row = state.setdefault(p_type, [0.0, 0.0]); row[0] -= change_kg; row[1] -= value_change
+    changed, moved = [], {}
+    for log_id, day, p_type, ledger_type, change_kg, value_change in rows:
+        row = state.setdefault(p_type, [0.0, 0.0])
+        if ledger_type in STOCK_ISSUE_TYPES:
+            cost = _issue_value(row[0], row[1], change_kg)
+            if abs(cost - value_change) > 1e-6:
+                changed.append((cost, log_id))
+                moved.setdefault((p_type, day[:7]), [0, 0.0, 0.0, 0.0, 0.0])[4] += cost - value_change
+                value_change = cost
+        row[0] += change_kg; row[1] += value_change
+    cursor.executemany("UPDATE inventory_log SET value_change = ? WHERE log_id = ?", changed)
+    cursor.executemany("UPDATE stock_balances SET stock_value = ? WHERE paddy_type = ?", [(v, p) for p, (_, v) in state.items()])
+    if since: _apply_checkpoints(cursor, moved)  # a full re-cost is followed by rebuild_stock_checkpoints
+    return len(changed)
+
+def _is_backdated(cursor, paddy_type, date):
+    return cursor.execute("SELECT 1 FROM inventory_log WHERE paddy_type = ? AND date > ? LIMIT 1", (paddy_type, date)).fetchone() is not None
+
+def _log_inventory(cursor, date, ledger_type, ref_id, paddy_type, bags, weight_kg, value=0, qtl=0):
+    """Writes one ledger row and moves the variety's stock balance in the same transaction.
+    `value` is a purchase's amount; issues are costed at the current average (see _revalue_stock)."""
+    value_change = value
+    if ledger_type in STOCK_ISSUE_TYPES:
+        value_change = _issue_value(*(cursor.execute("SELECT weight_kg, stock_value FROM stock_balances WHERE paddy_type = ?", (paddy_type,)).fetchone() or (0, 0)), weight_kg)
+    backdated = _is_backdated(cursor, paddy_type, date)
+    cursor.execute("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg, value_change) VALUES (?, ?, ?, ?, ?, ?, ?)", 
+                   (date, ledger_type, ref_id, paddy_type, bags, weight_kg, value_change))
+    _apply_stock_delta(cursor, ledger_type, paddy_type, bags, weight_kg, value, qtl, value_change)
+    _apply_checkpoints(cursor, _checkpoint_deltas([(date, ledger_type, paddy_type, bags, weight_kg, value_change)]))
+    if backdated: _revalue_stock(cursor, [paddy_type], date)
+
+def _apply_stock_delta(cursor, ledger_type, paddy_type, bags, weight_kg, value=0, qtl=0, value_change=0):
+    in_kg = weight_kg if ledger_type == 'PURCHASE' else 0
+    out_kg = -weight_kg if ledger_type in STOCK_ISSUE_TYPES else 0
+    cursor.execute(f"""INSERT INTO stock_balances ({STOCK_BALANCE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) 
+        ON CONFLICT(paddy_type) DO UPDATE SET bags = bags + excluded.bags, weight_kg = weight_kg + excluded.weight_kg, 
+        in_weight_kg = in_weight_kg + excluded.in_weight_kg, out_weight_kg = out_weight_kg + excluded.out_weight_kg, 
+        purchase_value = purchase_value + excluded.purchase_value, purchase_qtl = purchase_qtl + excluded.purchase_qtl,
+        stock_value = stock_value + excluded.stock_value""", 
+        (paddy_type, bags, weight_kg, in_kg, out_kg, value, qtl, value_change))
+
+def _remove_purchase_from_stock(cursor, bill_no):
+    """Backs a purchase bill's items out of the ledger and balances (before the bill is rewritten).
+    Returns the bill's earliest ledger date per variety, for re-costing the issues after it."""
+    for p_type, bags, wt, amt in cursor.execute("SELECT paddy_type, bags, calculated_weight_kg, item_amount FROM bill_items WHERE bill_no=?", (bill_no,)).fetchall():
+        _apply_stock_delta(cursor, 'PURCHASE', p_type, -bags, -(wt * 100), -amt, -wt, -amt)
+    rows = cursor.execute("SELECT date, type, paddy_type, bags_change, weight_change_kg, value_change FROM inventory_log WHERE type='PURCHASE' AND ref_id=?", (bill_no,)).fetchall()
+    _apply_checkpoints(cursor, _checkpoint_deltas(rows, sign=-1))
+    removed = {}
+    for day, _, p_type, *_ in rows: removed[p_type] = min(removed.get(p_type, day), day)
+    cursor.execute("DELETE FROM inventory_log WHERE type='PURCHASE' AND ref_id=?", (bill_no,))
+    _drop_empty_checkpoints(cursor, _checkpoint_deltas(rows))
+    return removed
+
+def rebuild_stock_balances(cursor):
+    """Recomputes stock_balances from inventory_log (bags/weight/value) and bill_items (purchase value), re-costing
+    every issue, and the stock checkpoints with them."""
+    cursor.execute("DELETE FROM stock_balances")
+    cursor.execute(f"INSERT INTO stock_balances ({STOCK_BALANCE_COLUMNS}) {STOCK_BALANCE_SOURCE_SQL}")
+    _revalue_stock(cursor)
+    rebuild_stock_checkpoints(cursor)
+
+# ======================================================================================
+# STOCK CHECKPOINTS (POINT-IN-TIME STOCK)
+# ======================================================================================
+# stock_checkpoints holds each variety's stock at the end of every month it moved in, cumulative
+# (a month without movements has no row: the stock is the previous checkpoint's). Every write moves
+# the checkpoints from its month on, so a save dated today touches one row. The stock on any date is
+# the checkpoint of the month before plus at most one month of ledger rows, however long the history.
+# Closing a year keeps its checkpoints: its OPENING row carries exactly the March checkpoint.
+
+STOCK_CHECKPOINT_COLUMNS = "paddy_type, month, bags, weight_kg, in_weight_kg, out_weight_kg, stock_value"
+STOCK_CHECKPOINT_SOURCE_SQL = """SELECT paddy_type, month, SUM(bags) OVER w, SUM(weight_kg) OVER w, SUM(in_kg) OVER w, SUM(out_kg) OVER w, SUM(value) OVER w
+    FROM (SELECT l.paddy_type, substr(l.date, 1, 7) AS month, SUM(l.bags_change) AS bags, SUM(l.weight_change_kg) AS weight_kg,
+            SUM(CASE WHEN l.type = 'PURCHASE' THEN l.weight_change_kg WHEN l.type = 'OPENING' THEN COALESCE(o.in_weight_kg, 0) ELSE 0 END) AS in_kg,
+            SUM(CASE WHEN l.type IN ('SALE', 'PROCESS_IN') THEN -l.weight_change_kg WHEN l.type = 'OPENING' THEN COALESCE(o.out_weight_kg, 0) ELSE 0 END) AS out_kg,
+            SUM(l.value_change) AS value
+          FROM inventory_log l LEFT JOIN opening_stock o ON o.paddy_type = l.paddy_type AND l.type = 'OPENING'
+          WHERE l.date >= ? GROUP BY l.paddy_type, month)
+    WINDOW w AS (PARTITION BY paddy_type ORDER BY month)"""
+
+def _checkpoint_deltas(rows, sign=1):
+    """{(paddy_type, month): [bags, weight_kg, in_kg, out_kg, value]} of ledger rows (date, type, paddy_type, bags, weight_kg, value_change)."""
+    deltas = {}
+    for day, ledger_type, p_type, bags, weight_kg, value in rows:
+        d = deltas.setdefault((p_type, day[:7]), [0, 0.0, 0.0, 0.0, 0.0])
+        d[0] += sign * bags; d[1] += sign * weight_kg; d[4] += sign * value
+        if ledger_type == 'PURCHASE': d[2] += sign * weight_kg
+        elif ledger_type in STOCK_ISSUE_TYPES: d[3] -= sign * weight_kg
+    return deltas
 
-    # 3. Processing (-)
+def _apply_checkpoints(cursor, deltas):
+    """Moves the checkpoints of each (paddy_type, month) and every later month by its delta."""
+    for (p_type, month), d in deltas.items():
+        if not cursor.execute("SELECT 1 FROM stock_checkpoints WHERE paddy_type = ? AND month = ?", (p_type, month)).fetchone():
+            prev = cursor.execute("""SELECT bags, weight_kg, in_weight_kg, out_weight_kg, stock_value FROM stock_checkpoints
+                WHERE paddy_type = ? AND month < ? ORDER BY month DESC LIMIT 1""", (p_type, month)).fetchone() or (0, 0.0, 0.0, 0.0, 0.0)
+            cursor.execute(f"INSERT INTO stock_checkpoints ({STOCK_CHECKPOINT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", (p_type, month, *prev))
+        cursor.execute("""UPDATE stock_checkpoints SET bags = bags + ?, weight_kg = weight_kg + ?, in_weight_kg = in_weight_kg + ?,
+            out_weight_kg = out_weight_kg + ?, stock_value = stock_value + ? WHERE paddy_type = ? AND month >= ?""", (*d, p_type, month))
+
+def _drop_empty_checkpoints(cursor, months):
+    """Deletes the checkpoints of the (paddy_type, month) keys whose ledger rows were all backed out, as a rebuild has none."""
+    cursor.executemany("""DELETE FROM stock_checkpoints WHERE paddy_type = ? AND month = ? AND NOT EXISTS
+        (SELECT 1 FROM inventory_log WHERE paddy_type = ? AND date BETWEEN ? AND ?)""", [(p, m, p, f"{m}-01", f"{m}-31") for p, m in months])
+
+def rebuild_stock_checkpoints(cursor):
+    """Recomputes the checkpoints from the live ledger. Those of closed years (before the opening stock) are kept."""
+    start = cursor.execute("SELECT COALESCE(MIN(as_of), '') FROM opening_stock").fetchone()[0]
+    cursor.execute("DELETE FROM stock_checkpoints WHERE month >= ?", (start[:7],))
+    cursor.execute(f"INSERT INTO stock_checkpoints ({STOCK_CHECKPOINT_COLUMNS}) {STOCK_CHECKPOINT_SOURCE_SQL}", (start,))
+
+@cached_query
+def get_stock_as_of(date_str):
+    """get_inventory_summary() as it stood at the end of `date_str` ("YYYY-MM-DD"), or "Error: ...".
+
+    Each variety's checkpoint of the month before, plus the ledger rows of the date's month up to it
+    (read from the archive when that year is closed)."""
+    try: datetime.strptime(date_str, "%Y-%m-%d")
+    except (TypeError, ValueError): return f"Error: Not a date: {date_str}"
+    conn = get_connection()
+    month = date_str[:7]
+    covered = get_meta(conn.cursor(), "stock_checkpoints_from", "")
+    if month < covered: return f"Error: No stock history before {covered} (earlier years were closed before stock checkpoints existed)"
+    stock = {r[0]: list(r[1:]) for r in conn.execute("""SELECT c.paddy_type, c.bags, c.weight_kg, c.in_weight_kg, c.out_weight_kg, c.stock_value
+        FROM stock_checkpoints c WHERE c.month = (SELECT MAX(month) FROM stock_checkpoints WHERE paddy_type = c.paddy_type AND month < ?)""", (month,))}
+    opening = {r[0]: r[1:] for r in conn.execute("SELECT paddy_type, in_weight_kg, out_weight_kg FROM opening_stock")}
+    sql, n = _over_years("SELECT date, type, paddy_type, bags_change, weight_change_kg, value_change FROM {s}.inventory_log WHERE date BETWEEN ? AND ?", f"{month}-01", date_str)
+    rows = conn.execute(sql, (f"{month}-01", date_str) * n).fetchall()
+    for row in rows:  # an OPENING row restates the checkpoint before it; it only counts where there is none
+        if row[1] != 'OPENING': continue
+        if row[2] not in stock: stock[row[2]] = [row[3], row[4], *opening.get(row[2], (0.0, 0.0)), row[5]]
+    for (p_type, _), d in _checkpoint_deltas(r for r in rows if r[1] != 'OPENING').items():
+        s = stock.setdefault(p_type, [0, 0.0, 0.0, 0.0, 0.0])
+        for i, v in enumerate(d): s[i] += v
+    df = pd.DataFrame([(p, s[2], s[3], s[1], s[0], s[4] * 100 / s[1] if s[1] > 0 else 0, int(round(s[4]))) for p, s in sorted(stock.items())],
+                      columns=["paddy_type", "total_in_kg", "total_out_kg", "current_stock_kg", "current_bags", "avg_rate", "stock_value"])
+    return df
+
+@writes
+def verify_stock_balances(repair=False):
+    """Compares stock_balances with a full recompute. Returns [(paddy_type, stored, expected), ...]."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    expected = {r[0]: r[1:] for r in cursor.execute(STOCK_BALANCE_SOURCE_SQL).fetchall()}
+    stored = {r[0]: r[1:] for r in cursor.execute(f"SELECT {STOCK_BALANCE_COLUMNS} FROM stock_balances").fetchall()}
+    mismatches = []
+    for p_type in sorted(set(expected) | set(stored)):
+        exp, got = expected.get(p_type), stored.get(p_type)
+        if exp is None or got is None or any(abs((a or 0) - (b or 0)) > 0.01 for a, b in zip(exp, got)):
+            mismatches.append((p_type, got, exp))
+    if mismatches and repair:
+        begin_write(conn, cursor); rebuild_stock_balances(cursor); commit(conn)
+    return mismatches
+
+@writes
+def rebuild_inventory_from_bills():
+    """Wipes inventory log and recalculates everything to fix sync issues (maintenance command)."""
+    conn = get_connection()
     try:
-        proc = pd.read_sql("SELECT b.date, b.batch_id, i.paddy_type, i.bags, i.total_weight_kg FROM processing_batches b JOIN processing_batch_items i ON b.batch_id = i.batch_id", conn)
-        for _, r in proc.iterrows():
-             c.execute("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg) VALUES (?, 'PROCESS_IN', ?, ?, ?, ?)", 
-                       (r['date'], r['batch_id'], r['paddy_type'], -r['bags'], -r['total_weight_kg']))
-    except: pass
-    
-    conn.commit()
-    conn.close()
+        cursor = begin_write(conn)
+        _rebuild_all(cursor)
+        commit(conn); return "full"
+    except Exception as e: conn.rollback(); return f"Error: {e}"
 
 # ======================================================================================
 # MASTER FUNCTIONS
@@ -135,103 +934,159 @@ def add_party(name, gst, mobile, address):
 def update_party(pid, name, gst, mobile, address):
     return execute_query("UPDATE parties SET party_name=?, gst_no=?, mobile_no=?, address=? WHERE party_id=?", (name, gst, mobile, address, pid))
 def delete_party(pid): return execute_query("DELETE FROM parties WHERE party_id=?", (pid,))
+@cached_query
 def get_all_parties(): return execute_query("SELECT * FROM parties ORDER BY party_name", fetch="all")
+@cached_query
 def get_party_details(pid): return execute_query("SELECT * FROM parties WHERE party_id=?", (pid,), fetch="one")
 def add_paddy_variety(name, rate): return execute_query("INSERT INTO paddy_varieties (variety_name, default_brokerage_rate) VALUES (?,?)", (name, rate))
 def update_paddy_variety(vid, name, rate): return execute_query("UPDATE paddy_varieties SET variety_name=?, default_brokerage_rate=? WHERE variety_id=?", (name, rate, vid))
+@cached_query
 def get_all_paddy_varieties(): return execute_query("SELECT * FROM paddy_varieties ORDER BY variety_name", fetch="all")
 
 # ======================================================================================
 # BILLING & TRANSACTION FUNCTIONS (STOCK VALIDATION ADDED)
 # ======================================================================================
 
-def get_next_bill_number(): 
-    res = execute_query("SELECT MAX(bill_no) FROM bills", fetch="one")
-    return (res[0] or 0) + 1 if res else 1
-def get_next_sales_bill_number(): 
-    res = execute_query("SELECT MAX(bill_no) FROM sales_bills", fetch="one")
-    return (res[0] or 0) + 1 if res else 1
+def _sequence_key(series, fy=None):
+    if series not in SEQUENCES: raise ValueError(f"Unknown number series: {series}")
+    return (f"{series} {fy}", (fy,)) if series == "BATCH" else (series, ())
+
+def allocate_number(cursor, series, fy=None, count=1, floor=0):
+    """Takes the next `count` numbers of a series (see SEQUENCES) and returns the first.
+    Call inside the saving BEGIN IMMEDIATE transaction: two counters can never get the same number,
+    and a save that rolls back gives its number back. `floor` = highest number known to be taken."""
+    key, params = _sequence_key(series, fy)
+    return cursor.execute(f"""INSERT INTO sequences (series, last_value) VALUES (?, MAX(({SEQUENCES[series]}), ?) + ?)
+        ON CONFLICT(series) DO UPDATE SET last_value = MAX(last_value, excluded.last_value - ?) + ? RETURNING last_value""",
+        (key, *params, floor, count, count, count)).fetchone()[0] - count + 1
+
+def preview_number(series, fy=None):
+    """Number the next save of a series will most likely get. Not reserved: the forms show it, the save allocates."""
+    key, params = _sequence_key(series, fy)
+    res = execute_query(f"SELECT MAX(COALESCE((SELECT last_value FROM sequences WHERE series = ?), 0), ({SEQUENCES[series]})) + 1", (key, *params), fetch="one")
+    return res[0] if res else 1
+
+def get_next_bill_number(): return preview_number("PURCHASE")
+def get_next_sales_bill_number(): return preview_number("SALE")
 
 def get_paddy_avg_weight(paddy_type):
     """Returns (Total Bags, Total Weight KG, Avg Weight KG) for checking stock."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    res = conn.execute("SELECT SUM(bags_change), SUM(weight_change_kg) FROM inventory_log WHERE paddy_type = ?", (paddy_type,)).fetchone()
-    conn.close()
+    res = execute_query("SELECT bags, weight_kg FROM stock_balances WHERE paddy_type = ?", (paddy_type,), fetch="one") or (0, 0)
     bags = res[0] or 0; weight = res[1] or 0
     if bags > 0: return bags, weight, weight / bags
     return 0, 0, 0
 
-def add_bill(header, items):
-    """Saves Purchase Bill (+)"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    try:
-        cursor = conn.cursor(); cursor.execute("BEGIN TRANSACTION")
-        cursor.execute("SELECT party_id FROM parties WHERE party_name = ?", (header['party_name'],))
-        row = cursor.fetchone()
-        party_id = row[0] if row else execute_query("INSERT INTO parties (party_name) VALUES (?)", (header['party_name'],))
-        
-        cursor.execute("""INSERT INTO bills (bill_no, party_id, bill_date, lorry_no, total_bags, truck_weight1_kg, truck_weight2_kg, truck_weight3_kg, final_truck_weight_kg, total_gross_amount, discount_percent, brokerage, hamali, others_desc, others_amount, net_payable, avg_pack_size_kg) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", 
-                       (header['bill_no'], party_id, header['date'], header['lorry_no'], header['total_bags'], header['truck_weight1_kg'], header['truck_weight2_kg'], header['truck_weight3_kg'], header['final_truck_weight_kg'], header['total_gross_amount'], header['discount_percent'], header['brokerage'], header['hamali'], header['others_desc'], header['others_amount'], header['net_payable'], 0))
+# The save paths are written as transaction bodies, body(cursor, *args), which raise on failure.
+# _run_write runs one in its own transaction, or hands it to the single writer thread when
+# write_queue has been started (several saves then share one group commit).
+_writer = None  # write_queue.submit while the writer thread runs
 
-        for i in items:
-            cursor.execute("""INSERT INTO bill_items (bill_no, paddy_type, bags, moisture, base_rate, calculated_rate, calculated_weight_kg, item_amount) VALUES (?,?,?,?,?,?,?,?)""", 
-                           (header['bill_no'], i['paddy_type'], i['bags'], i['moisture'], i['base_rate'], i['calculated_rate'], i['calculated_weight_kg'], i['item_amount']))
-            cursor.execute("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg) VALUES (?, 'PURCHASE', ?, ?, ?, ?)", 
-                           (header['date'], header['bill_no'], i['paddy_type'], i['bags'], i['calculated_weight_kg'] * 100))
-        conn.commit(); return header['bill_no']
+def _run_write(body, *args):
+    """Runs a save body and returns its result, or "Error: ..." (nothing of it is kept)."""
+    if _writer is not None: return _writer(body, args).result()
+    conn = get_connection()
+    try:
+        cursor = begin_write(conn)
+        result = body(cursor, *args)
+        commit(conn); return result
     except Exception as e: conn.rollback(); return f"Error: {e}"
-    finally: conn.close()
 
-def add_sales_bill(header, items):
-    """Saves Sales Bill (-) with STOCK CHECK"""
-    # 1. Validate Stock First
+@writes
+def add_bill(header, items):
+    """Saves Purchase Bill (+). A falsy header['bill_no'] takes the next number of the series; returns the bill no."""
+    return _run_write(_add_bill, header, items)
+
+def _add_bill(cursor, header, items):
+    in_sync = _watermark_is_current(cursor, "PURCHASE")
+    if not header.get('bill_no'): header = dict(header, bill_no=allocate_number(cursor, "PURCHASE"))
+    cursor.execute("SELECT party_id FROM parties WHERE party_name = ?", (header['party_name'],))
+    row = cursor.fetchone()
+    party_id = row[0] if row else cursor.execute("INSERT INTO parties (party_name) VALUES (?)", (header['party_name'],)).lastrowid
+    
+    cursor.execute("""INSERT INTO bills (bill_no, party_id, bill_date, lorry_no, total_bags, truck_weight1_kg, truck_weight2_kg, truck_weight3_kg, final_truck_weight_kg, total_gross_amount, discount_percent, brokerage, hamali, others_desc, others_amount, net_payable, avg_pack_size_kg) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", 
+                   (header['bill_no'], party_id, header['date'], header['lorry_no'], header['total_bags'], header['truck_weight1_kg'], header['truck_weight2_kg'], header['truck_weight3_kg'], header['final_truck_weight_kg'], header['total_gross_amount'], header['discount_percent'], header['brokerage'], header['hamali'], header['others_desc'], header['others_amount'], header['net_payable'], 0))
+
     for i in items:
-        curr_bags, _, _ = get_paddy_avg_weight(i['paddy_type'])
-        if curr_bags < i['bags']:
-            return f"Error: Insufficient stock for {i['paddy_type']}.\nAvailable: {curr_bags} Bags\nRequired: {i['bags']} Bags"
+        cursor.execute("""INSERT INTO bill_items (bill_no, paddy_type, bags, moisture, base_rate, calculated_rate, calculated_weight_kg, item_amount) VALUES (?,?,?,?,?,?,?,?)""", 
+                       (header['bill_no'], i['paddy_type'], i['bags'], i['moisture'], i['base_rate'], i['calculated_rate'], i['calculated_weight_kg'], i['item_amount']))
+        _log_inventory(cursor, header['date'], 'PURCHASE', header['bill_no'], i['paddy_type'], i['bags'], i['calculated_weight_kg'] * 100, i['item_amount'], i['calculated_weight_kg'])
+    _note_prices(cursor, "PURCHASE", [(i['paddy_type'], i['base_rate'], header['bill_no'], header['date']) for i in items])
+    _apply_rollup(cursor, "PURCHASE", "b.bill_no = ?", (header['bill_no'],))
+    _apply_party_aggregates(cursor, "PURCHASE", "b.bill_no = ?", (header['bill_no'],))
+    if in_sync: _advance_watermark(cursor, "PURCHASE")
+    return header['bill_no']
 
-    # 2. Proceed if Valid
-    conn = sqlite3.connect(DATABASE_FILE)
-    try:
-        cursor = conn.cursor(); cursor.execute("BEGIN TRANSACTION")
-        cursor.execute("SELECT party_id FROM parties WHERE party_name = ?", (header['party_name'],))
-        row = cursor.fetchone()
-        party_id = row[0] if row else execute_query("INSERT INTO parties (party_name) VALUES (?)", (header['party_name'],))
-        
-        cursor.execute("""INSERT INTO sales_bills (bill_no, party_id, bill_date, lorry_no, total_bags, final_weight_kg, total_gross_amount, discount_percent, brokerage, hamali, others_desc, others_amount, net_payable) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", 
-                       (header['bill_no'], party_id, header['date'], header['lorry_no'], header['total_bags'], header['final_weight_kg'], header['total_gross_amount'], header['discount_percent'], header['brokerage'], header['hamali'], header['others_desc'], header['others_amount'], header['net_payable']))
+class StockError(Exception):
+    """Raised inside a write transaction when stock cannot cover the requested bags."""
 
-        for i in items:
-            cursor.execute("""INSERT INTO sales_bill_items (bill_no, paddy_type, bags, rate, weight_kg, amount) VALUES (?,?,?,?,?,?)""", 
-                           (header['bill_no'], i['paddy_type'], i['bags'], i['rate'], i['calculated_weight_kg'], i['item_amount']))
-            cursor.execute("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg) VALUES (?, 'SALE', ?, ?, ?, ?)", 
-                           (header['date'], header['bill_no'], i['paddy_type'], -i['bags'], -(i['calculated_weight_kg'] * 100)))
-        conn.commit(); return header['bill_no']
-    except Exception as e: conn.rollback(); return f"Error: {e}"
-    finally: conn.close()
+def _lock_and_check_stock(cursor, items):
+    """Validates all requested varieties with one grouped query. Call right after BEGIN IMMEDIATE,
+    so no other counter can draw on the same stock until we commit.
+    Returns {paddy_type: (bags, weight_kg, avg_weight_kg)}."""
+    requested = {}
+    for i in items: requested[i['paddy_type']] = requested.get(i['paddy_type'], 0) + i['bags']
+    marks = ",".join("?" * len(requested))
+    rows = cursor.execute(f"SELECT paddy_type, bags, weight_kg FROM stock_balances WHERE paddy_type IN ({marks})", tuple(requested)).fetchall()
+    stock = {p: (b or 0, w or 0, (w or 0) / b if b and b > 0 else 0) for p, b, w in rows}
+    for p_type, bags in requested.items():
+        curr_bags = stock.get(p_type, (0, 0, 0))[0]
+        if curr_bags < bags: raise StockError(f"Insufficient stock for {p_type}.\nAvailable: {curr_bags} Bags\nRequired: {bags} Bags")
+    return stock
+
+@writes
+def add_sales_bill(header, items):
+    """Saves Sales Bill (-) with STOCK CHECK (inside the write lock). A falsy header['bill_no'] takes the next number."""
+    return _run_write(_add_sales_bill, header, items)
 
+def _add_sales_bill(cursor, header, items):
+    _lock_and_check_stock(cursor, items)
+    in_sync = _watermark_is_current(cursor, "SALE")
+    if not header.get('bill_no'): header = dict(header, bill_no=allocate_number(cursor, "SALE"))
+    cursor.execute("SELECT party_id FROM parties WHERE party_name = ?", (header['party_name'],))
+    row = cursor.fetchone()
+    party_id = row[0] if row else cursor.execute("INSERT INTO parties (party_name) VALUES (?)", (header['party_name'],)).lastrowid
+    
+    cursor.execute("""INSERT INTO sales_bills (bill_no, party_id, bill_date, lorry_no, total_bags, final_weight_kg, total_gross_amount, discount_percent, brokerage, hamali, others_desc, others_amount, net_payable) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", 
+                   (header['bill_no'], party_id, header['date'], header['lorry_no'], header['total_bags'], header['final_weight_kg'], header['total_gross_amount'], header['discount_percent'], header['brokerage'], header['hamali'], header['others_desc'], header['others_amount'], header['net_payable']))
+
+    for i in items:
+        cursor.execute("""INSERT INTO sales_bill_items (bill_no, paddy_type, bags, rate, weight_kg, amount) VALUES (?,?,?,?,?,?)""", 
+                       (header['bill_no'], i['paddy_type'], i['bags'], i['rate'], i['calculated_weight_kg'], i['item_amount']))
+        _log_inventory(cursor, header['date'], 'SALE', header['bill_no'], i['paddy_type'], -i['bags'], -(i['calculated_weight_kg'] * 100))
+    _note_prices(cursor, "SALE", [(i['paddy_type'], i['rate'], header['bill_no'], header['date']) for i in items])
+    _apply_rollup(cursor, "SALE", "b.bill_no = ?", (header['bill_no'],))
+    _apply_party_aggregates(cursor, "SALE", "b.bill_no = ?", (header['bill_no'],))
+    if in_sync: _advance_watermark(cursor, "SALE")
+    return header['bill_no']
+
+@writes
 def update_bill(original_bill_no, header, items):
-    conn = sqlite3.connect(DATABASE_FILE)
-    try:
-        cursor = conn.cursor(); cursor.execute("BEGIN TRANSACTION")
-        cursor.execute("SELECT party_id FROM parties WHERE party_name = ?", (header['party_name'],))
-        row = cursor.fetchone()
-        party_id = row[0] if row else execute_query("INSERT INTO parties (party_name) VALUES (?)", (header['party_name'],))
-        
-        cursor.execute("""UPDATE bills SET party_id=?, bill_date=?, lorry_no=?, total_bags=?, truck_weight1_kg=?, truck_weight2_kg=?, truck_weight3_kg=?, final_truck_weight_kg=?, total_gross_amount=?, discount_percent=?, brokerage=?, hamali=?, others_desc=?, others_amount=?, net_payable=?, avg_pack_size_kg=? WHERE bill_no=?""", 
-            (party_id, header['date'], header['lorry_no'], header['total_bags'], header['truck_weight1_kg'], header['truck_weight2_kg'], header['truck_weight3_kg'], header['final_truck_weight_kg'], header['total_gross_amount'], header['discount_percent'], header['brokerage'], header['hamali'], header['others_desc'], header['others_amount'], header['net_payable'], 0, original_bill_no))
+    return _run_write(_update_bill, original_bill_no, header, items)
 
-        cursor.execute("DELETE FROM bill_items WHERE bill_no=?", (original_bill_no,))
-        cursor.execute("DELETE FROM inventory_log WHERE type='PURCHASE' AND ref_id=?", (original_bill_no,))
+def _update_bill(cursor, original_bill_no, header, items):
+    in_sync = _watermark_is_current(cursor, "PURCHASE")
+    cursor.execute("SELECT party_id FROM parties WHERE party_name = ?", (header['party_name'],))
+    row = cursor.fetchone()
+    party_id = row[0] if row else cursor.execute("INSERT INTO parties (party_name) VALUES (?)", (header['party_name'],)).lastrowid
+    _apply_rollup(cursor, "PURCHASE", "b.bill_no = ?", (original_bill_no,), sign=-1)
+    moved_from = cursor.execute("SELECT party_id, bill_date FROM bills WHERE bill_no = ?", (original_bill_no,)).fetchall()
+    
+    cursor.execute("""UPDATE bills SET party_id=?, bill_date=?, lorry_no=?, total_bags=?, truck_weight1_kg=?, truck_weight2_kg=?, truck_weight3_kg=?, final_truck_weight_kg=?, total_gross_amount=?, discount_percent=?, brokerage=?, hamali=?, others_desc=?, others_amount=?, net_payable=?, avg_pack_size_kg=? WHERE bill_no=?""", 
+        (party_id, header['date'], header['lorry_no'], header['total_bags'], header['truck_weight1_kg'], header['truck_weight2_kg'], header['truck_weight3_kg'], header['final_truck_weight_kg'], header['total_gross_amount'], header['discount_percent'], header['brokerage'], header['hamali'], header['others_desc'], header['others_amount'], header['net_payable'], 0, original_bill_no))
 
-        for i in items:
-            cursor.execute("""INSERT INTO bill_items (bill_no, paddy_type, bags, moisture, base_rate, calculated_rate, calculated_weight_kg, item_amount) VALUES (?,?,?,?,?,?,?,?)""", 
-                (original_bill_no, i['paddy_type'], i['bags'], i['moisture'], i['base_rate'], i['calculated_rate'], i['calculated_weight_kg'], i['item_amount']))
-            cursor.execute("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg) VALUES (?, 'PURCHASE', ?, ?, ?, ?)", 
-                (header['date'], original_bill_no, i['paddy_type'], i['bags'], i['calculated_weight_kg'] * 100))
-        conn.commit(); return original_bill_no
-    except Exception as e: conn.rollback(); return f"Error: {e}"
-    finally: conn.close()
+    removed = _remove_purchase_from_stock(cursor, original_bill_no)
+    cursor.execute("DELETE FROM bill_items WHERE bill_no=?", (original_bill_no,))
+
+    for i in items:
+        cursor.execute("""INSERT INTO bill_items (bill_no, paddy_type, bags, moisture, base_rate, calculated_rate, calculated_weight_kg, item_amount) VALUES (?,?,?,?,?,?,?,?)""", 
+            (original_bill_no, i['paddy_type'], i['bags'], i['moisture'], i['base_rate'], i['calculated_rate'], i['calculated_weight_kg'], i['item_amount']))
+        _log_inventory(cursor, header['date'], 'PURCHASE', original_bill_no, i['paddy_type'], i['bags'], i['calculated_weight_kg'] * 100, i['item_amount'], i['calculated_weight_kg'])
+    if removed: _revalue_stock(cursor, list(removed), min(removed.values()))  # issues after the old lines lost or changed their cost
+    _refresh_latest_prices(cursor, "PURCHASE", set(removed) | {i['paddy_type'] for i in items})
+    _apply_rollup(cursor, "PURCHASE", "b.bill_no = ?", (original_bill_no,))
+    _refresh_party_aggregates(cursor, "PURCHASE", moved_from + [(party_id, header['date'])])
+    if in_sync: _advance_watermark(cursor, "PURCHASE")
+    return original_bill_no
 
 # ======================================================================================
 # PROCESSING & REPORTING
@@ -241,104 +1096,601 @@ def get_financial_year(date_str):
     dt = datetime.strptime(date_str, "%Y-%m-%d")
     return f"{dt.year}-{dt.year + 1}" if dt.month >= 4 else f"{dt.year - 1}-{dt.year}"
 
+def format_batch_no(seq, fy):
+    """Batch number as printed: 7 in FY 2024-2025 -> "7/24-25"."""
+    return f"{seq}/{fy[2:4]}-{fy[7:9]}"
+
 def get_next_batch_number(date_str):
+    """Preview of the next batch number in the date's financial year. Returns (batch_no, error)."""
     fy = get_financial_year(date_str)
-    # UNLIMITED BATCHES PER DAY (Check Removed)
-    
-    conn = sqlite3.connect(DATABASE_FILE); cursor = conn.cursor()
-    cursor.execute("SELECT batch_no FROM processing_batches WHERE financial_year = ?", (fy,)); rows = cursor.fetchall(); conn.close()
-    max_num = 0
-    for r in rows:
-        try: num = int(r[0].split('/')[0]); max_num = max(max_num, num)
-        except: pass
-    short_fy = fy[2:4] + "-" + fy[7:9]; return f"{max_num + 1}/{short_fy}", None
+    return format_batch_no(preview_number("BATCH", fy), fy), None
 
+@writes
 def add_processing_batch(date_str, items_list):
-    """Saves Batch with STOCK CHECK"""
-    batch_no, error = get_next_batch_number(date_str)
-    if error: return error
-    
-    total_batch_bags, total_batch_weight, processed_items = 0, 0, []
+    """Saves Batch with STOCK CHECK (inside the write lock)"""
+    return _run_write(_add_processing_batch, date_str, items_list)
+
+def _add_processing_batch(cursor, date_str, items_list):
+    fy = get_financial_year(date_str)
 
-    # 1. Check Stock
+    # 1. Check Stock (one grouped lookup for every variety in the batch)
+    stock = _lock_and_check_stock(cursor, items_list)
+    in_sync = _watermark_is_current(cursor, "PROCESS_IN")
+    total_batch_bags, total_batch_weight, processed_items = 0, 0, []
     for i in items_list:
         p_type = i['paddy_type']; bags = i['bags']
-        curr_bags, curr_wt, avg_wt = get_paddy_avg_weight(p_type)
-        if curr_bags < bags: return f"Error: Insufficient stock for {p_type}.\nAvailable: {curr_bags} Bags\nRequired: {bags} Bags"
-        if avg_wt <= 0: return f"Error: Invalid weight data for {p_type}. Check Inventory."
+        avg_wt = stock[p_type][2]
+        if avg_wt <= 0: raise StockError(f"Invalid weight data for {p_type}. Check Inventory.")
         item_weight = bags * avg_wt
         total_batch_bags += bags; total_batch_weight += item_weight
         processed_items.append({'paddy_type': p_type, 'bags': bags, 'avg_wt': avg_wt, 'total_wt': item_weight})
 
-    fy = get_financial_year(date_str)
-    conn = sqlite3.connect(DATABASE_FILE)
-    try:
-        cursor = conn.cursor(); cursor.execute("BEGIN TRANSACTION")
-        cursor.execute("INSERT INTO processing_batches (batch_no, date, financial_year, total_input_bags, total_input_weight_kg) VALUES (?, ?, ?, ?, ?)", (batch_no, date_str, fy, total_batch_bags, total_batch_weight))
-        batch_id = cursor.lastrowid
-        for item in processed_items:
-            cursor.execute("INSERT INTO processing_batch_items (batch_id, paddy_type, bags, avg_weight_kg, total_weight_kg) VALUES (?, ?, ?, ?, ?)", (batch_id, item['paddy_type'], item['bags'], item['avg_wt'], item['total_wt']))
-            cursor.execute("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg) VALUES (?, 'PROCESS_IN', ?, ?, ?, ?)", (date_str, batch_id, item['paddy_type'], -item['bags'], -item['total_wt']))
-        conn.commit(); return f"Batch {batch_no} Started Successfully!"
-    except Exception as e: conn.rollback(); return f"Error: {e}"
-    finally: conn.close()
+    batch_seq = allocate_number(cursor, "BATCH", fy); batch_no = format_batch_no(batch_seq, fy)
+    cursor.execute("INSERT INTO processing_batches (batch_no, batch_seq, date, financial_year, total_input_bags, total_input_weight_kg) VALUES (?, ?, ?, ?, ?, ?)", (batch_no, batch_seq, date_str, fy, total_batch_bags, total_batch_weight))
+    batch_id = cursor.lastrowid
+    for item in processed_items:
+        cursor.execute("INSERT INTO processing_batch_items (batch_id, paddy_type, bags, avg_weight_kg, total_weight_kg) VALUES (?, ?, ?, ?, ?)", (batch_id, item['paddy_type'], item['bags'], item['avg_wt'], item['total_wt']))
+        _log_inventory(cursor, date_str, 'PROCESS_IN', batch_id, item['paddy_type'], -item['bags'], -item['total_wt'])
+    _apply_rollup(cursor, "PROCESS", "b.batch_id = ?", (batch_id,))
+    if in_sync: _advance_watermark(cursor, "PROCESS_IN")
+    return f"Batch {batch_no} Started Successfully!"
+
+# ======================================================================================
+# BULK HISTORICAL IMPORT
+# ======================================================================================
+
+IMPORT_CHUNK_SIZE = 5000  # bills per transaction
+
+# kind -> (header table, item table, ledger type, header columns, item columns)
+IMPORT_TARGETS = {
+    "purchase": ("bills", "bill_items", "PURCHASE",
+                 ("bill_no", "party_id", "bill_date", "lorry_no", "total_bags", "truck_weight1_kg", "truck_weight2_kg", "truck_weight3_kg", "final_truck_weight_kg", "total_gross_amount", "discount_percent", "brokerage", "hamali", "others_desc", "others_amount", "net_payable", "avg_pack_size_kg"),
+                 ("bill_no", "paddy_type", "bags", "moisture", "base_rate", "calculated_rate", "calculated_weight_kg", "item_amount")),
+    "sale": ("sales_bills", "sales_bill_items", "SALE",
+             ("bill_no", "party_id", "bill_date", "lorry_no", "total_bags", "final_weight_kg", "total_gross_amount", "discount_percent", "brokerage", "hamali", "others_desc", "others_amount", "net_payable"),
+             ("bill_no", "paddy_type", "bags", "rate", "weight_kg", "amount")),
+}
+
+def read_bills_csv(path, kind="purchase"):
+    """Yields (fields, rows) per bill from a CSV holding one line per bill item.
+    Consecutive lines with the same bill_no and date form one bill; header columns come from its first line.
+    Columns: bill_no, date, party_name, lorry_no, total_bags, truck_weight1_kg, truck_weight2_kg, truck_weight3_kg,
+    discount_percent, brokerage, hamali, others_desc, others_amount, paddy_type, bags and
+    moisture + base_rate (purchase) or rate (sale). A blank bill_no gets the next free number."""
+    import csv
+    num = lambda v: float(v) if v not in (None, "") else 0.0
+    whole = lambda v: int(float(v)) if v not in (None, "") else 0
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        fields, rows, key = None, [], None
+        for line in csv.DictReader(f):
+            line_key = (line.get("bill_no"), line.get("date"))
+            if rows and line_key != key: yield fields, rows; rows = []
+            if not rows:
+                fields = {"bill_no": whole(line.get("bill_no")), "party_name": line["party_name"], "date": line["date"],
+                          "lorry_no": line.get("lorry_no", ""), "total_bags": whole(line.get("total_bags")),
+                          "truck_weight1_kg": num(line.get("truck_weight1_kg")), "truck_weight2_kg": num(line.get("truck_weight2_kg")),
+                          "truck_weight3_kg": num(line.get("truck_weight3_kg")), "discount_percent": num(line.get("discount_percent")),
+                          "brokerage": num(line.get("brokerage")), "hamali": num(line.get("hamali")),
+                          "others_desc": line.get("others_desc", ""), "others_amount": num(line.get("others_amount"))}
+            key = line_key
+            item = {"paddy_type": line["paddy_type"], "bags": whole(line.get("bags"))}
+            if kind == "purchase": item.update(moisture=num(line.get("moisture")), base_rate=num(line.get("base_rate")))
+            else: item["rate"] = num(line.get("rate"))
+            rows.append(item)
+        if rows: yield fields, rows
 
+def _import_chunk(cursor, kind, bills, parties):
+    """Writes one chunk of calculated (header, items) bills. Returns (bills written, items written, skipped)."""
+    table, item_table, ledger_type, h_cols, i_cols = IMPORT_TARGETS[kind]
+    sign = 1 if kind == "purchase" else -1
+    nos = [h['bill_no'] for h, _ in bills]
+    existing = {r[0] for r in cursor.execute(f"SELECT bill_no FROM {table} WHERE bill_no BETWEEN ? AND ?", (min(nos), max(nos))).fetchall()}
+    bills = [(h, i) for h, i in bills if h['bill_no'] not in existing]
+    skipped = len(nos) - len(bills)
+    if not bills: return 0, 0, skipped
+
+    new_names = {h['party_name'] for h, _ in bills} - parties.keys()
+    if new_names:
+        cursor.executemany("INSERT OR IGNORE INTO parties (party_name) VALUES (?)", [(n,) for n in new_names])
+        marks = ",".join("?" * len(new_names))
+        parties.update(cursor.execute(f"SELECT party_name, party_id FROM parties WHERE party_name IN ({marks})", tuple(new_names)).fetchall())
+
+    header_rows, item_rows, ledger_rows, deltas, first = [], [], [], {}, {}
+    for h, items in bills:
+        h = dict(h, party_id=parties[h['party_name']], avg_pack_size_kg=0)
+        header_rows.append(tuple(h[c] for c in h_cols))
+        for i in items:
+            wt = i['calculated_weight_kg']
+            if kind == "purchase": item_rows.append((h['bill_no'], i['paddy_type'], i['bags'], i['moisture'], i['base_rate'], i['calculated_rate'], wt, i['item_amount']))
+            else: item_rows.append((h['bill_no'], i['paddy_type'], i['bags'], i['rate'], wt, i['item_amount']))
+            ledger_rows.append((h['date'], ledger_type, h['bill_no'], i['paddy_type'], sign * i['bags'], sign * wt * 100, i['item_amount'] if kind == "purchase" else 0))
+            first[i['paddy_type']] = min(first.get(i['paddy_type'], h['date']), h['date'])
+            d = deltas.setdefault(i['paddy_type'], [0, 0.0, 0.0, 0.0])
+            d[0] += sign * i['bags']; d[1] += sign * wt * 100
+            if kind == "purchase": d[2] += i['item_amount']; d[3] += wt
+
+    # sales are costed after the insert; purchases only move the cost of issues dated after them
+    revalue = [p for p, day in first.items() if kind != "purchase" or _is_backdated(cursor, p, day)]
+    cursor.executemany(f"INSERT INTO {table} ({', '.join(h_cols)}) VALUES ({', '.join('?' * len(h_cols))})", header_rows)
+    cursor.executemany(f"INSERT INTO {item_table} ({', '.join(i_cols)}) VALUES ({', '.join('?' * len(i_cols))})", item_rows)
+    cursor.executemany("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg, value_change) VALUES (?, ?, ?, ?, ?, ?, ?)", ledger_rows)
+    for p_type, (bags, wt, value, qtl) in deltas.items(): _apply_stock_delta(cursor, ledger_type, p_type, bags, wt, value, qtl, value)
+    _apply_checkpoints(cursor, _checkpoint_deltas([(day, t, p_type, bags, wt, value) for day, t, _, p_type, bags, wt, value in ledger_rows]))
+    _note_prices(cursor, ledger_type, [(i['paddy_type'], i['base_rate'] if kind == "purchase" else i['rate'], h['bill_no'], h['date']) for h, items in bills for i in items])
+    if revalue: _revalue_stock(cursor, revalue, min(first[p] for p in revalue))
+    _apply_rollup(cursor, ledger_type, "b.bill_no IN (SELECT value FROM json_each(?))", (json.dumps([h['bill_no'] for h, _ in bills]),))
+    _apply_party_aggregates(cursor, ledger_type, "b.bill_no IN (SELECT value FROM json_each(?))", (json.dumps([h['bill_no'] for h, _ in bills]),))
+    return len(bills), len(item_rows), skipped
+
+@writes
+def import_bills(bills, kind="purchase", chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Bulk loads historical bills through the same arithmetic as the billing screens.
+
+    `bills` is an iterable of (fields, rows) pairs (see bill_calculator) or a CSV path (see read_bills_csv).
+    Bills, items, inventory_log, stock_balances and daily_rollup are written set-wise, one transaction per
+    chunk, so the ledger is consistent without a rebuild pass. Bill numbers already on file are skipped;
+    bills without a number take the next ones of the series (see allocate_number).
+    Sales are imported as history: stock is not validated.
+    Returns {"bills", "items", "skipped", "seconds", "bills_per_sec"}; progress(report) runs after each chunk."""
+    if kind not in IMPORT_TARGETS: raise ValueError(f"Unknown bill kind: {kind}")
+    if isinstance(bills, str): bills = read_bills_csv(bills, kind)
+    calculate = bill_calculator.calculate_purchase_bill if kind == "purchase" else bill_calculator.calculate_sales_bill
+    ledger_type = IMPORT_TARGETS[kind][2]
+
+    conn = get_connection(); cursor = conn.cursor()
+    parties = dict(cursor.execute("SELECT party_name, party_id FROM parties").fetchall())
+    report = {"bills": 0, "items": 0, "skipped": 0, "seconds": 0.0, "bills_per_sec": 0.0}
+    started = time.perf_counter()
+
+    def flush(chunk):
+        try:
+            begin_write(conn, cursor)
+            in_sync = _watermark_is_current(cursor, ledger_type)
+            unnumbered = [h for h, _ in chunk if not h['bill_no']]
+            if unnumbered:
+                first = allocate_number(cursor, ledger_type, count=len(unnumbered), floor=max(h['bill_no'] or 0 for h, _ in chunk))
+                for n, h in enumerate(unnumbered): h['bill_no'] = first + n
+            written, items, skipped = _import_chunk(cursor, kind, chunk, parties)
+            if in_sync: _advance_watermark(cursor, ledger_type)
+            commit(conn)
+        except Exception: conn.rollback(); raise
+        report["bills"] += written; report["items"] += items; report["skipped"] += skipped
+        report["seconds"] = time.perf_counter() - started
+        report["bills_per_sec"] = report["bills"] / report["seconds"] if report["seconds"] else 0.0
+        if progress: progress(dict(report))
+
+    chunk = []
+    for fields, rows in bills:
+        chunk.append(calculate(fields, rows))
+        if len(chunk) >= chunk_size: flush(chunk); chunk = []
+    if chunk: flush(chunk)
+    return report
+
+REPORT_DATA_SQL = "SELECT b.bill_no, b.bill_date, p.party_name, b.total_bags, b.final_truck_weight_kg, b.net_payable, b.brokerage as bill_total_brokerage, i.paddy_type, i.calculated_weight_kg as item_weight, i.moisture, i.base_rate, pv.default_brokerage_rate FROM bills b JOIN parties p ON b.party_id = p.party_id JOIN bill_items i ON b.bill_no = i.bill_no LEFT JOIN paddy_varieties pv ON i.paddy_type = pv.variety_name WHERE b.bill_date BETWEEN ? AND ?"
+
+@cached_query
 def get_report_data_with_items(start, end):
-    conn = sqlite3.connect(DATABASE_FILE)
-    query = "SELECT b.bill_no, b.bill_date, p.party_name, b.total_bags, b.final_truck_weight_kg, b.net_payable, b.brokerage as bill_total_brokerage, i.paddy_type, i.calculated_weight_kg as item_weight, i.moisture, i.base_rate, pv.default_brokerage_rate FROM bills b JOIN parties p ON b.party_id = p.party_id JOIN bill_items i ON b.bill_no = i.bill_no LEFT JOIN paddy_varieties pv ON i.paddy_type = pv.variety_name WHERE b.bill_date BETWEEN ? AND ?"
-    df = pd.read_sql_query(query, conn, params=(start, end)); conn.close(); return df
+    conn = get_connection()
+    df = pd.read_sql_query(REPORT_DATA_SQL, conn, params=(start, end)); return df
 
+@cached_query
 def get_inventory_summary():
-    conn = sqlite3.connect(DATABASE_FILE)
-    query = "SELECT paddy_type, SUM(CASE WHEN type='PURCHASE' THEN weight_change_kg ELSE 0 END) as total_in_kg, SUM(CASE WHEN type IN ('SALE', 'PROCESS_IN') THEN ABS(weight_change_kg) ELSE 0 END) as total_out_kg, SUM(weight_change_kg) as current_stock_kg, SUM(bags_change) as current_bags FROM inventory_log GROUP BY paddy_type"
-    df = pd.read_sql_query(query, conn)
-    rate_query = "SELECT i.paddy_type, SUM(i.item_amount) / SUM(i.calculated_weight_kg) as avg_rate FROM bill_items i GROUP BY i.paddy_type"
-    df_rates = pd.read_sql_query(rate_query, conn)
-    if not df.empty and not df_rates.empty:
-        df = df.merge(df_rates, on="paddy_type", how="left"); df['avg_rate'] = df['avg_rate'].fillna(0); df['stock_value'] = ((df['current_stock_kg'] / 100) * df['avg_rate']).astype(int)
-    else: df['avg_rate'] = 0; df['stock_value'] = 0
-    conn.close(); return df
-
-def get_inventory_ledger(paddy_type=None):
-    conn = sqlite3.connect(DATABASE_FILE)
-    base_query = "SELECT date, type, ref_id, paddy_type, bags_change, weight_change_kg FROM inventory_log"
-    if paddy_type and paddy_type != "ALL": base_query += f" WHERE paddy_type = '{paddy_type}'"
-    base_query += " ORDER BY date DESC"
-    df = pd.read_sql_query(base_query, conn); conn.close(); return df
+    """Per-variety stock; avg_rate is the moving-average cost per qtl and stock_value what the stock on hand cost."""
+    conn = get_connection()
+    query = """SELECT paddy_type, in_weight_kg as total_in_kg, out_weight_kg as total_out_kg, weight_kg as current_stock_kg, bags as current_bags,
+        CASE WHEN weight_kg > 0 THEN stock_value * 100 / weight_kg ELSE 0 END as avg_rate,
+        CASE WHEN purchase_qtl <> 0 THEN purchase_value / purchase_qtl ELSE 0 END as avg_purchase_rate,
+        CAST(ROUND(stock_value) AS INTEGER) as stock_value FROM stock_balances ORDER BY paddy_type"""
+    return pd.read_sql_query(query, conn)
+
+# ======================================================================================
+# REPORT AGGREGATES (READ FROM daily_rollup, NOT THE RAW BILLS)
+# ======================================================================================
+
+ROLLUP_GROUPS = {"day": "r.day", "month": "substr(r.day, 6, 2)", "paddy_type": "r.paddy_type"}  # and "party"
+
+@cached_query
+def get_rollup(source, start="", end="9999-12-31", by=None, items=False):
+    """Sums of daily_rollup for "PURCHASE", "SALE" or "PROCESS" between two dates, as one row or grouped by `by`
+    (day / month / party / paddy_type). Only by="party" reads the per-party rows. Closed years in range are included.
+
+    items=False sums the bill (batch) totals: bills, bags, truck weight, gross, net, brokerage.
+    items=True sums the item lines: items, bags, weight, amount (gross) and the rate / moisture sums
+    (rate_sum / items is the plain average, rate_wt / weight_kg the weight-weighted one).
+    """
+    sums = ", ".join(f"COALESCE(SUM(r.{c}), 0) AS {c}" for c in ROLLUP_COLUMNS)
+    parties = "IN (SELECT party_id FROM parties)" if by == "party" else "= 0"  # IN: one day-range seek per party
+    where = f"r.source = ? AND r.party_id {parties} AND r.day BETWEEN ? AND ? AND r.paddy_type {'<>' if items else '='} ''"
+    # Filter inside each year's arm: the party IN (...) seek is not pushed into a UNION ALL
+    rollup, n = _over_years(f"SELECT * FROM {{s}}.daily_rollup r WHERE {where}", start, end)
+    if by == "party":  # sum per id first, then name the (few) parties
+        query = (f"SELECT p.party_name AS party, {', '.join(f'x.{c}' for c in ROLLUP_COLUMNS)} FROM (SELECT r.party_id, {sums} FROM ({rollup}) r "
+                 f"GROUP BY r.party_id) x JOIN parties p ON p.party_id = x.party_id ORDER BY p.party_name")
+    elif by: query = f"SELECT {ROLLUP_GROUPS[by]} AS {by}, {sums} FROM ({rollup}) r GROUP BY 1 ORDER BY 1"
+    else: query = f"SELECT {sums} FROM ({rollup}) r"
+    return pd.read_sql_query(query, get_connection(), params=(source, start, end) * n)
+
+REPORT_BILLS_SQL = "SELECT b.bill_no, b.bill_date, p.party_name, b.total_bags, b.final_truck_weight_kg, b.brokerage as bill_total_brokerage, b.net_payable FROM {s}.bills b JOIN parties p ON b.party_id = p.party_id WHERE b.bill_date BETWEEN ? AND ?"
+
+@cached_query
+def get_report_bills(start, end):
+    """Purchase bills (one row each, no items) for the report's bill list."""
+    query, n = _over_years(REPORT_BILLS_SQL, start, end)
+    return pd.read_sql_query(query + " ORDER BY bill_date, bill_no", get_connection(), params=(start, end) * n)
+
+# Weighted by item weight; brokerage at each variety's current default rate
+PURCHASE_VARIETY_SQL = """SELECT r.paddy_type, SUM(r.weight_kg) AS wt, COALESCE(SUM(r.rate_wt) / SUM(r.weight_kg), 0) AS rate,
+        COALESCE(SUM(r.moisture_wt) / SUM(r.weight_kg), 0) AS moist, SUM(r.weight_kg) * COALESCE(pv.default_brokerage_rate, 0) AS brok
+    FROM {rollup} r LEFT JOIN paddy_varieties pv ON pv.variety_name = r.paddy_type
+    WHERE r.source = 'PURCHASE' AND r.day BETWEEN ? AND ? AND r.party_id = 0 AND r.paddy_type <> '' GROUP BY r.paddy_type"""
+
+@cached_query
+def get_purchase_variety_stats(start, end):
+    """Per variety: total weight, weighted avg rate and moisture, brokerage (the report's variety tab)."""
+    return pd.read_sql_query(PURCHASE_VARIETY_SQL.format(rollup=_rollup_table(start, end)), get_connection(), params=(start, end))
+
+DAILY_PURCHASE_PRICES_SQL = """SELECT r.paddy_type, r.day AS date, r.rate_wt / r.weight_kg AS price, r.weight_kg AS qtl
+    FROM {rollup} r WHERE r.source = 'PURCHASE' AND r.day BETWEEN ? AND ? AND r.party_id = 0 AND r.paddy_type <> '' AND r.weight_kg > 0
+    ORDER BY r.paddy_type, r.day"""
+
+@cached_query
+def get_daily_purchase_prices(start="", end="9999-12-31"):
+    """Every variety's weight-weighted purchase base_rate per day (one row per variety and purchase day, closed years included)."""
+    return pd.read_sql_query(DAILY_PURCHASE_PRICES_SQL.format(rollup=_rollup_table(start, end)), get_connection(), params=(start, end))
+
+@writes
+def rebuild_rollups():
+    """Re-derives daily_rollup from every bill and batch, and party_aggregates from it (backfill / repair command).
+    Returns the daily_rollup row count."""
+    conn = get_connection()
+    try:
+        cursor = begin_write(conn)
+        rebuild_daily_rollups(cursor)
+        rebuild_party_aggregates(cursor)
+        commit(conn); return cursor.execute("SELECT COUNT(*) FROM daily_rollup").fetchone()[0]
+    except Exception as e: conn.rollback(); return f"Error: {e}"
+
+# ======================================================================================
+# YEAR-END CLOSE (CLOSED FINANCIAL YEARS LIVE IN PER-YEAR ARCHIVE FILES)
+# ======================================================================================
+# close_financial_year() moves every bill, batch, ledger row and rollup of a finished FY into
+# rice_mill_FY<fy>.db next to the live file, and carries the closing stock into the live DB as
+# one OPENING ledger row per variety plus opening_stock (in/out weights, purchase value), so
+# stock_balances do not change. Closed years are read-only. Report readers that take a date
+# range read the live tables and, UNION ALL, those of every archive overlapping the range,
+# attached read-only to the thread's connection on first use.
+
+# Copied with their indexes into each archive. Masters (parties, varieties) and opening_stock are copied as
+# they stood at the close; the rest move: table -> rows of the years ending before :next.
+YEAR_CLOSE_COPIED = ("parties", "paddy_varieties", "opening_stock")
+YEAR_CLOSE_MOVED = {
+    "bills": "bill_date < :next",
+    "bill_items": "bill_no IN (SELECT bill_no FROM main.bills WHERE bill_date < :next)",
+    "sales_bills": "bill_date < :next",
+    "sales_bill_items": "bill_no IN (SELECT bill_no FROM main.sales_bills WHERE bill_date < :next)",
+    "processing_batches": "date < :next",
+    "processing_batch_items": "batch_id IN (SELECT batch_id FROM main.processing_batches WHERE date < :next)",
+    "inventory_log": "date < :next",
+    "daily_rollup": "day < :next",
+}
+MAX_ATTACHED_ARCHIVES = 8  # SQLite allows 10 attached databases per connection; keep room for year_close
+
+def fy_bounds(fy):
+    """("2023-2024") -> ("2023-04-01", "2024-03-31")."""
+    return f"{fy[:4]}-04-01", f"{fy[5:9]}-03-31"
+
+def archive_path(fy):
+    """Archive file of a financial year: rice_mill_FY2023-2024.db beside DATABASE_FILE."""
+    return f"{os.path.splitext(DATABASE_FILE)[0]}_FY{fy}.db"
+
+def _resolve_archive(path):
+    return path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.abspath(DATABASE_FILE)), path)
+
+def attach_archives(start="", end="9999-12-31"):
+    """Schema names of the closed years overlapping start..end (oldest first), attached read-only to
+    this thread's connection if they were not already. Empty when the range is all in the live DB."""
+    conn = get_connection()
+    rows = conn.execute("SELECT fy, path FROM year_archives WHERE start_date <= ? AND end_date >= ? ORDER BY fy", (end, start)).fetchall()
+    if len(rows) > MAX_ATTACHED_ARCHIVES: raise ValueError(f"Range spans {len(rows)} closed years; at most {MAX_ATTACHED_ARCHIVES} can be read at once")
+    wanted = {f"fy{fy[:4]}": path for fy, path in rows}
+    attached = _local.attached
+    for name in [n for n in attached if n not in wanted][:max(0, len(attached) + len(wanted) - MAX_ATTACHED_ARCHIVES)]:
+        conn.execute(f"DETACH DATABASE {name}"); del attached[name]
+    for name, path in wanted.items():
+        if name in attached: continue
+        conn.execute(f"ATTACH DATABASE ? AS {name}", (Path(_resolve_archive(path)).resolve().as_uri() + "?mode=ro",))
+        attached[name] = path
+    return list(wanted)
+
+def _over_years(branch, start="", end="9999-12-31"):
+    """UNION ALL of `branch` (a SELECT naming moved tables as {s}.table) over the live DB and every archive
+    overlapping start..end. Returns (sql, branch count); bind the branch's parameters once per branch."""
+    schemas = ["main", *attach_archives(start, end)]
+    return " UNION ALL ".join(branch.format(s=s) for s in schemas), len(schemas)
+
+def _rollup_table(start="", end="9999-12-31"):
+    """daily_rollup, or the UNION ALL of it with the archives overlapping start..end (filters are pushed into each arm)."""
+    schemas = attach_archives(start, end)
+    if not schemas: return "daily_rollup"
+    cols = ", ".join(("source", "day", "party_id", "paddy_type") + ROLLUP_COLUMNS)
+    return "(" + " UNION ALL ".join(f"SELECT {cols} FROM {s}.daily_rollup" for s in ["main", *schemas]) + ")"
+
+def _carry_forward(cursor, nxt):
+    """Closing stock of everything dated before `nxt`, per variety, including what earlier closes carried.
+    Rows are opening_stock's columns followed by the stock value."""
+    carried = {r[0]: list(r[1:]) for r in cursor.execute("SELECT paddy_type, bags, weight_kg, in_weight_kg, out_weight_kg, purchase_value, purchase_qtl FROM opening_stock")}
+    closing = {}
+    for p_type, bags, wt, in_kg, out_kg, stock_value in cursor.execute("""SELECT paddy_type, SUM(bags_change), SUM(weight_change_kg),
+            SUM(CASE WHEN type = 'PURCHASE' THEN weight_change_kg ELSE 0 END), SUM(CASE WHEN type IN ('SALE', 'PROCESS_IN') THEN -weight_change_kg ELSE 0 END),
+            SUM(value_change) FROM inventory_log WHERE date < ? GROUP BY paddy_type""", (nxt,)).fetchall():
+        prev = carried.get(p_type, [0] * 6)
+        closing[p_type] = [bags, wt, prev[2] + in_kg, prev[3] + out_kg, prev[4], prev[5], stock_value]
+    for p_type, value, qtl in cursor.execute("""SELECT i.paddy_type, SUM(i.item_amount), SUM(i.calculated_weight_kg) FROM bills b
+            JOIN bill_items i ON b.bill_no = i.bill_no WHERE b.bill_date < ? GROUP BY i.paddy_type""", (nxt,)).fetchall():
+        row = closing.setdefault(p_type, [0, 0.0] + carried.get(p_type, [0] * 6)[2:] + [0.0])
+        row[4] += value; row[5] += qtl
+    return closing
+
+@writes
+def close_financial_year(fy):
+    """Moves a finished financial year ("2023-2024") into its archive file and writes the opening stock
+    of the next year into the live DB. Years close oldest first. Returns a summary string or "Error: ..."."""
+    if not re.fullmatch(r"\d{4}-\d{4}", fy or "") or int(fy[5:]) != int(fy[:4]) + 1: return f"Error: Not a financial year: {fy}"
+    start, end = fy_bounds(fy); nxt = f"{fy[5:9]}-04-01"
+    if fy >= get_financial_year(datetime.now().strftime("%Y-%m-%d")): return f"Error: FY {fy} has not ended yet"
+    conn = get_connection()
+    if conn.execute("SELECT 1 FROM year_archives WHERE fy = ?", (fy,)).fetchone(): return f"Error: FY {fy} is already closed"
+    earliest = conn.execute("""SELECT MIN(d) FROM (SELECT MIN(bill_date) AS d FROM bills UNION ALL SELECT MIN(bill_date) FROM sales_bills
+        UNION ALL SELECT MIN(date) FROM processing_batches UNION ALL SELECT MIN(date) FROM inventory_log WHERE type <> 'OPENING')""").fetchone()[0]
+    if earliest and earliest < start: return f"Error: Close FY {get_financial_year(earliest)} first"
+    path = archive_path(fy)
+    if os.path.exists(path): return f"Error: {path} already exists"
+
+    conn.execute("ATTACH DATABASE ? AS year_close", (path,))
+    try:
+        cursor = begin_write(conn)
+        in_sync = _stored_watermarks(cursor) == _source_watermarks(cursor)
+        closing = _carry_forward(cursor, nxt)
+        for table in YEAR_CLOSE_COPIED + tuple(YEAR_CLOSE_MOVED):
+            for (sql,) in cursor.execute("SELECT sql FROM main.sqlite_master WHERE tbl_name = ? AND type IN ('table', 'index') AND sql IS NOT NULL ORDER BY type DESC", (table,)).fetchall():
+                cursor.execute(re.sub(r"^CREATE (TABLE|INDEX) (\w+)", r"CREATE \1 year_close.\2", sql))
+        for table in YEAR_CLOSE_COPIED: cursor.execute(f"INSERT INTO year_close.{table} SELECT * FROM main.{table}")
+        for table, where in YEAR_CLOSE_MOVED.items(): cursor.execute(f"INSERT INTO year_close.{table} SELECT * FROM main.{table} WHERE {where}", {"next": nxt})
+        counts = [cursor.execute(f"SELECT COUNT(*) FROM year_close.{t}").fetchone()[0] for t in ("bills", "sales_bills", "processing_batches")]
+        for table, where in reversed(YEAR_CLOSE_MOVED.items()): cursor.execute(f"DELETE FROM main.{table} WHERE {where}", {"next": nxt})
+
+        cursor.execute("DELETE FROM opening_stock")
+        cursor.executemany("INSERT INTO opening_stock (paddy_type, as_of, bags, weight_kg, in_weight_kg, out_weight_kg, purchase_value, purchase_qtl) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           [(p, nxt, *row[:6]) for p, row in closing.items()])
+        cursor.executemany("INSERT INTO inventory_log (date, type, ref_id, paddy_type, bags_change, weight_change_kg, value_change) VALUES (?, 'OPENING', NULL, ?, ?, ?, ?)",
+                           [(nxt, p, row[0], row[1], row[6]) for p, row in closing.items()])
+        if in_sync: _store_watermarks(cursor, _source_watermarks(cursor))
+        cursor.execute("INSERT INTO year_archives (fy, path, start_date, end_date, bills, sales, batches, closed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (fy, os.path.basename(path), start, end, *counts, datetime.now().isoformat(timespec="seconds")))
+        cursor.execute(f"PRAGMA year_close.user_version = {SCHEMA_VERSION}")
+        commit(conn)
+    except Exception as e:
+        conn.rollback(); conn.execute("DETACH DATABASE year_close")
+        if os.path.exists(path): os.remove(path)
+        return f"Error: {e}"
+    conn.execute("DETACH DATABASE year_close")
+    return f"FY {fy} closed: {counts[0]} bills, {counts[1]} sales, {counts[2]} batches moved to {os.path.basename(path)}"
+
+@cached_query
+def get_year_archives():
+    """[(fy, path, start_date, end_date, bills, sales, batches, closed_at)] of the closed years, oldest first."""
+    return execute_query("SELECT * FROM year_archives ORDER BY fy", fetch="all")
+
+# ======================================================================================
+# PAGED LISTS (KEYSET CURSORS, NEWEST FIRST)
+# ======================================================================================
+# A page is fetched with `after` = the cursor returned with the previous page, so each
+# page is an index range scan of `limit` rows however deep the user has scrolled.
+
+LEDGER_PAGE_SIZE = 200
+ARCHIVE_PAGE_SIZE = 100
+
+# Running balances: window sums over just the fetched page, offset by the balance carried in the cursor
+LEDGER_PAGE_SQL = """SELECT log_id, date, type, ref_id, paddy_type, bags_change, weight_change_kg, value_change,
+        :bags - SUM(bags_change) OVER w + bags_change AS bags_balance,
+        :weight - SUM(weight_change_kg) OVER w + weight_change_kg AS weight_balance_kg
+    FROM (SELECT log_id, date, type, ref_id, paddy_type, bags_change, weight_change_kg, value_change FROM inventory_log
+          WHERE {where} ORDER BY date DESC, log_id DESC LIMIT :limit)
+    WINDOW w AS (ORDER BY date DESC, log_id DESC ROWS UNBOUNDED PRECEDING)
+    ORDER BY date DESC, log_id DESC"""
+
+@cached_query
+def get_inventory_ledger_page(paddy_type=None, after=None, limit=LEDGER_PAGE_SIZE):
+    """One page of the stock ledger, newest first, with the running stock after each movement.
+
+    Returns (df, next_cursor); next_cursor is None on the last page. Balances are per variety,
+    or for the whole godown when paddy_type is None/"ALL".
+    """
+    conn = get_connection()
+    where, params = ["1"], {"limit": limit}
+    if paddy_type and paddy_type != "ALL": where.append("paddy_type = :paddy_type"); params["paddy_type"] = paddy_type
+    if after is None:
+        query = "SELECT COALESCE(SUM(bags), 0), COALESCE(SUM(weight_kg), 0) FROM stock_balances"
+        if "paddy_type" in params: query += " WHERE paddy_type = :paddy_type"
+        params["bags"], params["weight"] = conn.execute(query, params).fetchone()
+    else:
+        where.append("(date, log_id) < (:date, :log_id)")
+        params["date"], params["log_id"], params["bags"], params["weight"] = after
+    df = pd.read_sql_query(LEDGER_PAGE_SQL.format(where=" AND ".join(where)), conn, params=params)
+    if len(df) < limit: return df, None
+    last = df.iloc[-1]
+    return df, (last['date'], int(last['log_id']), int(last['bags_balance'] - last['bags_change']),
+                float(last['weight_balance_kg'] - last['weight_change_kg']))
+
+@cached_query
+def count_inventory_ledger(paddy_type=None):
+    """Number of ledger rows get_inventory_ledger_page() will walk through (for scrollbars)."""
+    if paddy_type and paddy_type != "ALL":
+        return get_connection().execute("SELECT COUNT(*) FROM inventory_log WHERE paddy_type = ?", (paddy_type,)).fetchone()[0]
+    return get_connection().execute("SELECT COUNT(*) FROM inventory_log").fetchone()[0]
 
+ARCHIVE_SOURCES = {"PURCHASE": "bills", "SALE": "sales_bills"}
+ARCHIVE_COLUMNS = ("type", "bill_no", "bill_date", "party_name", "total_bags", "net_payable")
+ARCHIVE_SORT_COLUMNS = {"bill_date": "b.bill_date", "bill_no": "b.bill_no", "party_name": "p.party_name",
+                        "total_bags": "COALESCE(b.total_bags, 0)", "net_payable": "b.net_payable"}
+
+ARCHIVE_BRANCH_SQL = """SELECT * FROM (SELECT '{kind}' AS type, b.bill_no, b.bill_date, p.party_name, COALESCE(b.total_bags, 0) AS total_bags, b.net_payable
+    FROM {table} b JOIN parties p ON b.party_id = p.party_id
+    WHERE {where} ORDER BY {sort_expr} {direction}, b.bill_no {direction} LIMIT :limit)"""
+
+def _with_closed_years(search, party_id):
+    """One party's history spans the closed years too; the archive screen and searches stay on the live DB."""
+    return party_id is not None and not search
+
+def _archive_filters(src, search, party_id):
+    where = ["1"]
+    if search:
+        first, last = search_rowid_range(src)
+        where.append(f"b.bill_no IN (SELECT rowid - {first} FROM search_index WHERE search_index MATCH :match AND rowid BETWEEN {first} AND {last})")
+    if party_id is not None: where.append("b.party_id = :party_id")
+    return where
+
+@cached_query
+def get_transactions_page(kind="ALL", search="", after=None, limit=ARCHIVE_PAGE_SIZE, sort="bill_date", descending=True, party_id=None):
+    """One page of the combined purchase/sale archive, ordered by `sort` then type then bill no (newest first by default).
+
+    `search` is matched through the search index (bill no, party name, lorry no; see search_match());
+    `party_id` narrows to one party's bills, closed years included (without a search: archived bills are not indexed).
+    Returns (rows, next_cursor) where rows are (type, bill_no, bill_date, party_name, total_bags, net_payable).
+    """
+    sort_expr, direction = ARCHIVE_SORT_COLUMNS[sort], "DESC" if descending else "ASC"
+    params, branches = {"limit": limit, "party_id": party_id, "match": search_match(search)}, []
+    search = params["match"]
+    if after is not None: params["value"], params["bill_no"] = after[0], after[2]
+    after_op = "<" if descending else ">"
+    for src, table in ARCHIVE_SOURCES.items():
+        if kind not in ("ALL", src): continue
+        where = _archive_filters(src, search, party_id)
+        if after is not None:  # rows strictly past the cursor in (sort, type, bill_no) order
+            if src == after[1]: where.append(f"({sort_expr}, b.bill_no) {after_op} (:value, :bill_no)")
+            else:  # this type sorts after the cursor's type, so ties on the sort value also come after it
+                ties_follow = src < after[1] if descending else src > after[1]
+                where.append(f"{sort_expr} {after_op}{'=' if ties_follow else ''} :value")
+        branch = ARCHIVE_BRANCH_SQL.format(kind=src, table="{s}." + table, where=" AND ".join(where), sort_expr=sort_expr, direction=direction)
+        branches.append(_over_years(branch)[0] if _with_closed_years(search, party_id) else branch.format(s="main"))
+    if not branches: return [], None
+    query = " UNION ALL ".join(branches) + f" ORDER BY {sort} {direction}, type {direction}, bill_no {direction} LIMIT :limit"
+    rows = get_connection().execute(query, params).fetchall()
+    if len(rows) < limit: return rows, None
+    return rows, (rows[-1][ARCHIVE_COLUMNS.index(sort)], rows[-1][0], rows[-1][1])
+
+@cached_query
+def count_transactions(kind="ALL", search="", party_id=None):
+    """Number of rows get_transactions_page() will walk through with the same filters."""
+    params, total = {"match": search_match(search), "party_id": party_id}, 0
+    for src, table in ARCHIVE_SOURCES.items():
+        if kind not in ("ALL", src): continue
+        where = " AND ".join(_archive_filters(src, params["match"], party_id))
+        branch = f"SELECT COUNT(*) AS n FROM {{s}}.{table} b WHERE {where}"
+        query = f"SELECT SUM(n) FROM ({_over_years(branch)[0]})" if _with_closed_years(params["match"], party_id) else branch.format(s="main")
+        total += get_connection().execute(query, params).fetchone()[0]
+    return total
+
+# ======================================================================================
+# GLOBAL SEARCH (FTS5 INDEX KEPT IN SYNC BY TRIGGERS)
+# ======================================================================================
+
+SEARCH_LIMIT = 50
+SEARCH_CANDIDATES = 300  # newest matches per kind that get ranked
+_search_words = lambda text: re.findall(r"[^\W_]+", (text or "").upper())  # same split as the FTS5 tokenizer
+
+def search_match(text):
+    """Turns what the user typed into an FTS5 query: every word must match, the last one may be unfinished.
+
+    Only the last word is a prefix (and only from two letters on): a prefix over a common word has to
+    be merged for the whole index, while complete words are read lazily, newest first.
+    """
+    terms = _search_words(text)
+    return " ".join(f'"{term}"' + ("*" if n == len(terms) - 1 and len(term) > 1 else "") for n, term in enumerate(terms))
+
+def _search_score(terms, title, detail):
+    """Rank of one hit: title words weigh 10x detail words, and a short title (the party itself) beats a long one.
+
+    Every hit contains every term, so bm25's document frequencies add nothing but a full doclist scan.
+    """
+    def hits(text):
+        words = _search_words(text)
+        return sum(any(w.startswith(t) for w in words) for t in terms) / max(len(words), 1)
+    return 10 * hits(title) + hits(detail)
+
+@cached_query
+def search(text, kinds=None, limit=SEARCH_LIMIT):
+    """Ranked matches for `text` over bills, sales, parties and batches; newer first among equals.
+
+    Only the newest SEARCH_CANDIDATES matches of each kind are ranked, so common words stay fast.
+    A bill number typed in full always ranks first, however old, so "1042" jumps straight to bill 1042.
+    Returns [(kind, ref, date, title, detail)]: ref is the bill no, party id or batch no.
+    """
+    match, terms = search_match(text), _search_words(text)
+    if not match: return []
+    exact, conn, found = (text or "").strip(), get_connection(), {}
+    for kind in kinds or SEARCH_KINDS:
+        first, last = search_rowid_range(kind)
+        rows = conn.execute(f"SELECT rowid, ref, date, title, detail FROM search_index WHERE search_index MATCH ? AND rowid BETWEEN {first} AND {last} "
+                            "ORDER BY rowid DESC LIMIT ?", (match, SEARCH_CANDIDATES)).fetchall()
+        if kind in ARCHIVE_SOURCES and exact.isdigit() and len(exact) < 12:
+            rows += conn.execute("SELECT rowid, ref, date, title, detail FROM search_index WHERE rowid = ?", (first + int(exact),)).fetchall()
+        for rowid, ref, day, title, detail in rows:
+            found[rowid] = (str(ref) == exact and kind != "PARTY", _search_score(terms, title, detail), day, (kind, ref, day, title, detail))
+    hits = sorted(found.values(), key=lambda h: h[2], reverse=True)  # newest first among equal ranks
+    hits.sort(key=lambda h: (h[0], h[1]), reverse=True)
+    return [h[3] for h in hits[:limit]]
+
+@writes
+def reindex_search():
+    """Rebuilds search_index from scratch and merges its b-trees (maintenance command)."""
+    conn = get_connection()
+    try:
+        cursor = begin_write(conn)
+        rebuild_search_index(cursor)
+        cursor.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+        commit(conn); return cursor.execute("SELECT COUNT(*) FROM search_index").fetchone()[0]
+    except Exception as e: conn.rollback(); return f"Error: {e}"
+
+PROCESSING_REPORT_SQL = "SELECT b.batch_no, b.date, b.financial_year, b.total_input_bags, b.total_input_weight_kg, GROUP_CONCAT(i.paddy_type || ': ' || i.bags, ' | ') as varieties FROM {s}.processing_batches b LEFT JOIN {s}.processing_batch_items i ON b.batch_id = i.batch_id WHERE b.date BETWEEN ? AND ? GROUP BY b.date, b.batch_id"
+
+@cached_query
 def get_processing_report(start, end):
-    conn = sqlite3.connect(DATABASE_FILE)
-    query = "SELECT b.batch_no, b.date, b.financial_year, b.total_input_bags, b.total_input_weight_kg, GROUP_CONCAT(i.paddy_type || ': ' || i.bags, ' | ') as varieties FROM processing_batches b LEFT JOIN processing_batch_items i ON b.batch_id = i.batch_id WHERE b.date BETWEEN ? AND ? GROUP BY b.batch_id ORDER BY b.date DESC"
-    df = pd.read_sql_query(query, conn, params=(start, end)); conn.close(); return df
+    conn = get_connection()
+    query, n = _over_years(PROCESSING_REPORT_SQL, start, end)
+    df = pd.read_sql_query(query + " ORDER BY date DESC", conn, params=(start, end) * n); return df
 
+PROCESSING_VARIETY_SQL = "SELECT paddy_type, SUM(bags) as total_bags, SUM(weight_kg) as total_weight FROM {rollup} WHERE source = 'PROCESS' AND day BETWEEN ? AND ? AND party_id = 0 AND paddy_type <> '' GROUP BY paddy_type"
+
+@cached_query
 def get_processing_variety_stats(start, end):
-    conn = sqlite3.connect(DATABASE_FILE)
-    query = "SELECT i.paddy_type, SUM(i.bags) as total_bags, SUM(i.total_weight_kg) as total_weight FROM processing_batch_items i JOIN processing_batches b ON i.batch_id = b.batch_id WHERE b.date BETWEEN ? AND ? GROUP BY i.paddy_type"
-    df = pd.read_sql_query(query, conn, params=(start, end)); conn.close(); return df
+    conn = get_connection()
+    df = pd.read_sql_query(PROCESSING_VARIETY_SQL.format(rollup=_rollup_table(start, end)), conn, params=(start, end)); return df
+
+BATCH_ITEMS_SQL = "SELECT i.paddy_type, i.bags, i.avg_weight_kg, i.total_weight_kg FROM processing_batch_items i JOIN processing_batches b ON i.batch_id = b.batch_id WHERE b.batch_no = ?"
 
 def get_batch_items_by_no(batch_no):
-    conn = sqlite3.connect(DATABASE_FILE)
-    query = "SELECT i.paddy_type, i.bags, i.avg_weight_kg, i.total_weight_kg FROM processing_batch_items i JOIN processing_batches b ON i.batch_id = b.batch_id WHERE b.batch_no = ?"
-    df = pd.read_sql_query(query, conn, params=(batch_no,)); conn.close(); return df
+    conn = get_connection()
+    df = pd.read_sql_query(BATCH_ITEMS_SQL, conn, params=(batch_no,)); return df
 
 def get_bill_details(bill_no):
-    conn = sqlite3.connect(DATABASE_FILE); conn.row_factory = sqlite3.Row; cursor = conn.cursor()
+    cursor = get_connection().cursor(); cursor.row_factory = sqlite3.Row
     header = cursor.execute("SELECT b.*, p.party_name, p.gst_no, p.mobile_no, p.address FROM bills b JOIN parties p ON b.party_id = p.party_id WHERE b.bill_no = ?", (bill_no,)).fetchone()
     if not header: return None
     items = cursor.execute("SELECT * FROM bill_items WHERE bill_no = ?", (bill_no,)).fetchall()
-    conn.close(); return {"header": dict(header), "items": [dict(i) for i in items]}
+    return {"header": dict(header), "items": [dict(i) for i in items]}
 
 def get_sales_bill_details(bill_no):
-    conn = sqlite3.connect(DATABASE_FILE); conn.row_factory = sqlite3.Row; cursor = conn.cursor()
+    cursor = get_connection().cursor(); cursor.row_factory = sqlite3.Row
     header = cursor.execute("SELECT b.*, p.party_name, p.gst_no, p.mobile_no, p.address FROM sales_bills b JOIN parties p ON b.party_id = p.party_id WHERE b.bill_no = ?", (bill_no,)).fetchone()
     if not header: return None
     items = cursor.execute("SELECT * FROM sales_bill_items WHERE bill_no = ?", (bill_no,)).fetchall()
-    conn.close(); return {"header": dict(header), "items": [dict(i) for i in items]}
+    return {"header": dict(header), "items": [dict(i) for i in items]}
 # ... (Add this to the very bottom of database.py)
 
 def get_price_history(paddy_type):
     """Fetches historical purchase rates for a specific variety."""
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = get_connection()
     query = """
         SELECT b.bill_date as date, i.base_rate as rate
         FROM bill_items i
@@ -347,82 +1699,274 @@ def get_price_history(paddy_type):
         ORDER BY b.bill_date ASC
     """
     df = pd.read_sql_query(query, conn, params=(paddy_type,))
-    conn.close()
     return df
 # ... (Add to the bottom of database.py) ...
 
+@cached_query
 def get_moisture_insights():
     """Finds which suppliers bring the highest moisture paddy on average."""
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = get_connection()
     query = """
-        SELECT p.party_name, AVG(i.moisture) as avg_moist, SUM(i.bags) as total_bags
-        FROM bill_items i
-        JOIN bills b ON i.bill_no = b.bill_no
-        JOIN parties p ON b.party_id = p.party_id
-        GROUP BY p.party_name
-        HAVING total_bags > 0
-        ORDER BY avg_moist DESC
+        SELECT p.party_name, x.avg_moist, x.total_bags
+        FROM (SELECT party_id, SUM(moisture_sum) / SUM(items) as avg_moist, SUM(bags) as total_bags
+              FROM {rollup} WHERE source = 'PURCHASE' AND party_id <> 0 AND paddy_type <> '' GROUP BY party_id) x
+        JOIN parties p ON x.party_id = p.party_id
+        WHERE x.total_bags > 0
+        ORDER BY x.avg_moist DESC
         LIMIT 5
     """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    df = pd.read_sql_query(query.format(rollup=_rollup_table()), conn)
     return df
 
+@cached_query
 def get_seasonal_buying_stats():
-    """Analyzes which months you buy the most paddy."""
-    conn = sqlite3.connect(DATABASE_FILE)
+    """Analyzes which months you buy the most paddy (bill bags; plain average of item rates)."""
+    conn = get_connection()
     query = """
-        SELECT strftime('%m', b.bill_date) as month, SUM(b.total_bags) as total_bags, AVG(i.base_rate) as avg_rate
-        FROM bills b
-        JOIN bill_items i ON b.bill_no = i.bill_no
+        SELECT substr(r.day, 6, 2) as month, SUM(CASE WHEN r.paddy_type = '' THEN r.bags ELSE 0 END) as total_bags,
+               SUM(r.rate_sum) / SUM(r.items) as avg_rate
+        FROM {rollup} r
+        WHERE r.source = 'PURCHASE' AND r.party_id = 0
         GROUP BY month
         ORDER BY month ASC
     """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    df = pd.read_sql_query(query.format(rollup=_rollup_table()), conn)
     return df
 
+@cached_query
 def get_supplier_rankings():
     """Ranks suppliers by who gives the Cheapest Rate (Best Value)."""
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = get_connection()
     query = """
-        SELECT p.party_name, AVG(i.base_rate) as avg_rate, SUM(i.bags) as vol
-        FROM bill_items i
-        JOIN bills b ON i.bill_no = b.bill_no
-        JOIN parties p ON b.party_id = p.party_id
-        GROUP BY p.party_name
-        ORDER BY avg_rate ASC
+        SELECT p.party_name, x.avg_rate, x.vol
+        FROM (SELECT party_id, SUM(rate_sum) / SUM(items) as avg_rate, SUM(bags) as vol
+              FROM {rollup} WHERE source = 'PURCHASE' AND party_id <> 0 AND paddy_type <> '' GROUP BY party_id) x
+        JOIN parties p ON x.party_id = p.party_id
+        ORDER BY x.avg_rate ASC
         LIMIT 10
     """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    df = pd.read_sql_query(query.format(rollup=_rollup_table()), conn)
     return df
 # --- ADD THESE TO THE BOTTOM OF database.py ---
 
-def get_price_history(paddy_type):
-    """Fetches historical purchase rates for a specific variety to build the graph."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    query = """
+PRICE_HISTORY_SQL = """
         SELECT b.bill_date as date, i.base_rate as rate
-        FROM bill_items i
-        JOIN bills b ON i.bill_no = b.bill_no
+        FROM {s}.bill_items i
+        JOIN {s}.bills b ON i.bill_no = b.bill_no
         WHERE i.paddy_type = ?
-        ORDER BY b.bill_date ASC
     """
-    df = pd.read_sql_query(query, conn, params=(paddy_type,))
-    conn.close()
+
+@cached_query
+def get_price_history(paddy_type):
+    """Fetches historical purchase rates for a specific variety to build the graph (closed years included)."""
+    conn = get_connection()
+    query, n = _over_years(PRICE_HISTORY_SQL)
+    df = pd.read_sql_query(query + " ORDER BY date ASC", conn, params=(paddy_type,) * n)
     return df
 
+# Price bars for the market chart: one bar per day / week (from Monday) / month of a variety's purchase lines.
+# A date range finds its lines through the ledger's (paddy_type, type, date) index, so a narrow range reads only
+# its own bills (the unary + keeps SQLite from walking every item of the variety through idx_bill_items_paddy);
+# the whole history is cheaper read through that index.
+PRICE_BAR_BUCKETS = {"day": "day", "week": "date(day, '-6 days', 'weekday 1')", "month": "substr(day, 1, 7) || '-01'"}
+PRICE_LINES_SQL = """SELECT b.bill_date AS day, b.bill_no, i.item_id, i.base_rate AS rate, i.calculated_weight_kg AS qtl, i.bags
+        FROM {s}.bill_items i JOIN {s}.bills b ON b.bill_no = i.bill_no
+        WHERE +i.paddy_type = :paddy_type AND i.bill_no IN (SELECT ref_id FROM {s}.inventory_log WHERE paddy_type = :paddy_type AND type = 'PURCHASE' AND date BETWEEN :start AND :end)"""
+PRICE_HISTORY_LINES_SQL = """SELECT b.bill_date AS day, b.bill_no, i.item_id, i.base_rate AS rate, i.calculated_weight_kg AS qtl, i.bags
+        FROM {s}.bill_items i JOIN {s}.bills b ON b.bill_no = i.bill_no WHERE i.paddy_type = :paddy_type AND b.bill_date <= :end"""
+PRICE_BARS_SQL = """SELECT bar AS date, MAX(open) AS open, MAX(rate) AS high, MIN(rate) AS low, MAX(close) AS close,
+        SUM(rate * qtl) / SUM(qtl) AS vwap, SUM(qtl) AS qtl, SUM(bags) AS bags, COUNT(*) AS lines
+    FROM (SELECT {bucket} AS bar, rate, qtl, bags, FIRST_VALUE(rate) OVER w AS open, LAST_VALUE(rate) OVER w AS close FROM ({lines})
+          WINDOW w AS (PARTITION BY {bucket} ORDER BY day, bill_no, item_id ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING))
+    GROUP BY bar ORDER BY bar"""
+
+@cached_query
+def get_price_bars(paddy_type, start="", end="9999-12-31", bucket="day"):
+    """OHLC bars of a variety's purchase base_rate between two dates (closed years included).
+
+    Columns: date (first day of the bar), open, high, low, close, vwap (weighted by qtl), qtl, bags, lines."""
+    if bucket not in PRICE_BAR_BUCKETS: raise ValueError(f"Unknown bar size: {bucket}")
+    lines, _ = _over_years(PRICE_LINES_SQL if start else PRICE_HISTORY_LINES_SQL, start, end)
+    query = PRICE_BARS_SQL.format(bucket=PRICE_BAR_BUCKETS[bucket], lines=lines)
+    return pd.read_sql_query(query, get_connection(), params={"paddy_type": paddy_type, "start": start, "end": end})
+
+# ======================================================================================
+# LATEST PRICES (MARKET TICKER, O(VARIETIES))
+# ======================================================================================
+# latest_prices keeps the newest purchase rate (base_rate) and sale rate of every variety, newest by
+# (date, bill no, item). Saves and imports only ever move a price forward; update_bill re-reads the
+# varieties it touched from the live bills. Closing a year leaves the table alone, so a variety last
+# bought in a closed year keeps that price.
+
+# kind -> (item table, rate column, latest_prices columns: rate, bill no, date)
+LATEST_PRICE_SOURCES = {"PURCHASE": ("bill_items", "base_rate", ("rate", "bill_no", "bill_date"), "bills"),
+                        "SALE": ("sales_bill_items", "rate", ("sale_rate", "sale_bill_no", "sale_date"), "sales_bills")}
+
+def _note_prices(cursor, kind, rows):
+    """Records (paddy_type, rate, bill_no, date) rows that are newer than what latest_prices holds."""
+    r, n, d = LATEST_PRICE_SOURCES[kind][2]
+    cursor.executemany(f"""INSERT INTO latest_prices (paddy_type, {r}, {n}, {d}) VALUES (?, ?, ?, ?)
+        ON CONFLICT(paddy_type) DO UPDATE SET {r} = excluded.{r}, {n} = excluded.{n}, {d} = excluded.{d}
+        WHERE latest_prices.{d} IS NULL OR (excluded.{d}, excluded.{n}) >= (latest_prices.{d}, latest_prices.{n})""", rows)
+
+def _refresh_latest_prices(cursor, kind, paddy_types):
+    """Re-reads the newest price of the varieties from the live bills, through the ledger's (paddy_type, type, date) index.
+    A variety with no live bill left loses a price dated in the live year (its bill was edited away)."""
+    items, rate_col, (r, n, d), _ = LATEST_PRICE_SOURCES[kind]
+    for p_type in paddy_types:
+        row = cursor.execute(f"""SELECT i.{rate_col}, l.ref_id, l.date FROM inventory_log l JOIN {items} i ON i.bill_no = l.ref_id AND i.paddy_type = l.paddy_type
+            WHERE l.paddy_type = ? AND l.type = ? AND l.date = (SELECT MAX(date) FROM inventory_log WHERE paddy_type = ? AND type = ?)
+            ORDER BY l.ref_id DESC, i.item_id DESC LIMIT 1""", (p_type, kind, p_type, kind)).fetchone()
+        if row: cursor.execute(f"""INSERT INTO latest_prices (paddy_type, {r}, {n}, {d}) VALUES (?, ?, ?, ?)
+            ON CONFLICT(paddy_type) DO UPDATE SET {r} = excluded.{r}, {n} = excluded.{n}, {d} = excluded.{d}""", (p_type, *row))
+        else:
+            cursor.execute(f"""UPDATE latest_prices SET {r} = NULL, {n} = NULL, {d} = NULL
+                WHERE paddy_type = ? AND {d} >= (SELECT COALESCE(MIN(as_of), '') FROM opening_stock)""", (p_type,))
+            cursor.execute("DELETE FROM latest_prices WHERE paddy_type = ? AND rate IS NULL AND sale_rate IS NULL", (p_type,))
+
+def rebuild_latest_prices(cursor):
+    """Recomputes latest_prices from the live bills (prices of varieties seen only in closed years are kept)."""
+    for kind, (items, rate_col, (r, n, d), table) in LATEST_PRICE_SOURCES.items():
+        cursor.execute(f"""INSERT INTO latest_prices (paddy_type, {r}, {n}, {d})
+            SELECT paddy_type, rate, bill_no, bill_date FROM (SELECT i.paddy_type, i.{rate_col} AS rate, b.bill_no, b.bill_date,
+                ROW_NUMBER() OVER (PARTITION BY i.paddy_type ORDER BY b.bill_date DESC, b.bill_no DESC, i.item_id DESC) AS newest
+                FROM {items} i JOIN {table} b ON b.bill_no = i.bill_no) WHERE newest = 1
+            ON CONFLICT(paddy_type) DO UPDATE SET {r} = excluded.{r}, {n} = excluded.{n}, {d} = excluded.{d}""")
+
+@cached_query
 def get_latest_prices():
-    """Fetches the most recent purchase price for EVERY variety (for the ticker)."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    query = """
-        SELECT i.paddy_type, i.base_rate
-        FROM bill_items i
-        JOIN bills b ON i.bill_no = b.bill_no
-        GROUP BY i.paddy_type
-        ORDER BY b.bill_date DESC
-    """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
\ No newline at end of file
+    """The most recent purchase rate (base_rate) of every variety, with its bill, and the last sale rate (for the ticker)."""
+    conn = get_connection()
+    query = "SELECT paddy_type, rate AS base_rate, bill_no, bill_date, sale_rate, sale_date FROM latest_prices WHERE rate IS NOT NULL ORDER BY paddy_type"
+    return pd.read_sql_query(query, conn)
+
+# ======================================================================================
+# MARKET SIGNALS (EVALUATED IN BATCH BY market_analytics.refresh_signals)
+# ======================================================================================
+# One row per variety and purchase day the signal was evaluated for (as_of), so the table keeps
+# each variety's signal history. Rows are only written when a value changed: an unchanged
+# evaluation keeps its computed_at and does not drop the query cache.
+
+MARKET_SIGNAL_COLUMNS = ("signal", "rate", "high_52w", "low_52w", "ma_short", "ma_long", "pct_rank", "volatility")
+
+def save_market_signals(rows):
+    """Stores evaluated signals, rows = [(paddy_type, as_of, <MARKET_SIGNAL_COLUMNS>)] for every variety with purchases.
+    Values are kept to 2 decimals. Rows dated after a variety's as_of (its newer purchases were since removed) and
+    varieties missing from `rows` are dropped. Returns the number of rows written or removed, or "Error: ..."."""
+    conn = get_connection()
+    rows = [(p, d, sig, *(None if v is None or v != v else round(float(v), 2) for v in vals)) for p, d, sig, *vals in rows]
+    stored = {r[:2]: r[2:] for r in conn.execute(f"SELECT paddy_type, as_of, {', '.join(MARKET_SIGNAL_COLUMNS)} FROM market_signals s "
+                                                  "WHERE as_of = (SELECT MAX(as_of) FROM market_signals WHERE paddy_type = s.paddy_type)")}
+    changed = [r for r in rows if stored.get(r[:2]) != tuple(r[2:])]
+    newest = {p: d for p, d, *_ in rows}
+    stale = [(p, newest.get(p, "")) for p, d in stored if d > newest.get(p, "")]
+    if not changed and not stale: return 0  # an unchanged evaluation neither writes nor drops the cache
+    result = _run_write(_save_market_signals, changed, stale)
+    if not isinstance(result, str): bump_generation()
+    return result
+
+def _save_market_signals(cursor, changed, stale):
+    now = datetime.now().isoformat(timespec="seconds")
+    cursor.executemany("DELETE FROM market_signals WHERE paddy_type = ? AND as_of > ?", stale)
+    cursor.executemany(f"""INSERT INTO market_signals (paddy_type, as_of, {', '.join(MARKET_SIGNAL_COLUMNS)}, computed_at)
+        VALUES ({', '.join('?' * (len(MARKET_SIGNAL_COLUMNS) + 3))})
+        ON CONFLICT(paddy_type, as_of) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in MARKET_SIGNAL_COLUMNS)}, computed_at = excluded.computed_at""",
+        [(*r, now) for r in changed])
+    return len(changed) + len(stale)
+
+@cached_query
+def get_market_signals():
+    """The newest stored signal of every variety, with prev_signal (the one evaluated before it, None at first)."""
+    query = f"""SELECT s.paddy_type, s.as_of, {', '.join(f's.{c}' for c in MARKET_SIGNAL_COLUMNS)}, s.computed_at,
+            (SELECT p.signal FROM market_signals p WHERE p.paddy_type = s.paddy_type AND p.as_of < s.as_of ORDER BY p.as_of DESC LIMIT 1) AS prev_signal
+        FROM market_signals s WHERE s.as_of = (SELECT MAX(as_of) FROM market_signals WHERE paddy_type = s.paddy_type) ORDER BY s.paddy_type"""
+    return pd.read_sql_query(query, get_connection())
+
+# ======================================================================================
+# QUERY PLAN CHECKS
+# ======================================================================================
+
+# name -> (sql, sample params). Every entry must be answered through an index, never a full table SCAN.
+QUERY_PLAN_CHECKS = {
+    "report data (bills by date)": (REPORT_DATA_SQL, ("2024-04-01", "2025-03-31")),
+    "stock ledger page (one variety)": (LEDGER_PAGE_SQL.format(where="paddy_type = :paddy_type AND (date, log_id) < (:date, :log_id)"),
+                                        {"paddy_type": "SONA", "date": "2025-01-01", "log_id": 1000, "bags": 0, "weight": 0, "limit": LEDGER_PAGE_SIZE}),
+    "stock ledger page (all varieties)": (LEDGER_PAGE_SQL.format(where="(date, log_id) < (:date, :log_id)"),
+                                          {"date": "2025-01-01", "log_id": 1000, "bags": 0, "weight": 0, "limit": LEDGER_PAGE_SIZE}),
+    "archive page (all bills)": (ARCHIVE_BRANCH_SQL.format(kind="SALE", table="sales_bills", where="(b.bill_date, b.bill_no) < (:value, :bill_no)", sort_expr="b.bill_date", direction="DESC")
+                                 + " UNION ALL " + ARCHIVE_BRANCH_SQL.format(kind="PURCHASE", table="bills", where="b.bill_date <= :value", sort_expr="b.bill_date", direction="DESC")
+                                 + " ORDER BY bill_date DESC, type DESC, bill_no DESC LIMIT :limit", {"value": "2025-01-01", "bill_no": 50, "limit": ARCHIVE_PAGE_SIZE}),
+    "archive search (bill no / party / lorry)": (ARCHIVE_BRANCH_SQL.format(kind="PURCHASE", table="bills", where=" AND ".join(_archive_filters("PURCHASE", "x", None)), sort_expr="b.bill_date", direction="DESC"),
+                                                 {"match": search_match("PARTY 04"), "limit": ARCHIVE_PAGE_SIZE}),
+    "daily rollup totals": ("SELECT SUM(r.bills), SUM(r.net) FROM daily_rollup r WHERE r.source = 'PURCHASE' AND r.day BETWEEN ? AND ? AND r.party_id = 0 AND r.paddy_type = ''", ("2024-04-01", "2025-03-31")),
+    "ledger rows of one bill": ("SELECT * FROM inventory_log WHERE type = 'PURCHASE' AND ref_id = ?", (1,)),
+    "purchase bill items": ("SELECT * FROM bill_items WHERE bill_no = ?", (1,)),
+    "sales bill items": ("SELECT * FROM sales_bill_items WHERE bill_no = ?", (1,)),
+    "sales bills by date": ("SELECT * FROM sales_bills WHERE bill_date BETWEEN ? AND ?", ("2024-04-01", "2025-03-31")),
+    "processing report": (PROCESSING_REPORT_SQL.format(s="main") + " ORDER BY date DESC", ("2024-04-01", "2025-03-31")),
+    "processing variety stats": (PROCESSING_VARIETY_SQL.format(rollup="daily_rollup"), ("2024-04-01", "2025-03-31")),
+    "batch items by batch no": (BATCH_ITEMS_SQL, ("1/24-25",)),
+    "next batch of a financial year": (SEQUENCES["BATCH"], ("2024-2025",)),
+    "price history": (PRICE_HISTORY_SQL.format(s="main") + " ORDER BY date ASC", ("SONA",)),
+    "price bars (one variety, one month)": (PRICE_BARS_SQL.format(bucket="day", lines=PRICE_LINES_SQL.format(s="main")), {"paddy_type": "SONA", "start": "2025-01-01", "end": "2025-01-31"}),
+    "party bill history page": (ARCHIVE_BRANCH_SQL.format(kind="PURCHASE", table="bills", where=" AND ".join(_archive_filters("PURCHASE", "", 1) + ["(b.bill_date, b.bill_no) < (:value, :bill_no)"]),
+                                                         sort_expr="b.bill_date", direction="DESC"), {"party_id": 1, "value": "2025-01-01", "bill_no": 50, "limit": ARCHIVE_PAGE_SIZE}),
+    "party aggregates of one year": (PARTY_AGGREGATE_SOURCE_SQL.format(where="r.source = ? AND r.party_id = ? AND r.day BETWEEN ? AND ?"), ("PURCHASE", 1, "2024-04-01", "2025-03-31")),
+    "newest purchase of a variety": ("SELECT MAX(date) FROM inventory_log WHERE paddy_type = ? AND type = ?", ("SONA", "PURCHASE")),
+}
+
+def explain_query_plans():
+    """Returns {check name: (uses_index, [plan lines])} from EXPLAIN QUERY PLAN."""
+    cursor = get_connection().cursor(); results = {}
+    for name, (sql, params) in QUERY_PLAN_CHECKS.items():
+        lines = [r[3] for r in cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+        full_scans = [l for l in lines if l.startswith("SCAN") and "USING" not in l and "subquery" not in l.lower()
+                      and not re.search(r"VIRTUAL TABLE INDEX \d+:M", l)]  # FTS5 MATCH lookups are index reads
+        results[name] = (not full_scans, lines)
+    return results
+
+# ======================================================================================
+# MAINTENANCE COMMANDS
+# ======================================================================================
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Rice mill database maintenance")
+    parser.add_argument("--db", default=DATABASE_FILE, help="database file (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild-inventory", help="wipe and re-derive inventory_log from all bills and batches")
+    sub.add_parser("sync-inventory", help="run the incremental startup sync")
+    sub.add_parser("verify-stock", help="recompute stock_balances from inventory_log and repair any drift")
+    sub.add_parser("migrate", help="apply pending schema migrations")
+    sub.add_parser("explain", help="show EXPLAIN QUERY PLAN for the report queries")
+    sub.add_parser("reindex-search", help="rebuild the global search index")
+    sub.add_parser("rebuild-rollups", help="re-derive the daily report rollups from all bills and batches")
+    find = sub.add_parser("search", help="query the global search index"); find.add_argument("text")
+    close = sub.add_parser("close-year", help="move a finished financial year (e.g. 2023-2024) into its archive file")
+    close.add_argument("fy")
+    sub.add_parser("list-years", help="list the closed financial years and their archive files")
+    imp = sub.add_parser("import-bills", help="bulk load historical bills from a CSV (one line per item)")
+    imp.add_argument("csv_path"); imp.add_argument("--kind", choices=list(IMPORT_TARGETS), default="purchase")
+    args = parser.parse_args()
+    DATABASE_FILE = args.db
+    setup_database()
+    if args.command == "rebuild-inventory": print(rebuild_inventory_from_bills())
+    elif args.command == "sync-inventory": print(sync_inventory())
+    elif args.command == "verify-stock":
+        for p_type, got, exp in verify_stock_balances(repair=True): print(f"{p_type}: stored {got} != ledger {exp} (repaired)")
+    elif args.command == "migrate": print(f"schema version {migrate_database()}")
+    elif args.command == "import-bills":
+        report = import_bills(args.csv_path, args.kind, progress=lambda r: print(f"  ... {r['bills']:,} bills"))
+        print(f"{report['bills']:,} bills, {report['items']:,} items, {report['skipped']:,} skipped in {report['seconds']:.1f}s ({report['bills_per_sec']:,.0f} bills/sec)")
+    elif args.command == "reindex-search": print(f"{reindex_search()} documents indexed")
+    elif args.command == "rebuild-rollups": print(f"{rebuild_rollups()} rollup rows")
+    elif args.command == "close-year": print(close_financial_year(args.fy))
+    elif args.command == "list-years":
+        for fy, path, start, end, bills, sales, batches, closed_at in get_year_archives(): print(f"{fy}  {path:<32} {bills:>8,} bills {sales:>8,} sales {batches:>6,} batches  closed {closed_at}")
+    elif args.command == "search":
+        for kind, ref, d, title, detail in search(args.text): print(f"{kind:<9} {str(ref):<10} {d:<10} {title}  {detail}")
+    elif args.command == "explain":
+        for name, (indexed, lines) in explain_query_plans().items():
+            print(f"[{'OK' if indexed else 'FULL SCAN'}] {name}")
+            for line in lines: print(f"    {line}")
+    close_all_connections()
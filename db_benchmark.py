@@ -0,0 +1,566 @@
+"""Micro-benchmarks for the database layer.
+
+Every benchmark runs against a throw-away database seeded with synthetic bills,
+never against the live rice_mill.db.
+
+    python db_benchmark.py connections
+    python db_benchmark.py import
+    python db_benchmark.py background
+    python db_benchmark.py virtual-table
+    python db_benchmark.py search
+    python db_benchmark.py rollups
+    python db_benchmark.py numbering
+    python db_benchmark.py counters
+    python db_benchmark.py write-queue
+    python db_benchmark.py year-close
+    python db_benchmark.py backup
+    python db_benchmark.py export
+    python db_benchmark.py stock-value
+    python db_benchmark.py stock-as-of
+    python db_benchmark.py latest-prices
+    python db_benchmark.py price-chart
+    python db_benchmark.py rolling-stats
+    python db_benchmark.py party-dashboard
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import pandas as pd
+
+import background_tasks
+import backup
+import bill_calculator
+import database
+import parquet_export
+import write_queue
+from paged_rows import PageCache, TableSource
+
+VARIETIES = ["SONA", "IR64", "RNR", "HMT", "BPT", "JSR", "KOLAM", "MTU1010"]
+PARTIES = [f"PARTY {n:03d}" for n in range(1, 121)]
+
+# ======================================================================================
+# SYNTHETIC DATA
+# ======================================================================================
+
+def make_purchase(bill_no, bill_date, rng):
+    """Builds raw (fields, rows) for one purchase bill, as typed into BillingFrame."""
+    rows = [{"paddy_type": variety, "bags": rng.randint(20, 200), "moisture": round(rng.uniform(12, 18), 1),
+             "base_rate": rng.randint(1800, 2600)} for variety in rng.sample(VARIETIES, rng.randint(1, 3))]
+    total_bags = sum(r["bags"] for r in rows)
+    fields = {"bill_no": bill_no, "party_name": rng.choice(PARTIES), "date": bill_date,
+              "lorry_no": f"MH{rng.randint(10, 50)}AB{rng.randint(1000, 9999)}", "total_bags": total_bags,
+              "truck_weight1_kg": total_bags * 0.75, "truck_weight2_kg": 0, "truck_weight3_kg": 0,
+              "discount_percent": 0, "brokerage": 0, "hamali": 0, "others_desc": "", "others_amount": 0}
+    return fields, rows
+
+def synthetic_purchases(n_bills, seed=7, first_no=1):
+    """Yields `n_bills` raw purchase bills spread evenly over the last three years."""
+    rng = random.Random(seed); start = date.today() - timedelta(days=3 * 365)
+    for n in range(n_bills):
+        day = (start + timedelta(days=n * 3 * 365 // max(n_bills, 1))).isoformat()
+        yield make_purchase(first_no + n, day, rng)
+
+def seed_database(path, n_bills=2000, seed=7):
+    """Creates a fresh database at `path` holding `n_bills` purchase bills."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix): os.remove(path + suffix)
+    database.close_all_connections()
+    database.DATABASE_FILE = path
+    database.setup_database()
+    database.import_bills(synthetic_purchases(n_bills, seed))
+    return path
+
+def timed(fn, repeat):
+    """Returns per-call latencies in microseconds."""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); samples.append((time.perf_counter() - t0) * 1e6)
+    return samples
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"  {label:<44} median {statistics.median(samples):9.1f} us   p95 {p95:9.1f} us")
+
+# ======================================================================================
+# BENCHMARKS
+# ======================================================================================
+
+def bench_connections(workdir, repeat=500):
+    """Per-call latency of short lookups: connect-per-call (old) vs pooled connection (new)."""
+    path = seed_database(os.path.join(workdir, "bench.db"))
+    lookups = {
+        "stock check (inventory_log SUM)": ("SELECT SUM(bags_change), SUM(weight_change_kg) FROM inventory_log WHERE paddy_type = ?", ("SONA",)),
+        "party lookup by name": ("SELECT party_id FROM parties WHERE party_name = ?", ("PARTY 042",)),
+        "paddy master list": ("SELECT * FROM paddy_varieties ORDER BY variety_name", ()),
+    }
+    print(f"connections: {repeat} calls each against {path}")
+    for label, (sql, params) in lookups.items():
+        def legacy():
+            conn = sqlite3.connect(path); conn.execute(sql, params).fetchall(); conn.close()
+        def pooled():
+            database.execute_query(sql, params, fetch="all")
+        report(f"{label} [connect per call]", timed(legacy, repeat))
+        report(f"{label} [pooled]", timed(pooled, repeat))
+    database.close_all_connections()
+
+def bench_import(workdir, n_bills=100_000):
+    """Bulk import throughput vs. saving the same bills one by one through add_bill()."""
+    path = seed_database(os.path.join(workdir, "import.db"), n_bills=0)
+    print(f"import: {n_bills:,} purchase bills")
+    report = database.import_bills(synthetic_purchases(n_bills))
+    print(f"  import_bills      {report['bills']:>9,} bills {report['items']:>9,} items  {report['seconds']:7.1f} s  {report['bills_per_sec']:9,.0f} bills/sec")
+    sample = min(2000, n_bills)
+    t0 = time.perf_counter()
+    for fields, rows in synthetic_purchases(sample, seed=11, first_no=n_bills + 1):
+        database.add_bill(*bill_calculator.calculate_purchase_bill(fields, rows))
+    per_sec = sample / (time.perf_counter() - t0)
+    print(f"  add_bill (sample) {sample:>9,} bills                     {per_sec:9,.0f} bills/sec")
+    print(f"  ledger consistent: {database.inventory_is_consistent(database.get_connection().cursor())}, stock drift: {len(database.verify_stock_balances())} varieties")
+    database.close_all_connections()
+
+def bench_background(workdir, n_bills=50_000, tick_ms=5):
+    """Longest main-loop stall while a full-range report loads inline vs. through background_tasks.
+
+    Simulates the Tk loop headlessly: a tick every `tick_ms` that also pumps finished jobs.
+    """
+    path = seed_database(os.path.join(workdir, "background.db"), n_bills=n_bills)
+    start, end = "2000-01-01", date.today().isoformat()
+    def report_job():
+        database.bump_generation()  # measure the query, not the result cache
+        df = database.get_report_data_with_items(start, end)
+        return df.drop_duplicates('bill_no').groupby('party_name')['net_payable'].sum()
+    print(f"background: full-range purchase report over {n_bills:,} bills, {tick_ms} ms UI tick")
+
+    t0 = time.perf_counter(); report_job()
+    print(f"  inline (old)      main loop blocked for {(time.perf_counter() - t0) * 1000:9.1f} ms")
+
+    delivered = []
+    def run_loop(submit_jobs):
+        submit_jobs()
+        worst, last = 0.0, time.perf_counter()
+        while background_tasks.is_pending("bench") or not delivered:
+            time.sleep(tick_ms / 1000); background_tasks.pump()
+            now = time.perf_counter(); worst = max(worst, now - last); last = now
+        return worst * 1000
+    worst = run_loop(lambda: background_tasks.submit(None, "bench", report_job, on_done=delivered.append))
+    print(f"  background        longest tick gap           {worst:9.1f} ms  (tick {tick_ms} ms)")
+
+    delivered.clear()
+    def five_quick_refreshes():
+        for _ in range(5): background_tasks.submit(None, "bench", report_job, on_done=delivered.append)
+    run_loop(five_quick_refreshes)
+    print(f"  5 quick refreshes delivered {len(delivered)} result(s); stats {background_tasks.get_stats()}")
+    background_tasks.shutdown()
+
+def bench_virtual_table(workdir, sizes=(10_000, 50_000, 200_000), visible=25):
+    """Open time and retained memory of the archive list: load-everything (old) vs. PageCache (VirtualTable)."""
+    print(f"virtual-table: archive list open + scroll, {visible} visible rows")
+    for n_bills in sizes:
+        seed_database(os.path.join(workdir, f"virtual_{n_bills}.db"), n_bills=n_bills)
+        database.bump_generation()
+
+        tracemalloc.start(); t0 = time.perf_counter()
+        rows = database.get_connection().execute("SELECT b.bill_no, b.bill_date, p.party_name, b.total_bags, b.net_payable FROM bills b JOIN parties p ON b.party_id = p.party_id").fetchall()
+        records = sorted((("PURCHASE",) + tuple(r) for r in rows), key=lambda r: r[2], reverse=True)
+        legacy_ms, legacy_kb = (time.perf_counter() - t0) * 1000, tracemalloc.get_traced_memory()[0] / 1024
+        tracemalloc.stop(); del rows, records
+
+        source = TableSource(lambda after, limit, sort, desc: database.get_transactions_page("ALL", "", after, limit, sort, desc),
+                             lambda: database.count_transactions(), sort="bill_date")
+        tracemalloc.start(); t0 = time.perf_counter()
+        cache = PageCache(source); epoch = cache.reset(); cache.load_total(epoch)
+        cache.load(cache.missing_pages(0, visible), epoch)
+        first = [cache.get(i) for i in range(visible)]
+        open_ms = (time.perf_counter() - t0) * 1000
+        for top in range(0, 5_000, visible):  # scroll 5,000 rows down, a screen at a time
+            cache.load(cache.missing_pages(top, top + visible), epoch)
+        kb = tracemalloc.get_traced_memory()[0] / 1024
+        tracemalloc.stop()
+        print(f"  {n_bills:>8,} bills  load-all {legacy_ms:8.1f} ms {legacy_kb:9,.0f} KiB   "
+              f"virtual open {open_ms:6.1f} ms, after scrolling 5,000 rows {kb:6,.0f} KiB ({cache.stats['fetches']} page fetches)")
+    database.close_all_connections()
+
+def bench_search(workdir, n_bills=500_000, repeat=50):
+    """Global search latency: FTS5 search_index vs. the LIKE scan over bills + parties it replaces."""
+    t0 = time.perf_counter()
+    seed_database(os.path.join(workdir, "search.db"), n_bills=n_bills)
+    print(f"search: {n_bills:,} bills (seed incl. index triggers {time.perf_counter() - t0:.1f} s)")
+    conn = database.get_connection()
+    lorry = conn.execute("SELECT lorry_no FROM bills LIMIT 1 OFFSET ?", (n_bills // 2,)).fetchone()[0]
+    like_sql = ("SELECT b.bill_no, b.bill_date, p.party_name, b.lorry_no FROM bills b JOIN parties p ON b.party_id = p.party_id "
+                "WHERE CAST(b.bill_no AS TEXT) LIKE :q OR p.party_name LIKE :q OR b.lorry_no LIKE :q ORDER BY b.bill_date DESC LIMIT 50")
+    # LIKE stops after 50 hits in date order, so it is only slow when the text is rare
+    for label, text in (("party name", "PARTY 042"), ("lorry prefix", lorry[:6]), ("lorry no", lorry), ("bill no", str(n_bills // 3))):
+        def fts():
+            database.bump_generation(); database.search(text)
+        def like():
+            conn.execute(like_sql, {"q": f"%{text}%"}).fetchall()
+        report(f"{label} '{text}' [LIKE scan]", timed(like, max(3, repeat // 10)))
+        report(f"{label} '{text}' [search_index]", timed(fts, repeat))
+    database.close_all_connections()
+
+def bench_rollups(workdir, n_bills=200_000, repeat=5):
+    """Report screens: aggregating the raw bills (old) vs. reading daily_rollup."""
+    seed_database(os.path.join(workdir, "rollups.db"), n_bills=n_bills)
+    conn, start, end = database.get_connection(), (date.today() - timedelta(days=365)).isoformat(), date.today().isoformat()
+    print(f"rollups: {n_bills:,} bills, {conn.execute('SELECT COUNT(*) FROM daily_rollup').fetchone()[0]:,} rollup rows, one-year report range")
+
+    def dashboard_raw():  # what ReportsFrame.fetch_report did before
+        df = pd.read_sql_query(database.REPORT_DATA_SQL, conn, params=(start, end))
+        bills = df.drop_duplicates('bill_no')
+        bills.groupby('party_name')['net_payable'].sum().nlargest(5); bills.groupby('bill_date')['final_truck_weight_kg'].sum()
+        df.assign(w=df.base_rate * df.item_weight).groupby('paddy_type')[['item_weight', 'w']].sum()
+    def dashboard_rollup():
+        database.get_report_bills(start, end); database.get_rollup("PURCHASE", start, end)
+        database.get_rollup("PURCHASE", start, end, by="party"); database.get_rollup("PURCHASE", start, end, by="day")
+        database.get_purchase_variety_stats(start, end)
+    seasonal_raw = ("SELECT strftime('%m', b.bill_date) as month, SUM(b.total_bags), AVG(i.base_rate) FROM bills b "
+                    "JOIN bill_items i ON b.bill_no = i.bill_no GROUP BY month ORDER BY month")
+    rankings_raw = ("SELECT p.party_name, AVG(i.base_rate) as avg_rate, SUM(i.bags) FROM bill_items i JOIN bills b ON i.bill_no = b.bill_no "
+                    "JOIN parties p ON b.party_id = p.party_id GROUP BY p.party_name ORDER BY avg_rate LIMIT 10")
+    cases = {
+        "financial report (1 year)": (dashboard_raw, dashboard_rollup),
+        "seasonal buying stats (all time)": (lambda: conn.execute(seasonal_raw).fetchall(), database.get_seasonal_buying_stats),
+        "supplier rankings (all time)": (lambda: conn.execute(rankings_raw).fetchall(), database.get_supplier_rankings),
+    }
+    for label, (raw, rollup) in cases.items():
+        def fresh():
+            database.bump_generation(); rollup()  # measure the query, not the result cache
+        report(f"{label} [raw bills]", timed(raw, repeat))
+        report(f"{label} [daily_rollup]", timed(fresh, repeat))
+    t0 = time.perf_counter(); database.rebuild_rollups()
+    print(f"  rebuild-rollups   {time.perf_counter() - t0:7.2f} s")
+    database.close_all_connections()
+
+def bench_numbering(workdir, counters=8, saves=100, n_batches=20_000):
+    """Counters saving at the same time: number read at form load (old) vs. allocated on save (sequences)."""
+    seed_database(os.path.join(workdir, "numbering.db"), n_bills=1000)
+    database.add_processing_batch(date.today().isoformat(), [{"paddy_type": "SONA", "bags": 1}])  # makes the bench variety checkable
+    print(f"numbering: {counters} counters x {saves} saves each")
+
+    def run(save):
+        results, threads = [], []
+        def counter(seed):
+            rng = random.Random(seed)
+            for fields, rows in synthetic_purchases(saves, seed=seed):
+                results.append(save(rng, *bill_calculator.calculate_purchase_bill(fields, rows)))
+            database.close_connection()
+        threads = [threading.Thread(target=counter, args=(n,)) for n in range(counters)]
+        t0 = time.perf_counter()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        return results, time.perf_counter() - t0
+
+    def form_load(rng, header, items):  # old flow: number shown on the form is the number saved
+        header = dict(header, bill_no=database.get_next_bill_number())
+        time.sleep(rng.uniform(0, 0.002))  # operator finishing the bill
+        return database.add_bill(header, items)
+    def on_save(rng, header, items):
+        time.sleep(rng.uniform(0, 0.002))
+        return database.add_bill(dict(header, bill_no=None), items)
+    for label, save in (("number at form load", form_load), ("allocated on save", on_save)):
+        first = database.get_next_bill_number()
+        results, seconds = run(save)
+        nos = sorted(r for r in results if isinstance(r, int))
+        gapless = nos == list(range(first, first + len(nos)))
+        print(f"  {label:<22} saved {len(nos):>4}/{len(results)}  failed {len(results) - len(nos):>4}  "
+              f"unique {len(set(nos)) == len(nos)}  gapless {gapless}  {seconds:6.2f} s")
+
+    # Batch numbers: parse every "N/YY-YY" of the year (old) vs. read the sequence
+    fy = database.get_financial_year(date.today().isoformat())
+    conn = database.get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany("INSERT INTO processing_batches (batch_no, batch_seq, date, financial_year, total_input_bags, total_input_weight_kg) VALUES (?, ?, ?, ?, 0, 0)",
+                     [(database.format_batch_no(n, fy), n, date.today().isoformat(), fy) for n in range(2, n_batches + 2)])
+    conn.commit()
+    def parse_all():
+        max_num = 0
+        for (batch_no,) in conn.execute("SELECT batch_no FROM processing_batches WHERE financial_year = ?", (fy,)):
+            max_num = max(max_num, int(batch_no.split('/')[0]))
+        return max_num + 1
+    assert parse_all() == database.preview_number("BATCH", fy)
+    report(f"next batch no, {n_batches:,} in year [parse all]", timed(parse_all, 50))
+    report(f"next batch no, {n_batches:,} in year [sequence]", timed(lambda: database.get_next_batch_number(date.today().isoformat()), 50))
+
+    threads = [threading.Thread(target=lambda: (database.add_processing_batch(date.today().isoformat(), [{"paddy_type": "SONA", "bags": 1}]), database.close_connection()))
+               for _ in range(counters * 4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    seqs = [r[0] for r in database.get_connection().execute("SELECT batch_seq FROM processing_batches WHERE financial_year = ? ORDER BY batch_seq", (fy,))]
+    print(f"  concurrent batches     {len(threads)} saved, sequence 1..{seqs[-1]} unique {len(set(seqs)) == len(seqs)} gapless {seqs == list(range(1, len(seqs) + 1))}")
+    database.close_all_connections()
+
+def _counter_process(path, legacy, seed, saves):
+    """One counter PC saving bills into the shared file.
+    legacy: the old write path - deferred BEGIN, a read (the party lookup) before the first write, no retry."""
+    database.DATABASE_FILE = path
+    if legacy:
+        database.begin_write = lambda conn, cursor=None: (cursor or conn.cursor()).execute("BEGIN").execute("SELECT COUNT(*) FROM parties")
+        database.commit = lambda conn: conn.commit()
+    errors, t0 = [], time.perf_counter()
+    for fields, rows in synthetic_purchases(saves, seed=seed):
+        res = database.add_bill(*bill_calculator.calculate_purchase_bill(dict(fields, bill_no=None), rows))
+        if not isinstance(res, int): errors.append(res)
+    return saves - len(errors), errors, time.perf_counter() - t0, database.get_write_stats()
+
+def bench_counters(workdir, terminals=3, saves=300):
+    """Several counter processes saving into one file at once: old deferred writes vs. begin_write()."""
+    print(f"counters: {terminals} processes x {saves} bills each")
+    ctx = multiprocessing.get_context("spawn")
+    for label, legacy in (("deferred BEGIN (old)", True), ("BEGIN IMMEDIATE + retry", False)):
+        path = seed_database(os.path.join(workdir, f"counters_{legacy}.db"), n_bills=1000)
+        database.close_all_connections()
+        t0 = time.perf_counter()
+        with ctx.Pool(terminals) as pool:
+            results = pool.starmap(_counter_process, [(path, legacy, 100 + n, saves) for n in range(terminals)])
+        seconds = time.perf_counter() - t0
+        saved = sum(r[0] for r in results); errors = [e for r in results for e in r[1]]
+        on_file = database.execute_query("SELECT COUNT(*) FROM bills", fetch="one")[0] - 1000
+        retries = sum(r[3]["retries"] for r in results); max_wait = max(r[3]["max_wait_ms"] for r in results)
+        print(f"  {label:<24} saved {saved:>5}/{terminals * saves}  on file {on_file:>5}  failed {len(errors):>4}  "
+              f"{saved / seconds:7.0f} bills/sec  retries {retries}  max lock wait {max_wait:6.0f} ms")
+        if errors: print(f"    first error: {errors[0]}")
+        database.close_all_connections()
+
+def bench_write_queue(workdir, threads=8, saves=250):
+    """Burst of saves from several threads: one transaction per save vs. the write_queue group commit."""
+    print(f"write-queue: {threads} threads x {saves} purchase bills")
+    for journal, label, queued in [(j, l, q) for j in ("WAL", "DELETE") for l, q in (("transaction per save", False), ("write_queue group commit", True))]:
+        database.JOURNAL_MODE = journal
+        seed_database(os.path.join(workdir, f"write_queue_{journal}_{queued}.db"), n_bills=1000)
+        label = f"{label} [{journal}]"
+        if queued: write_queue.reset_stats(); write_queue.start()
+        results = []
+        def counter(seed):
+            for fields, rows in synthetic_purchases(saves, seed=seed):
+                results.append(database.add_bill(*bill_calculator.calculate_purchase_bill(dict(fields, bill_no=None), rows)))
+            database.close_connection()
+        workers = [threading.Thread(target=counter, args=(200 + n,)) for n in range(threads)]
+        t0 = time.perf_counter()
+        for t in workers: t.start()
+        for t in workers: t.join()
+        seconds = time.perf_counter() - t0
+        if queued: write_queue.stop()
+        saved = sum(isinstance(r, int) for r in results)
+        print(f"  {label:<35} saved {saved:>5}/{len(results)}  {saved / seconds:7.0f} bills/sec  "
+              f"ledger consistent: {database.inventory_is_consistent(database.get_connection().cursor())}")
+        if queued:
+            st = write_queue.get_stats()
+            print(f"    {st['commits']} commits, {st['avg_batch']:.1f} saves/commit (max {st['max_batch']}), max queue depth {st['max_depth']}, "
+                  f"commit {st['commit_ms_avg']:.1f} ms avg / {st['commit_ms_max']:.1f} max, save latency {st['wait_ms_avg']:.1f} ms avg / {st['wait_ms_max']:.1f} max")
+        database.close_all_connections()
+    database.JOURNAL_MODE = "WAL"
+
+def bench_year_close(workdir, n_bills=300_000, repeat=5):
+    """Whole-history queries on the live DB before and after closing every finished financial year."""
+    path = seed_database(os.path.join(workdir, "year_close.db"), n_bills=n_bills)
+    today = date.today().isoformat()
+    fy_now = database.get_financial_year(today); fy_start = database.fy_bounds(fy_now)[0]
+    cases = {
+        "startup sync_inventory": database.sync_inventory,
+        "verify-stock (full recompute)": database.verify_stock_balances,
+        "archive list count (all bills)": lambda: database.count_transactions("ALL"),
+        "stock ledger count (all varieties)": lambda: database.count_inventory_ledger(),
+        "current-year report": lambda: (database.get_report_bills(fy_start, today), database.get_rollup("PURCHASE", fy_start, today, by="party")),
+        "all-time report (attaches closed years)": lambda: (database.get_report_bills("2000-01-01", today), database.get_rollup("PURCHASE", "2000-01-01", today, by="party")),
+    }
+    def run(tag):
+        for label, fn in cases.items():
+            def fresh(): database.bump_generation(); fn()
+            report(f"{label} [{tag}]", timed(fresh, repeat))
+    print(f"year-close: {n_bills:,} bills over three years, live file {os.path.getsize(path) / 1e6:,.0f} MB")
+    run("one file")
+    first = database.get_connection().execute("SELECT MIN(bill_date) FROM bills").fetchone()[0]
+    fy, t0 = database.get_financial_year(first), time.perf_counter()
+    while fy < fy_now:
+        print(f"  {database.close_financial_year(fy)}")
+        fy = f"{int(fy[:4]) + 1}-{int(fy[:4]) + 2}"
+    print(f"  closed in {time.perf_counter() - t0:.1f} s; live bills left: {database.get_connection().execute('SELECT COUNT(*) FROM bills').fetchone()[0]:,}")
+    run("closed years archived")
+    database.close_all_connections()
+
+def bench_backup(workdir, n_bills=100_000, save_every_ms=20):
+    """Longest save stall while a snapshot is taken: stepped online backup vs. one locked copy."""
+    print(f"backup: {n_bills:,} bills, one purchase saved every {save_every_ms} ms during each phase")
+    for journal in ("WAL", "DELETE"):
+        database.JOURNAL_MODE = journal
+        path = seed_database(os.path.join(workdir, f"backup_{journal}.db"), n_bills=n_bills)
+        backup.BACKUP_DIR = f"backups_{journal}"
+        stop, latencies = threading.Event(), []
+        def counter():
+            for fields, rows in synthetic_purchases(1_000_000, seed=31):
+                if stop.is_set(): break
+                t = time.perf_counter()
+                database.add_bill(*bill_calculator.calculate_purchase_bill(dict(fields, bill_no=None), rows))
+                latencies.append((t, time.perf_counter() - t))
+                time.sleep(save_every_ms / 1000)
+            database.close_connection()
+        def locked_copy():
+            src, dest = sqlite3.connect(path), sqlite3.connect(os.path.join(workdir, f"locked_{journal}.db"))
+            src.backup(dest, pages=-1); src.close(); dest.close()
+        writer = threading.Thread(target=counter); writer.start()
+        phases = []
+        for label, fn in (("idle (no backup)", lambda: time.sleep(1.5)), ("backup.create_backup (stepped)", backup.create_backup),
+                          ("one-step locked copy", locked_copy)):
+            t0 = time.perf_counter(); result = fn(); t1 = time.perf_counter()
+            note = ""
+            if fn is backup.create_backup:
+                st = backup.get_last_backup()
+                note = (f"  {st['steps']} steps, {st['restarts']} restarts{' + one-step copy' if st['one_step'] else ''}, {st['bytes'] / 1e6:.0f} MB -> "
+                        f"{st['gz_bytes'] / 1e6:.0f} MB gz, verify: {backup.verify_backup(result)}" if st.get("error") is None else f"  {result}")
+            phases.append((label, t0, t1, note))
+            time.sleep(0.3)
+        stop.set(); writer.join()
+        for label, t0, t1, note in phases:
+            ms = sorted(l * 1000 for t, l in latencies if t <= t1 and t + l >= t0) or [0.0]  # saves overlapping the phase
+            print(f"  {label + ' [' + journal + ']':<42} {t1 - t0:6.2f} s  {len(ms):>4} saves  save p50 {ms[len(ms) // 2]:6.1f} ms  "
+                  f"p99 {ms[int(len(ms) * .99)]:6.1f} ms  max {ms[-1]:7.1f} ms{note}")
+        database.close_all_connections()
+    database.JOURNAL_MODE = "WAL"; backup.BACKUP_DIR = "backups"
+
+def bench_export(workdir, n_bills=200_000, new_bills=50, repeat=5):
+    """Parquet export: full first run, incremental run after a few saves, and one month read back vs. the SQL join."""
+    seed_database(os.path.join(workdir, "export.db"), n_bills=n_bills)
+    print(f"export: {n_bills:,} bills")
+    result = parquet_export.export()
+    if isinstance(result, str): print(f"  {result}"); return
+    print(f"  full export          {result['seconds']:6.1f} s  {result['months']} months, {result['files']} files, {result['rows']:,} rows")
+    last = database.get_connection().execute("SELECT MAX(bill_date) FROM bills").fetchone()[0]
+    for fields, rows in synthetic_purchases(new_bills, seed=41):
+        database.add_bill(*bill_calculator.calculate_purchase_bill(dict(fields, bill_no=None, date=last), rows))
+    result = parquet_export.export()
+    print(f"  after {new_bills} new bills  {result['seconds']:6.2f} s  {result['months']} months, {result['files']} files, {result['rows']:,} rows")
+    month = last[:7]
+    report(f"month {month} via SQL join (get_report_data_with_items)", timed(lambda: (database.bump_generation(), database.get_report_data_with_items(f"{month}-01", f"{month}-31")), repeat))
+    report(f"month {month} from Parquet (bill_items)", timed(lambda: parquet_export.read_dataset("bill_items", [month]), repeat))
+    database.close_all_connections()
+
+def bench_stock_value(workdir, n_bills=200_000, saves=200, repeat=20):
+    """Moving-average stock value: summary read, a save dated today, back-dated saves that re-cost the sales after them."""
+    seed_database(os.path.join(workdir, "stock_value.db"), n_bills=n_bills)
+    sales = [(dict(fields, bill_no=None), [{"paddy_type": r["paddy_type"], "bags": r["bags"] // 3, "rate": r["base_rate"] + 150} for r in rows])
+             for fields, rows in synthetic_purchases(n_bills // 4, seed=47)]
+    database.import_bills(sales, kind="sale")
+    conn = database.get_connection()
+    first, last = conn.execute("SELECT MIN(bill_date), MAX(bill_date) FROM bills").fetchone()
+    week_ago = (date.fromisoformat(last) - timedelta(days=7)).isoformat()
+    print(f"stock-value: {n_bills:,} bills, {conn.execute('SELECT COUNT(*) FROM inventory_log').fetchone()[0]:,} ledger rows")
+    report("get_inventory_summary", timed(lambda: (database.bump_generation(), database.get_inventory_summary()), repeat))
+    bills = iter(synthetic_purchases(saves, seed=53))
+    def save(day):
+        fields, rows = next(bills)
+        database.add_bill(*bill_calculator.calculate_purchase_bill(dict(fields, bill_no=None, date=day), rows))
+    report("add_bill dated today", timed(lambda: save(last), saves // 2))
+    report("add_bill a week back (re-costs its sales)", timed(lambda: save(week_ago), saves // 4))
+    report("add_bill on the first day (all sales)", timed(lambda: save(first), saves // 4))
+    t0 = time.perf_counter(); drift = database.verify_stock_balances()
+    print(f"  verify-stock                      {time.perf_counter() - t0:6.2f} s  drift: {len(drift)} varieties")
+    database.close_all_connections()
+
+STOCK_AS_OF_RAW_SQL = "SELECT paddy_type, SUM(bags_change), SUM(weight_change_kg), SUM(value_change) FROM inventory_log WHERE date <= ? GROUP BY paddy_type"
+
+def bench_stock_as_of(workdir, sizes=(20_000, 200_000), repeat=20):
+    """Stock on a past date: checkpoint + one month of ledger rows vs summing the ledger from the start."""
+    for n_bills in sizes:
+        seed_database(os.path.join(workdir, f"as_of_{n_bills}.db"), n_bills=n_bills)
+        conn = database.get_connection()
+        last = conn.execute("SELECT MAX(date) FROM inventory_log").fetchone()[0]
+        day = (date.fromisoformat(last) - timedelta(days=45)).isoformat()
+        print(f"stock-as-of {day}: {n_bills:,} bills, {conn.execute('SELECT COUNT(*) FROM stock_checkpoints').fetchone()[0]:,} checkpoints")
+        report("get_stock_as_of (checkpoints)", timed(lambda: (database.bump_generation(), database.get_stock_as_of(day)), repeat))
+        report("SUM over the ledger up to the date", timed(lambda: conn.execute(STOCK_AS_OF_RAW_SQL, (day,)).fetchall(), repeat))
+        database.close_all_connections()
+
+LATEST_PRICES_OLD_SQL = "SELECT i.paddy_type, i.base_rate FROM bill_items i JOIN bills b ON i.bill_no = b.bill_no GROUP BY i.paddy_type ORDER BY b.bill_date DESC"
+
+def bench_latest_prices(workdir, n_bills=200_000, repeat=20):
+    """Market ticker: the latest_prices table vs the old GROUP BY over every bill item (which also picked an arbitrary row)."""
+    seed_database(os.path.join(workdir, "latest_prices.db"), n_bills=n_bills)
+    conn = database.get_connection()
+    print(f"latest-prices: {n_bills:,} bills")
+    report("get_latest_prices (table)", timed(lambda: (database.bump_generation(), database.get_latest_prices()), repeat))
+    report("old GROUP BY over bill_items", timed(lambda: conn.execute(LATEST_PRICES_OLD_SQL).fetchall(), repeat))
+    exact = dict(conn.execute("SELECT paddy_type, rate FROM latest_prices").fetchall())
+    wrong = sum(exact[p] != rate for p, rate in conn.execute(LATEST_PRICES_OLD_SQL))
+    print(f"  old query disagreed with the newest bill on {wrong} of {len(exact)} varieties")
+    database.close_all_connections()
+
+def bench_price_chart(workdir, n_bills=200_000, width_px=600, repeat=10):
+    """Market chart data: every purchase line (old get_price_history) vs SQL bars + LTTB per zoom level."""
+    import market_analytics
+    seed_database(os.path.join(workdir, "price_chart.db"), n_bills=n_bills)
+    variety = VARIETIES[0]
+    lines = len(database.get_price_history(variety))
+    print(f"price-chart: {n_bills:,} bills, {variety}: {lines:,} purchase lines, chart {width_px} px")
+    report("get_price_history (every line)", timed(lambda: (database.bump_generation(), database.get_price_history(variety)), repeat))
+    for zoom in market_analytics.ZOOM_LEVELS:
+        points = len(market_analytics.price_series(variety, zoom, width_px))
+        report(f"price_series {zoom} ({points} bars)", timed(lambda: (database.bump_generation(), market_analytics.price_series(variety, zoom, width_px)), repeat))
+    database.close_all_connections()
+
+def bench_rolling_stats(workdir, n_bills=200_000, repeat=10):
+    """Market side panel: old full-history max/min/std per variety change vs one rolling pass (and signal refresh) over every variety."""
+    import market_analytics
+    seed_database(os.path.join(workdir, "rolling_stats.db"), n_bills=n_bills)
+    def old_panel():
+        for v in VARIETIES:
+            rate = database.get_price_history(v)['rate']; rate.max(), rate.min(), rate.std()
+    print(f"rolling-stats: {n_bills:,} bills, {len(VARIETIES)} varieties, {len(database.get_daily_purchase_prices()):,} variety-days")
+    report(f"old: full history of all {len(VARIETIES)} varieties", timed(lambda: (database.bump_generation(), old_panel()), repeat))
+    report("rolling_stats (all varieties, after a write)", timed(lambda: (database.bump_generation(), market_analytics.rolling_stats()), repeat))
+    report("latest_stats (cached)", timed(market_analytics.latest_stats, repeat * 10))
+    market_analytics.refresh_signals()
+    report("refresh_signals (all varieties, no change)", timed(market_analytics.refresh_signals, repeat * 10))
+    database.close_all_connections()
+
+def bench_party_dashboard(workdir, n_bills=200_000, repeat=20):
+    """Opening the biggest party's dashboard: KPIs summed from its bills vs party_aggregates, and its first history page."""
+    seed_database(os.path.join(workdir, "party_dashboard.db"), n_bills=n_bills)
+    conn = database.get_connection()
+    pid, bills = conn.execute("SELECT party_id, COUNT(*) FROM bills GROUP BY party_id ORDER BY 2 DESC LIMIT 1").fetchone()
+    print(f"party-dashboard: {n_bills:,} bills, biggest party has {bills:,}")
+    old = ("SELECT COUNT(*), SUM(net_payable), MAX(bill_date) FROM (SELECT net_payable, bill_date FROM bills WHERE +party_id = ? "
+           "UNION ALL SELECT net_payable, bill_date FROM sales_bills WHERE +party_id = ?)")  # unary +: no party index, as before
+    report("old: KPIs summed from the bills", timed(lambda: conn.execute(old, (pid, pid)).fetchone(), repeat))
+    report("get_party_kpis (party_aggregates)", timed(lambda: (database.bump_generation(), database.get_party_kpis(pid)), repeat))
+    report("first history page + count", timed(lambda: (database.bump_generation(), database.get_transactions_page("ALL", "", party_id=pid),
+                                                          database.count_transactions(party_id=pid)), repeat))
+    fy = database.get_financial_year(conn.execute("SELECT MIN(bill_date) FROM bills").fetchone()[0])
+    print(f"  {database.close_financial_year(fy)}")
+    report("first history page + count [year closed]", timed(lambda: (database.bump_generation(), database.get_transactions_page("ALL", "", party_id=pid),
+                                                                        database.count_transactions(party_id=pid)), repeat))
+    walked, after = 0, None
+    while True:  # the whole history, page by page, as the dashboard scrolls it
+        rows, after = database.get_transactions_page("ALL", "", after, party_id=pid); walked += len(rows)
+        if after is None: break
+    kpi = database.get_party_kpis(pid)["total_bills"]
+    print(f"  history after close: {walked:,} rows walked, count {database.count_transactions(party_id=pid):,}, KPI total_bills {kpi:,}"
+          f" -> {'OK' if walked == kpi == database.count_transactions(party_id=pid) else 'MISMATCH'}")
+    database.close_all_connections()
+
+BENCHMARKS = {"connections": bench_connections, "import": bench_import, "background": bench_background,
+              "virtual-table": bench_virtual_table, "search": bench_search,
+              "rollups": bench_rollups, "numbering": bench_numbering,
+              "counters": bench_counters, "write-queue": bench_write_queue,
+              "year-close": bench_year_close, "backup": bench_backup,
+              "export": bench_export, "stock-value": bench_stock_value,
+              "stock-as-of": bench_stock_as_of, "latest-prices": bench_latest_prices,
+              "price-chart": bench_price_chart, "rolling-stats": bench_rolling_stats,
+              "party-dashboard": bench_party_dashboard}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database layer benchmarks")
+    parser.add_argument("names", nargs="*", default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.names: BENCHMARKS[name](workdir)
@@ -3,6 +3,7 @@ from tkinter import messagebox, Toplevel, simpledialog
 from tkcalendar import Calendar
 from datetime import datetime
 import database
+import bill_calculator
 import pdf_generator
 
 # --- Custom Widgets (Same as BillingFrame) ---
@@ -186,11 +187,11 @@ class EditBillFrame(ctk.CTkFrame):
         try:
             s_float = lambda e: float(e.get()) if e.get().strip() else 0.0
             s_int = lambda e: int(e.get()) if e.get().strip() else 0
-            header = {"bill_no": s_int(self.bill_no), "party_name": self.party.get().upper(), "date": self.date.get(), "lorry_no": self.lorry.get().upper(), "total_bags": s_int(self.total_bags), "truck_weight1_kg": s_float(self.w1), "truck_weight2_kg": s_float(self.w2), "truck_weight3_kg": s_float(self.w3), "discount_percent": s_float(self.discount), "brokerage": s_float(self.brokerage), "hamali": s_float(self.hamali), "others_desc": self.others_d.get().upper(), "others_amount": s_float(self.others_a)}
-            if not header["party_name"]: return messagebox.showerror("Error", "PARTY NAME REQUIRED")
-            if header["total_bags"] == 0: return messagebox.showerror("Error", "TOTAL BAGS 0")
-            items = []
-            for r in self.item_rows: items.append({"paddy_type": r["type"].get().upper(), "bags": s_int(r["bags"]), "moisture": s_float(r["moist"]), "base_rate": s_float(r["rate"])})
+            fields = {"bill_no": s_int(self.bill_no), "party_name": self.party.get().upper(), "date": self.date.get(), "lorry_no": self.lorry.get().upper(), "total_bags": s_int(self.total_bags), "truck_weight1_kg": s_float(self.w1), "truck_weight2_kg": s_float(self.w2), "truck_weight3_kg": s_float(self.w3), "discount_percent": s_float(self.discount), "brokerage": s_float(self.brokerage), "hamali": s_float(self.hamali), "others_desc": self.others_d.get().upper(), "others_amount": s_float(self.others_a)}
+            if not fields["party_name"]: return messagebox.showerror("Error", "PARTY NAME REQUIRED")
+            if fields["total_bags"] == 0: return messagebox.showerror("Error", "TOTAL BAGS 0")
+            rows = [{"paddy_type": r["type"].get().upper(), "bags": s_int(r["bags"]), "moisture": s_float(r["moist"]), "base_rate": s_float(r["rate"])} for r in self.item_rows]
+            header, items = bill_calculator.calculate_purchase_bill(fields, rows)
             
             res = database.update_bill(self.editing_bill_no, header, items)
             
@@ -1,9 +1,12 @@
 import customtkinter as ctk
 from tkinter import ttk, messagebox
+from tkcalendar import DateEntry
 import pandas as pd
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import database
+import background_tasks
+from virtual_table import VirtualTable, TableSource
 
 # --- THEME COLORS ---
 THEME_COLOR = "#1f6aa5"
@@ -13,9 +16,14 @@ class InventoryReportsFrame(ctk.CTkFrame):
     def __init__(self, master):
         super().__init__(master, fg_color="transparent")
         self.df_summary = pd.DataFrame()
+        self.as_of = None  # None = live stock, else "YYYY-MM-DD" (stock at the end of that day)
         
         # --- TITLE ---
-        ctk.CTkLabel(self, text="INVENTORY INTELLIGENCE", font=("Arial", 20, "bold"), text_color=THEME_COLOR).pack(pady=(10,5), anchor="w", padx=20)
+        title_row = ctk.CTkFrame(self, fg_color="transparent")
+        title_row.pack(fill="x", padx=20, pady=(10,5))
+        ctk.CTkLabel(title_row, text="INVENTORY INTELLIGENCE", font=("Arial", 20, "bold"), text_color=THEME_COLOR).pack(side="left")
+        self.loading_lbl = ctk.CTkLabel(title_row, text="", font=("Arial", 12, "bold"), text_color="#ff9900")
+        self.loading_lbl.pack(side="left", padx=15)
 
         # --- KPI CARDS ---
         kpi_frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -62,7 +70,22 @@ class InventoryReportsFrame(ctk.CTkFrame):
             
         self.tree_stock.pack(fill="both", expand=True, padx=10, pady=10)
         
-        ctk.CTkButton(self.tab_stock, text="REFRESH DATA", command=self.load_inventory_data, fg_color=THEME_COLOR, height=40).pack(pady=10)
+        # 3. Point-in-time stock (from the monthly checkpoints)
+        bar = ctk.CTkFrame(self.tab_stock, fg_color="transparent")
+        bar.pack(pady=10)
+        ctk.CTkLabel(bar, text="STOCK AS OF:", font=("Arial", 12, "bold")).pack(side="left", padx=5)
+        self.as_of_entry = DateEntry(bar, width=12, background=THEME_COLOR, foreground='white', borderwidth=2, date_pattern='y-mm-dd')
+        self.as_of_entry.pack(side="left", padx=5)
+        ctk.CTkButton(bar, text="SHOW", command=self.show_as_of, fg_color=THEME_COLOR, width=80, height=40).pack(side="left", padx=5)
+        ctk.CTkButton(bar, text="LIVE / REFRESH DATA", command=self.show_live, fg_color=THEME_COLOR, height=40).pack(side="left", padx=5)
+
+    def show_as_of(self):
+        self.as_of = self.as_of_entry.get()
+        self.load_inventory_data()
+
+    def show_live(self):
+        self.as_of = None
+        self.load_inventory_data()
 
     def setup_ledger_tab(self):
         f = ctk.CTkFrame(self.tab_ledger, fg_color="transparent")
@@ -71,18 +94,36 @@ class InventoryReportsFrame(ctk.CTkFrame):
         self.filter_var = ctk.CTkOptionMenu(f, values=["ALL"], command=self.load_ledger_data)
         self.filter_var.pack(side="left", padx=5)
         
-        cols = ["DATE", "TYPE", "REF ID", "VARIETY", "BAGS CHANGE", "WEIGHT CHANGE (KG)"]
-        self.tree_ledger = ttk.Treeview(self.tab_ledger, columns=cols, show="headings", height=18)
-        
-        for c in cols: 
-            self.tree_ledger.heading(c, text=c)
-            self.tree_ledger.column(c, width=120, anchor="center")
-            
-        self.tree_ledger.pack(fill="both", expand=True, padx=10, pady=10)
+        # Virtualized: only the visible rows exist, pages are fetched as they scroll into view
+        cols = [("date", "DATE", 120, "center"), ("type", "TYPE", 120, "center"), ("ref_id", "REF ID", 120, "center"),
+                ("paddy_type", "VARIETY", 120, "center"), ("bags_change", "BAGS CHANGE", 120, "center"),
+                ("weight_change_kg", "WEIGHT CHANGE (KG)", 120, "center"), ("value_change", "VALUE (Rs)", 120, "center"),
+                ("bags_balance", "BAGS BAL.", 120, "center"),
+                ("weight_balance_kg", "STOCK BAL. (QTL)", 120, "center")]
+        self.ledger_table = VirtualTable(self.tab_ledger, cols, row_height=28)
+        self.ledger_table.pack(fill="both", expand=True, padx=10, pady=10)
+
+    def set_loading(self, busy):
+        loading = busy or background_tasks.is_pending("inventory.summary")
+        self.loading_lbl.configure(text="LOADING..." if loading else "")
+
+    def on_load_error(self, e):
+        self.set_loading(False)
+        messagebox.showerror("Error", f"Failed to load inventory: {e}")
 
     def load_inventory_data(self):
-        # 1. Summary Data
-        self.df_summary = database.get_inventory_summary()
+        # 1. Summary Data (fetched on a worker, drawn in show_inventory_data)
+        self.set_loading(True)
+        if self.as_of: fetch, args = database.get_stock_as_of, (self.as_of,)
+        else: fetch, args = database.get_inventory_summary, ()
+        background_tasks.submit(self, "inventory.summary", fetch, *args,
+                                on_done=self.show_inventory_data, on_error=self.on_load_error)
+
+    def show_inventory_data(self, df_summary):
+        self.set_loading(False)
+        if isinstance(df_summary, str):
+            messagebox.showerror("Error", df_summary); return
+        self.df_summary = df_summary
         
         # Reset KPIs
         if not self.df_summary.empty:
@@ -132,7 +173,7 @@ class InventoryReportsFrame(ctk.CTkFrame):
         bars = ax.bar(x, y, color=THEME_COLOR, alpha=0.8)
         ax.bar_label(bars, fmt='%.1f', padding=3, color='white', fontsize=9)
         
-        ax.set_title("CURRENT STOCK HOLDING (QTL)", color="white", fontsize=10, pad=10)
+        ax.set_title(f"STOCK HOLDING AS OF {self.as_of} (QTL)" if self.as_of else "CURRENT STOCK HOLDING (QTL)", color="white", fontsize=10, pad=10)
         ax.tick_params(axis='x', colors='white', labelsize=8)
         ax.tick_params(axis='y', colors='white', labelsize=8)
         ax.spines['bottom'].set_color('white')
@@ -146,16 +187,27 @@ class InventoryReportsFrame(ctk.CTkFrame):
         canvas.get_tk_widget().pack(fill="both", expand=True)
 
     def load_ledger_data(self, filter_val=None):
-        val = self.filter_var.get()
-        df = database.get_inventory_ledger(val)
-        self.tree_ledger.delete(*self.tree_ledger.get_children())
-        
-        for _, r in df.iterrows():
-            self.tree_ledger.insert("", "end", values=[
-                r['date'],
-                r['type'],
-                r['ref_id'],
-                r['paddy_type'],
-                f"{r['bags_change']:,.0f}",      # No decimals for bags
-                f"{r['weight_change_kg']:,.2f}"  # Max 2 decimals for weight
-            ])
\ No newline at end of file
+        """Restarts the ledger from the newest movement (filter changed or data refreshed)."""
+        variety = self.filter_var.get()
+        self.ledger_table.set_source(TableSource(
+            lambda after, limit, sort, desc: self.fetch_ledger_page(variety, after, limit),
+            lambda: database.count_inventory_ledger(variety), format_row=self.format_ledger_row))
+
+    @staticmethod
+    def fetch_ledger_page(variety, after, limit):
+        df, cursor = database.get_inventory_ledger_page(variety, after, limit)
+        return list(df.itertuples(index=False)), cursor
+
+    @staticmethod
+    def format_ledger_row(r):
+        return [
+            r.date,
+            r.type,
+            r.ref_id,
+            r.paddy_type,
+            f"{r.bags_change:,.0f}",      # No decimals for bags
+            f"{r.weight_change_kg:,.2f}", # Max 2 decimals for weight
+            f"{r.value_change:,.0f}",     # purchase amount, or the moving-average cost of an issue
+            f"{r.bags_balance:,.0f}",
+            f"{r.weight_balance_kg/100:,.2f}"
+        ], ()
@@ -1,4 +1,5 @@
 import customtkinter as ctk
+import tkinter as tk
 from tkinter import messagebox
 from billing_frame import BillingFrame
 from edit_bill_frame import EditBillFrame
@@ -14,6 +15,12 @@ from paddy_master_frame import PaddyMasterFrame
 from party_dashboard_frame import PartyDashboardFrame
 from all_bills_frame import AllBillsFrame 
 import database
+import background_tasks
+import write_queue
+import backup
+
+USE_WRITE_QUEUE = False  # route saves through one writer thread with group commit (see write_queue)
+AUTO_BACKUP = True       # online snapshot every backup.BACKUP_EVERY_MIN minutes while the app is open
 
 # --- STANDARD THEME ---
 ctk.set_appearance_mode("Dark")
@@ -82,6 +89,11 @@ class MainApp(ctk.CTk):
         self.btn_reports = self.create_nav_btn("  FINANCIAL REPORTS", "reports", 12)
         self.btn_party = self.create_nav_btn("  PARTY MASTERS", "party_masters", 13)
         self.btn_paddy = self.create_nav_btn("  PADDY MASTERS", "paddy_masters", 14)
+
+        # QUICK JUMP (bill no, party, GST, mobile, lorry or batch -> straight to its screen)
+        self.jump_entry = ctk.CTkEntry(self.sidebar, placeholder_text="Quick jump (bill, party, lorry...)")
+        self.jump_entry.grid(row=16, column=0, padx=10, pady=(10, 20), sticky="ew")
+        self.jump_entry.bind("<Return>", lambda e: self.quick_jump())
         
         # Main Area
         self.main_area = ctk.CTkFrame(self, fg_color="transparent")
@@ -140,6 +152,27 @@ class MainApp(ctk.CTk):
         elif hasattr(f, 'refresh_variety_list'): f.refresh_variety_list()
         elif hasattr(f, 'load_party_data') and "party_id" in kwargs: f.load_party_data(kwargs["party_id"])
 
+    def quick_jump(self):
+        """Shows the best search matches under the quick-jump box; picking one opens it"""
+        results = database.search(self.jump_entry.get(), limit=10)
+        menu = tk.Menu(self, tearoff=0)
+        if not results: menu.add_command(label="No matches", state="disabled")
+        for kind, ref, day, title, detail in results:
+            menu.add_command(label=f"{kind:<9} {title}   {day or ''}", command=lambda k=kind, r=ref: self.jump_to(k, r))
+        menu.tk_popup(self.jump_entry.winfo_rootx(), self.jump_entry.winfo_rooty() + self.jump_entry.winfo_height())
+
+    def jump_to(self, kind, ref):
+        if kind == "PURCHASE": self.load_bill_for_editing(ref)
+        elif kind == "PARTY": self.select_frame("party_dashboard", party_id=ref)
+        elif kind == "BATCH":
+            self.select_frame("processing_rep")
+            self.frames["processing_rep"].show_batch_details(ref)
+        else:  # SALE: sales bills are not editable, show it in the archive
+            archive = self.frames["all_bills"]
+            archive.filter_var.set("SALE")
+            archive.search_entry.delete(0, 'end'); archive.search_entry.insert(0, str(ref))
+            self.select_frame("all_bills")
+
     def load_bill_for_editing(self, bill_no):
         self.select_frame("edit_bill") 
         self.frames["edit_bill"].search_entry.delete(0, 'end')
@@ -148,5 +181,10 @@ class MainApp(ctk.CTk):
 
 if __name__ == "__main__":
     database.setup_database()
+    if USE_WRITE_QUEUE: write_queue.start()
+    if AUTO_BACKUP: backup.start()
     app = LoginApp()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+    backup.stop()  # lets a snapshot in progress finish
+    write_queue.stop()  # commits any queued saves
+    background_tasks.shutdown()  # also closes every pooled connection
\ No newline at end of file
@@ -2,6 +2,8 @@ import customtkinter as ctk
 from tkinter import ttk
 import pandas as pd
 import database
+import background_tasks
+import market_analytics
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import datetime
@@ -15,6 +17,12 @@ ACCENT_BLUE = "#58a6ff"   # Tech Blue
 TEXT_MAIN = "white"
 TEXT_SUB = "#8b949e"
 
+# market_analytics signal code -> (label, colour)
+SIGNAL_STYLES = {"STRONG_BUY": ("STRONG BUY 🟢", ACCENT_GREEN), "GOOD_VALUE": ("GOOD VALUE 🔵", ACCENT_BLUE),
+                 "OVERPRICED": ("OVERPRICED 🔴", ACCENT_RED), "HOLD": ("HOLD / NEUTRAL ⚪", "white")}
+SIGNAL_COLUMNS = [("paddy_type", "VARIETY", 90), ("signal", "SIGNAL", 130), ("rate", "RATE", 70), ("low_52w", "52W LOW", 70),
+                  ("high_52w", "52W HIGH", 70), ("ma_long", "50D AVG", 70), ("pct_rank", "PCTL", 50), ("as_of", "AS OF", 90), ("computed_at", "UPDATED", 130)]
+
 class MarketAnalysisFrame(ctk.CTkFrame):
     def __init__(self, master):
         super().__init__(master, fg_color="transparent")
@@ -33,6 +41,8 @@ class MarketAnalysisFrame(ctk.CTkFrame):
         
         self.refresh_btn = ctk.CTkButton(ctrl_frame, text="⟳ REFRESH MARKET", command=self.refresh_data, fg_color="#21262d", hover_color="#30363d", width=150)
         self.refresh_btn.pack(side="right")
+        self.loading_lbl = ctk.CTkLabel(ctrl_frame, text="", font=("Consolas", 12, "bold"), text_color=TEXT_SUB)
+        self.loading_lbl.pack(side="right", padx=15)
 
         # --- 3. MAIN DASHBOARD GRID ---
         self.grid_frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -65,11 +75,32 @@ class MarketAnalysisFrame(ctk.CTkFrame):
         # Stats List
         self.lbl_high = self.create_stat_row(self.side_panel, "52-Week High")
         self.lbl_low = self.create_stat_row(self.side_panel, "52-Week Low")
+        self.lbl_ma = self.create_stat_row(self.side_panel, f"{market_analytics.MA_SHORT_DAYS} / {market_analytics.MA_LONG_DAYS}-Day Avg")
+        self.lbl_rank = self.create_stat_row(self.side_panel, "52-Week Percentile")
         self.lbl_volatility = self.create_stat_row(self.side_panel, "Price Volatility")
 
-        # --- RIGHT: THE CHART ---
-        self.chart_area = ctk.CTkFrame(self.grid_frame, fg_color=BG_CARD, corner_radius=10)
-        self.chart_area.pack(side="right", fill="both", expand=True)
+        # --- RIGHT: THE CHART (zoom picks the visible range; only that range is fetched) ---
+        chart_col = ctk.CTkFrame(self.grid_frame, fg_color="transparent")
+        chart_col.pack(side="right", fill="both", expand=True)
+        self.zoom = "all"
+        self.zoom_btn = ctk.CTkSegmentedButton(chart_col, values=[z.upper() for z in market_analytics.ZOOM_LEVELS], command=self.set_zoom)
+        self.zoom_btn.set("ALL")
+        self.zoom_btn.pack(anchor="e", pady=(0, 8))
+        self.chart_area = ctk.CTkFrame(chart_col, fg_color=BG_CARD, corner_radius=10)
+        self.chart_area.pack(fill="both", expand=True)
+
+        # --- BELOW THE CHART: EVERY VARIETY'S SIGNAL (click a heading to sort, a row to analyse it) ---
+        style = ttk.Style()
+        style.configure("Signals.Treeview", rowheight=24, font=("Consolas", 10), background=BG_CARD, foreground=TEXT_MAIN, fieldbackground=BG_CARD, borderwidth=0)
+        style.configure("Signals.Treeview.Heading", font=("Arial", 10, "bold"), background="#21262d", foreground=TEXT_SUB, relief="flat")
+        self.signals, self.signal_sort = pd.DataFrame(), ("paddy_type", False)
+        self.signal_tree = ttk.Treeview(chart_col, columns=[c[0] for c in SIGNAL_COLUMNS], show="headings", height=6, style="Signals.Treeview", selectmode="browse")
+        for key, heading, width in SIGNAL_COLUMNS:
+            self.signal_tree.heading(key, text=heading, command=lambda k=key: self.sort_signals(k))
+            self.signal_tree.column(key, width=width, anchor="center")
+        for code, (_, color) in SIGNAL_STYLES.items(): self.signal_tree.tag_configure(code, foreground=color)
+        self.signal_tree.bind("<<TreeviewSelect>>", self.on_signal_select)
+        self.signal_tree.pack(fill="x", pady=(10, 0))
         
         self.refresh_data()
 
@@ -81,16 +112,37 @@ class MarketAnalysisFrame(ctk.CTkFrame):
         lbl.pack(side="right")
         return lbl
 
+    def set_loading(self, busy):
+        loading = busy or background_tasks.is_pending("market.ticker") or background_tasks.is_pending("market.analysis")
+        self.loading_lbl.configure(text="LOADING..." if loading else "")
+
     def refresh_data(self):
+        self.set_loading(True)
+        background_tasks.submit(self, "market.ticker", self.fetch_market, on_done=self.show_market, on_error=self.on_load_error)
+
+    @staticmethod
+    def fetch_market():
+        """Runs on a worker thread: ticker prices, the variety list and every variety's signal, re-evaluated and stored once per refresh."""
+        return database.get_latest_prices(), [v[1] for v in database.get_all_paddy_varieties()], market_analytics.refresh_signals()
+
+    def on_load_error(self, e):
+        self.set_loading(False)
+        print(f"Market Data Error: {e}")
+
+    def show_market(self, data):
         # 1. Update Ticker
         try:
-            df = database.get_latest_prices()
+            self.set_loading(False)
+            df, vars, signals = data
+            self.show_signals(signals)
             if not df.empty:
-                ticker_text = "  |  ".join([f"{r['paddy_type']}: ₹{r['base_rate']}" for _, r in df.iterrows()])
+                marks = {r['paddy_type']: SIGNAL_STYLES[r['signal']][0].split()[-1] for _, r in signals.iterrows()}
+                ticker_text = "  |  ".join([f"{r['paddy_type']}: ₹{r['base_rate']:g} {marks.get(r['paddy_type'], '')}".rstrip()
+                                            + (f" (sold ₹{r['sale_rate']:g})" if pd.notna(r['sale_rate']) else "")
+                                            for _, r in df.iterrows()])
                 self.ticker_lbl.configure(text=f"🔴 LIVE MARKET:  {ticker_text}  (Rates per Quintal)")
             
             # 2. Update Dropdown
-            vars = [v[1] for v in database.get_all_paddy_varieties()]
             if vars:
                 self.var_menu.configure(values=vars)
                 self.var_menu.set(vars[0])
@@ -98,62 +150,96 @@ class MarketAnalysisFrame(ctk.CTkFrame):
         except Exception as e:
             print(f"Market Data Error: {e}")
 
+    def show_signals(self, signals):
+        self.signals = signals
+        key, descending = self.signal_sort
+        self.signal_tree.delete(*self.signal_tree.get_children())
+        if signals.empty: return
+        for _, r in signals.sort_values(key, ascending=not descending, na_position="last").iterrows():
+            values = [r['paddy_type'], SIGNAL_STYLES[r['signal']][0] + (" ◀ NEW" if pd.notna(r['prev_signal']) and r['prev_signal'] != r['signal'] else ""),
+                      f"{r['rate']:,.0f}", f"{r['low_52w']:,.0f}", f"{r['high_52w']:,.0f}", f"{r['ma_long']:,.0f}",
+                      f"{r['pct_rank']:.0f}%", r['as_of'], r['computed_at'].replace("T", " ")]
+            self.signal_tree.insert("", "end", iid=r['paddy_type'], values=values, tags=(r['signal'],))
+        if self.signal_tree.exists(self.var_menu.get()): self.signal_tree.selection_set(self.var_menu.get())
+
+    def sort_signals(self, key):
+        current, descending = self.signal_sort
+        self.signal_sort = (key, not descending if key == current else key not in ("paddy_type", "signal"))
+        self.show_signals(self.signals)
+
+    def on_signal_select(self, _event=None):
+        picked = self.signal_tree.selection()
+        if picked and picked[0] != self.var_menu.get():
+            self.var_menu.set(picked[0])
+            self.update_analysis(picked[0])
+
+    def set_zoom(self, value):
+        self.zoom = value.lower()
+        if self.var_menu.get(): self.update_analysis(self.var_menu.get())
+
     def update_analysis(self, variety):
-        df = database.get_price_history(variety)
-        if df.empty: return
-
-        # --- 1. CALCULATE METRICS ---
-        current_price = df.iloc[-1]['rate']
-        all_time_high = df['rate'].max()
-        all_time_low = df['rate'].min()
-        avg_price = df['rate'].mean()
-        
-        # Volatility (Standard Deviation)
-        volatility = df['rate'].std()
-        vol_text = "STABLE (Safe)" if volatility < 50 else "HIGH (Risky)"
+        # Flipping quickly through varieties only draws the last one picked
+        self.set_loading(True)
+        width = max(self.chart_area.winfo_width() - 20, market_analytics.DEFAULT_WIDTH_PX // 2)
+        background_tasks.submit(self, "market.analysis", self.fetch_analysis, variety, self.zoom, width,
+                                on_done=lambda data: self.show_analysis(data, variety), on_error=self.on_load_error)
+
+    @staticmethod
+    def fetch_analysis(variety, zoom, width):
+        """Runs on a worker thread: the variety's rolling stats (side panel), the stored signals (evaluated by
+        fetch_market on each refresh) and the chart's visible bars."""
+        stats = market_analytics.latest_stats()
+        return (stats.loc[variety] if variety in stats.index else None), database.get_market_signals(), market_analytics.price_series(variety, zoom, width)
+
+    def show_analysis(self, data, variety):
+        self.set_loading(False)
+        stats, signals, bars = data
+        self.show_signals(signals)
+        if stats is None: return
+
+        # --- 1. METRICS (52 weeks / 20 / 50 days up to the variety's newest purchase) ---
+        current_price = stats['last_rate']
+        high_52w, low_52w = stats['high_52w'], stats['low_52w']
+        volatility = stats['volatility']
+        vol_text = "STABLE (Safe)" if pd.isna(volatility) or volatility < 50 else "HIGH (Risky)"
         
         # --- 2. UPDATE UI ---
         self.lbl_big_price.configure(text=f"₹ {current_price:,.0f}")
-        self.lbl_high.configure(text=f"₹ {all_time_high:,.0f}")
-        self.lbl_low.configure(text=f"₹ {all_time_low:,.0f}")
+        self.lbl_high.configure(text=f"₹ {high_52w:,.0f}")
+        self.lbl_low.configure(text=f"₹ {low_52w:,.0f}")
+        self.lbl_ma.configure(text=f"₹ {stats['ma_short']:,.0f} / {stats['ma_long']:,.0f}")
+        self.lbl_rank.configure(text=f"{stats['pct_rank']:.0f}%")
         self.lbl_volatility.configure(text=vol_text)
 
-        # --- 3. AI SIGNAL LOGIC ---
-        # Logic: Buy if price is near Low or below Average. Sell/Wait if near High.
-        if current_price <= all_time_low * 1.05:
-            self.lbl_signal.configure(text="STRONG BUY 🟢", text_color=ACCENT_GREEN)
-            self.signal_card.configure(border_color=ACCENT_GREEN)
-        elif current_price < avg_price:
-            self.lbl_signal.configure(text="GOOD VALUE 🔵", text_color=ACCENT_BLUE)
-            self.signal_card.configure(border_color=ACCENT_BLUE)
-        elif current_price >= all_time_high * 0.95:
-            self.lbl_signal.configure(text="OVERPRICED 🔴", text_color=ACCENT_RED)
-            self.signal_card.configure(border_color=ACCENT_RED)
-        else:
-            self.lbl_signal.configure(text="HOLD / NEUTRAL ⚪", text_color="white")
-            self.signal_card.configure(border_color="gray")
+        # --- 3. AI SIGNAL (evaluated for every variety at once, see market_analytics.SIGNAL_RULES) ---
+        row = signals[signals['paddy_type'] == variety]
+        text, color = SIGNAL_STYLES[row.iloc[0]['signal']] if not row.empty else ("WAITING FOR DATA", "gray")
+        self.lbl_signal.configure(text=text, text_color=color)
+        self.signal_card.configure(border_color=color if color != "white" else "gray")
 
         # --- 4. PLOT CHART ---
-        self.plot_chart(df, variety)
+        self.plot_chart(bars, variety)
 
-    def plot_chart(self, df, title):
+    def plot_chart(self, bars, title):
         for widget in self.chart_area.winfo_children(): widget.destroy()
+        if bars.empty: return
         
         fig = Figure(figsize=(6, 4), dpi=100, facecolor=BG_CARD)
         ax = fig.add_subplot(111)
         ax.set_facecolor(BG_CARD)
         
-        df['date'] = pd.to_datetime(df['date'])
-        
-        # Gradient Fill Effect (Simulated with fill_between)
-        ax.plot(df['date'], df['rate'], color=ACCENT_BLUE, linewidth=2)
-        ax.fill_between(df['date'], df['rate'], df['rate'].min(), color=ACCENT_BLUE, alpha=0.1)
+        # Daily average line over the day's low-high band (one bar per pixel at most)
+        ax.plot(bars['date'], bars['vwap'], color=ACCENT_BLUE, linewidth=2)
+        ax.fill_between(bars['date'], bars['low'], bars['high'], color=ACCENT_BLUE, alpha=0.1, linewidth=0)
         
-        # Draw Average Line
-        avg = df['rate'].mean()
-        ax.axhline(avg, color='gray', linestyle='--', linewidth=1, alpha=0.5, label=f"Avg: {avg:.0f}")
+        # Rolling overlays: short / long moving averages and the 52-week range as of each day
+        ax.plot(bars['date'], bars['ma_short'], color="#d29922", linewidth=1, label=f"{market_analytics.MA_SHORT_DAYS}-day avg")
+        ax.plot(bars['date'], bars['ma_long'], color="#bc8cff", linewidth=1, label=f"{market_analytics.MA_LONG_DAYS}-day avg")
+        ax.plot(bars['date'], bars['high_52w'], color=ACCENT_RED, linestyle='--', linewidth=1, alpha=0.5, label="52-week high")
+        ax.plot(bars['date'], bars['low_52w'], color=ACCENT_GREEN, linestyle='--', linewidth=1, alpha=0.5, label="52-week low")
+        ax.legend(loc="upper left", fontsize=7, facecolor=BG_CARD, edgecolor="#30363d", labelcolor=TEXT_SUB)
         
-        ax.set_title(f"{title} PRICE TREND (₹/Qtl)", color="white", fontsize=10, pad=10)
+        ax.set_title(f"{title} PRICE TREND, {self.zoom.upper()} (₹/Qtl)", color="white", fontsize=10, pad=10)
         
         # Dark Theme Styling
         ax.tick_params(colors=TEXT_SUB, labelsize=8)
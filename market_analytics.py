@@ -0,0 +1,116 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import database
+
+# ======================================================================================
+# MARKET ANALYTICS (PRICE SERIES AND ROLLING STATS FOR THE MARKET SCREEN)
+# ======================================================================================
+# The chart never draws raw purchase lines. get_price_bars() aggregates them in SQL into daily
+# OHLC + volume-weighted average bars, reading only the visible range (ZOOM_LEVELS). When there
+# are still more bars than the chart has pixels, lttb() keeps the ones that preserve the shape of
+# the VWAP line, at most one per pixel.
+# rolling_stats() works for every variety at once from the daily weighted prices in daily_rollup:
+# 52-week high / low, 20 / 50-day moving averages, volatility and the percentile rank of each day's
+# price within its 52 weeks, in one groupby-rolling pass that stays cached until the next write.
+# evaluate_signals() applies the signal rules to every variety's latest stats at once;
+# refresh_signals() stores the outcome (market_signals) for the side panel and the signals table.
+
+ZOOM_LEVELS = {"week": 7, "month": 31, "season": 183, "all": None}  # visible days up to the newest purchase
+DEFAULT_WIDTH_PX = 600
+
+# Rolling windows, in calendar days ending on each purchase day (days without purchases just have no row)
+YEAR_DAYS = 364                   # 52 weeks
+MA_SHORT_DAYS, MA_LONG_DAYS = 20, 50
+VOLATILITY_DAYS = 20
+OVERLAY_COLUMNS = ["ma_short", "ma_long", "high_52w", "low_52w"]  # drawn over the chart's bars
+
+# Signal rules on a variety's newest purchase rate, first match wins (anything else is HOLD)
+SIGNAL_RULES = [
+    ("STRONG_BUY", lambda s: s['last_rate'] <= s['low_52w'] * 1.05),   # within 5% of the 52-week low
+    ("GOOD_VALUE", lambda s: s['last_rate'] < s['ma_long']),           # below the 50-day average
+    ("OVERPRICED", lambda s: s['last_rate'] >= s['high_52w'] * 0.95),  # within 5% of the 52-week high
+]
+
+def lttb(x, y, threshold):
+    """Indices of `threshold` points of (x, y) chosen by Largest-Triangle-Three-Buckets; the first and
+    last points are always kept. Returns every index when there are no more than `threshold` points."""
+    n = len(x)
+    if threshold >= n or threshold < 3: return np.arange(n)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)  # threshold - 2 buckets between the end points
+    picked = np.empty(threshold, dtype=int); picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for b in range(threshold - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nlo, nhi = (edges[b + 1], edges[b + 2]) if b + 2 < len(edges) else (n - 1, n)
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()  # the next bucket's average stands in for its pick
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax()); picked[b + 1] = a
+    return picked
+
+def _newest_purchase(paddy_type):
+    prices = database.get_latest_prices()
+    row = prices[prices['paddy_type'] == paddy_type]
+    return None if row.empty else row.iloc[0]['bill_date']
+
+def price_series(paddy_type, zoom="all", width_px=DEFAULT_WIDTH_PX):
+    """Daily price bars of a variety for the chart: the last ZOOM_LEVELS[zoom] days up to its newest
+    purchase, downsampled to at most `width_px` bars. Empty when the variety was never bought."""
+    if zoom not in ZOOM_LEVELS: raise ValueError(f"Unknown zoom: {zoom}")
+    newest = _newest_purchase(paddy_type)
+    if newest is None: return database.get_price_bars(paddy_type, "9999-12-31", "9999-12-31")
+    days = ZOOM_LEVELS[zoom]
+    if days: bars = database.get_price_bars(paddy_type, (date.fromisoformat(newest) - timedelta(days=days - 1)).isoformat(), newest)
+    else: bars = database.get_price_bars(paddy_type)
+    bars = bars.copy()
+    bars['date'] = pd.to_datetime(bars['date'])
+    bars['vwap'] = bars['vwap'].fillna(bars['close'])
+    if len(bars) > width_px: bars = bars.iloc[lttb(bars['date'].values.astype("int64"), bars['vwap'], max(int(width_px), 3))]
+    stats = rolling_stats()
+    overlays = stats.loc[stats['paddy_type'] == paddy_type, ["date", *OVERLAY_COLUMNS]]
+    return bars.merge(overlays, on="date", how="left")  # every daily bar is a purchase day, so each has its row
+
+@database.cached_query
+def rolling_stats():
+    """One row per variety and purchase day: price (the day's weight-weighted rate), qtl, and as of that day
+    high_52w / low_52w (of the daily prices), ma_short / ma_long (weight-weighted over MA_SHORT_DAYS /
+    MA_LONG_DAYS), volatility (std of the daily prices over VOLATILITY_DAYS) and pct_rank (0-100, share of
+    the 52 weeks' daily prices at or below the day's). Sorted by variety and date."""
+    df = database.get_daily_purchase_prices()
+    df['date'] = pd.to_datetime(df['date'])
+    df['turnover'] = df['price'] * df['qtl']
+    grouped = df.groupby('paddy_type', sort=False)  # rows come sorted by variety, so results line up by position
+    def window(days): return grouped.rolling(f"{days}D", on="date")
+    year, short, long = window(YEAR_DAYS), window(MA_SHORT_DAYS), window(MA_LONG_DAYS)
+    df['high_52w'] = year['price'].max().to_numpy()
+    df['low_52w'] = year['price'].min().to_numpy()
+    df['pct_rank'] = year['price'].rank(method="max", pct=True).to_numpy() * 100
+    df['ma_short'] = short['turnover'].sum().to_numpy() / short['qtl'].sum().to_numpy()
+    df['ma_long'] = long['turnover'].sum().to_numpy() / long['qtl'].sum().to_numpy()
+    df['volatility'] = window(VOLATILITY_DAYS)['price'].std().to_numpy()
+    return df.drop(columns="turnover")
+
+def latest_stats():
+    """rolling_stats() as of each variety's newest purchase day, indexed by variety, plus last_rate (the base_rate
+    of its newest purchase line, from latest_prices) and last_bill_date."""
+    stats = rolling_stats().groupby('paddy_type', sort=False).tail(1).set_index('paddy_type')
+    prices = database.get_latest_prices().set_index('paddy_type')
+    stats['last_rate'], stats['last_bill_date'] = prices['base_rate'], prices['bill_date']
+    return stats
+
+def evaluate_signals(stats=None):
+    """latest_stats() (or the given frame) with a `signal` column: the first SIGNAL_RULES code that holds, else "HOLD"."""
+    stats = latest_stats() if stats is None else stats.copy()
+    stats['signal'] = np.select([rule(stats) for _, rule in SIGNAL_RULES], [code for code, _ in SIGNAL_RULES], default="HOLD")
+    return stats
+
+def refresh_signals():
+    """Evaluates every variety, stores what changed and returns database.get_market_signals()."""
+    stats = evaluate_signals()
+    stats['as_of'] = stats['date'].dt.strftime("%Y-%m-%d")
+    stats['rate'] = stats['last_rate']
+    database.save_market_signals(stats.reset_index()[["paddy_type", "as_of", *database.MARKET_SIGNAL_COLUMNS]].itertuples(index=False, name=None))
+    return database.get_market_signals()
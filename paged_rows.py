@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+
+# ======================================================================================
+# PAGED ROW MODEL (NO TK: SHARED BY VirtualTable AND THE BENCHMARKS)
+# ======================================================================================
+# A TableSource describes where rows come from; a PageCache gives random access to them
+# while holding only a small window of pages, whatever the length of the list.
+
+PAGE_SIZE = 200
+MAX_CACHED_PAGES = 8
+_END = object()  # cursor slot past the last page
+
+class TableSource:
+    """Adapts keyset-paged database functions for VirtualTable.
+
+    fetch_page(after, limit, sort, descending) -> (rows, next_cursor)
+    count() -> total rows
+    format_row(row) -> (values, tags)
+    `sortable` lists the column keys the provider can order by in SQL.
+    """
+    def __init__(self, fetch_page, count, format_row=lambda row: (tuple(row), ()), sortable=(), sort=None, descending=True):
+        self.fetch_page, self.count, self.format_row = fetch_page, count, format_row
+        self.sortable, self.sort, self.descending = tuple(sortable), sort, descending
+
+class PageCache:
+    """Random row access over a keyset-paged source.
+
+    Remembers the cursor at every page boundary it has passed (a few bytes per page) but keeps
+    only `max_pages` pages of rows, least recently used first out. Safe to load from a worker
+    thread while the Tk thread reads.
+    """
+    def __init__(self, source, page_size=PAGE_SIZE, max_pages=MAX_CACHED_PAGES):
+        self.source, self.page_size, self.max_pages = source, page_size, max_pages
+        self._lock = threading.Lock()
+        self.epoch, self.total = 0, None
+        self._pages, self._cursors = OrderedDict(), [None]
+        self.stats = {"fetches": 0, "hits": 0, "misses": 0}
+
+    def reset(self):
+        """Forgets every row (filter or sort changed). Loads still in flight are discarded."""
+        with self._lock:
+            self.epoch += 1; self.total = None
+            self._pages.clear(); self._cursors = [None]
+            return self.epoch
+
+    def get(self, index):
+        """Row at `index`, or None if its page is not loaded yet."""
+        page, offset = divmod(index, self.page_size)
+        with self._lock:
+            rows = self._pages.get(page)
+            if rows is None: self.stats["misses"] += 1; return None
+            self._pages.move_to_end(page); self.stats["hits"] += 1
+            return rows[offset] if offset < len(rows) else None
+
+    def missing_pages(self, start, stop):
+        """Pages needed for rows [start, stop) that are not cached (and not past the known end of the list)."""
+        if stop <= start: return []
+        with self._lock:
+            end = self._cursors.index(_END) if _END in self._cursors else None
+            return [p for p in range(start // self.page_size, (stop - 1) // self.page_size + 1)
+                    if p not in self._pages and (end is None or p < end)]
+
+    def load_total(self, epoch):
+        total = self.source.count()
+        with self._lock:
+            if epoch == self.epoch: self.total = total
+        return total
+
+    def load(self, pages, epoch):
+        """Fetches `pages`, walking forward from the nearest page boundary already known."""
+        for page in sorted(pages):
+            with self._lock:
+                if epoch != self.epoch: return
+                known = min(page, len(self._cursors) - 1)
+            for p in range(known, page + 1):
+                with self._lock:
+                    if epoch != self.epoch or p >= len(self._cursors): return
+                    cursor = self._cursors[p]
+                    if cursor is _END: return
+                    if p < page and p + 1 < len(self._cursors): continue
+                rows, next_cursor = self.source.fetch_page(cursor, self.page_size, self.source.sort, self.source.descending)
+                with self._lock:
+                    if epoch != self.epoch: return
+                    self.stats["fetches"] += 1
+                    if p + 1 == len(self._cursors): self._cursors.append(_END if next_cursor is None else next_cursor)
+                    self._pages[p] = list(rows); self._pages.move_to_end(p)
+                    while len(self._pages) > self.max_pages: self._pages.popitem(last=False)
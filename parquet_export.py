@@ -0,0 +1,168 @@
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import pandas as pd
+
+import database
+
+try:
+    import pyarrow  # optional: only this export needs it (pip install pyarrow)
+except ImportError:
+    pyarrow = None
+
+# ======================================================================================
+# INCREMENTAL PARQUET EXPORT (FOR THE ACCOUNTANT'S PANDAS / EXCEL WORK)
+# ======================================================================================
+# export() writes the bill, sales, processing and ledger tables as Parquet under EXPORT_DIR,
+# one file per financial year x month in hive layout:
+#     export/bill_items/fy=2024-2025/month=2024-05/part.parquet
+# so pd.read_parquet("export/bill_items", filters=[("month", "=", "2024-05")]) opens only that
+# month. Item datasets carry their bill's date and party, so the bill x item join is already done.
+# The first run (no manifest.json in the folder yet) writes every month. After that only the months
+# marked in export_changes are rewritten; the database triggers mark a month on every write
+# (see EXPORT_SOURCES in database.py). Closed financial years are read from their archive files.
+# Parties and varieties are small and rewritten whole on every run. Keep one export folder per
+# database: a run clears the marks it exported, so a second folder would miss those months.
+
+EXPORT_DIR = "export"           # relative to the folder of DATABASE_FILE
+COMPRESSION = "snappy"          # what Excel / Power BI parquet readers all understand
+
+DATASETS = {  # name -> (export_changes source, SELECT over {s}.tables for one month (two ? dates), tables whose column types apply)
+    "bills": ("PURCHASE", "SELECT b.* FROM {s}.bills b WHERE b.bill_date BETWEEN ? AND ?", ("bills",)),
+    "bill_items": ("PURCHASE", "SELECT i.*, b.bill_date, b.party_id FROM {s}.bill_items i JOIN {s}.bills b ON b.bill_no = i.bill_no "
+                               "WHERE b.bill_date BETWEEN ? AND ?", ("bill_items", "bills")),
+    "sales_bills": ("SALE", "SELECT b.* FROM {s}.sales_bills b WHERE b.bill_date BETWEEN ? AND ?", ("sales_bills",)),
+    "sales_bill_items": ("SALE", "SELECT i.*, b.bill_date, b.party_id FROM {s}.sales_bill_items i JOIN {s}.sales_bills b ON b.bill_no = i.bill_no "
+                                 "WHERE b.bill_date BETWEEN ? AND ?", ("sales_bill_items", "sales_bills")),
+    "processing_batches": ("PROCESS", "SELECT b.* FROM {s}.processing_batches b WHERE b.date BETWEEN ? AND ?", ("processing_batches",)),
+    "processing_batch_items": ("PROCESS", "SELECT i.*, b.batch_no, b.date FROM {s}.processing_batch_items i JOIN {s}.processing_batches b "
+                                          "ON b.batch_id = i.batch_id WHERE b.date BETWEEN ? AND ?", ("processing_batch_items", "processing_batches")),
+    # named columns: archives closed before schema 8 have no value_change, so l.* would not line up across years
+    "inventory_log": ("LEDGER", "SELECT l.log_id, l.date, l.type, l.ref_id, l.paddy_type, l.bags_change, l.weight_change_kg "
+                                "FROM {s}.inventory_log l WHERE l.date BETWEEN ? AND ?", ("inventory_log",)),
+}
+LOOKUPS = ("parties", "paddy_varieties")
+DATE_COLUMNS = ("bill_date", "date")
+SQL_TYPES = {"INTEGER": "Int64", "REAL": "float64", "TEXT": "string"}
+
+def export_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(database.DATABASE_FILE)), EXPORT_DIR)
+
+def _column_types(conn, tables):
+    """pandas dtype of each column, from the declared SQLite types (the first table wins on a shared name)."""
+    types = {}
+    for table in reversed(tables):
+        for _, name, decl, *_ in conn.execute(f"PRAGMA table_info({table})"):
+            types[name] = "datetime64[ns]" if name in DATE_COLUMNS else SQL_TYPES.get(decl.upper(), "object")
+    return types
+
+def _typed(df, types):
+    for col in df.columns:
+        dtype = types.get(col, "object")
+        if dtype == "datetime64[ns]": df[col] = pd.to_datetime(df[col], format="%Y-%m-%d", errors="coerce")
+        elif dtype != "object": df[col] = df[col].astype(dtype)
+    return df
+
+def _write(df, path):
+    df.to_parquet(path + ".part", engine="pyarrow", compression=COMPRESSION, index=False)
+    os.replace(path + ".part", path)
+
+def _partition(name, month):
+    fy = database.get_financial_year(f"{month}-01")
+    return fy, os.path.join(name, f"fy={fy}", f"month={month}", "part.parquet")
+
+def _all_months(conn):
+    """{(source, month)} of everything on file, closed years included (for the first, full run)."""
+    months = {(src, day[:7]) for src, day in conn.execute(f"SELECT DISTINCT source, substr(day, 1, 7) FROM {database._rollup_table()}")}
+    ledger, n = database._over_years("SELECT DISTINCT substr(date, 1, 7) FROM {s}.inventory_log")
+    return months | {("LEDGER", m) for (m,) in conn.execute(ledger)}
+
+def _load_manifest(folder):
+    try:
+        with open(os.path.join(folder, "manifest.json")) as f: return json.load(f)
+    except (OSError, ValueError): return None
+
+def _save_manifest(folder, manifest):
+    path = os.path.join(folder, "manifest.json")
+    with open(path + ".part", "w") as f: json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".part", path)
+
+def export(full=False, progress=None):
+    """Brings EXPORT_DIR up to date. Returns {"months", "files", "removed", "rows", "seconds"} or "Error: ...".
+
+    full=True rewrites every month (also what the first run into an empty folder does).
+    progress(done, total) runs after each month.
+    """
+    if pyarrow is None: return "Error: Parquet export needs pyarrow (pip install pyarrow)."
+    started, folder = time.perf_counter(), export_dir()
+    conn = database.get_connection()
+    try:
+        manifest = _load_manifest(folder)
+        full = full or manifest is None
+        manifest = manifest or {"datasets": {}}
+        pending = {(src, m) for src, m in conn.execute("SELECT source, month FROM export_changes")}
+        if full: pending |= _all_months(conn)
+        by_fy = defaultdict(set)
+        for src, month in pending: by_fy[database.get_financial_year(f"{month}-01")].add((src, month))
+        stats = {"months": len(pending), "files": 0, "removed": 0, "rows": 0}
+        done, types = 0, {name: _column_types(conn, tables) for name, (_, _, tables) in DATASETS.items()}
+        for fy in sorted(by_fy):
+            start, end = database.fy_bounds(fy)
+            database.attach_archives(start, end)  # ATTACH is not allowed inside the read transaction below
+            conn.execute("BEGIN")
+            try:  # marks and rows from one snapshot: a save after it leaves its month marked for the next run
+                marks = {(src, m): n for src, m, n in conn.execute("SELECT source, month, changes FROM export_changes WHERE month BETWEEN ? AND ?", (start[:7], end[:7]))}
+                frames = {}
+                for name, (source, branch, _) in DATASETS.items():
+                    for src, month in by_fy[fy]:
+                        if src != source: continue
+                        sql, n = database._over_years(branch, start, end)
+                        frames[name, month] = pd.read_sql_query(sql + " ORDER BY 1", conn, params=(f"{month}-01", f"{month}-31") * n)
+            finally: conn.execute("COMMIT")
+            for (name, month), df in frames.items():
+                _, rel = _partition(name, month)
+                path, entries = os.path.join(folder, rel), manifest["datasets"].setdefault(name, {})
+                if df.empty:
+                    if os.path.exists(path): os.remove(path); stats["removed"] += 1
+                    entries.pop(month, None); continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _write(_typed(df, types[name]), path)
+                entries[month] = {"path": rel.replace(os.sep, "/"), "fy": fy, "rows": len(df), "exported_at": datetime.now().isoformat(timespec="seconds")}
+                stats["files"] += 1; stats["rows"] += len(df)
+            _save_manifest(folder, manifest)
+            cursor = database.begin_write(conn)
+            cursor.executemany("DELETE FROM export_changes WHERE source = ? AND month = ? AND changes = ?", [(s, m, n) for (s, m), n in marks.items() if (s, m) in by_fy[fy]])
+            database.commit(conn)
+            done += len(by_fy[fy])
+            if progress: progress(done, len(pending))
+        for table in LOOKUPS:
+            _write(_typed(pd.read_sql_query(f"SELECT * FROM {table}", conn), _column_types(conn, (table,))), os.path.join(folder, f"{table}.parquet"))
+        manifest.update(database=os.path.abspath(database.DATABASE_FILE), schema_version=database.SCHEMA_VERSION,
+                        exported_at=datetime.now().isoformat(timespec="seconds"),
+                        columns={name: {c: str(t) for c, t in types[name].items()} for name in DATASETS})
+        _save_manifest(folder, manifest)
+        return dict(stats, seconds=time.perf_counter() - started)
+    except Exception as e:
+        if conn.in_transaction: conn.rollback()
+        return f"Error: {e}"
+
+def read_dataset(name, months=None, folder=None):
+    """One exported dataset as a DataFrame, reading only the given months ("2024-05", ...) if any."""
+    filters = [("month", "in", list(months))] if months else None
+    return pd.read_parquet(os.path.join(folder or export_dir(), name), engine="pyarrow", filters=filters)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export the bills and ledger to Parquet, one file per month")
+    parser.add_argument("--db", default=database.DATABASE_FILE, help="database file (default: %(default)s)")
+    parser.add_argument("--full", action="store_true", help="rewrite every month, not just the changed ones")
+    args = parser.parse_args()
+    database.DATABASE_FILE = args.db
+    database.setup_database()
+    result = export(full=args.full, progress=lambda d, t: print(f"  ... {d:,}/{t:,} months"))
+    if isinstance(result, str): print(result)
+    else: print(f"{result['months']:,} months: {result['files']:,} files, {result['rows']:,} rows written, {result['removed']} removed in {result['seconds']:.1f}s -> {export_dir()}")
+    database.close_all_connections()
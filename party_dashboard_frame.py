@@ -1,5 +1,6 @@
 import customtkinter as ctk
 import database
+from virtual_table import VirtualTable, TableSource
 import pandas as pd
 
 class PartyDashboardFrame(ctk.CTkFrame):
@@ -12,23 +13,36 @@ class PartyDashboardFrame(ctk.CTkFrame):
         self.header_f = ctk.CTkFrame(self, fg_color="transparent"); self.header_f.grid(row=0, column=0, sticky="ew", padx=10, pady=10)
         self.title = ctk.CTkLabel(self.header_f, text="SELECT PARTY FROM REPORTS", font=("Arial", 22, "bold")); self.title.pack(anchor="w")
         self.kpi_f = ctk.CTkFrame(self.header_f, fg_color="transparent"); self.kpi_f.pack(fill="x", pady=10)
-        self.hist_f = ctk.CTkScrollableFrame(self, label_text="BILL HISTORY"); self.hist_f.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
+        self.hist_f = ctk.CTkFrame(self); self.hist_f.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
+        ctk.CTkLabel(self.hist_f, text="BILL HISTORY, CLOSED YEARS INCLUDED (DOUBLE CLICK AN OPEN-YEAR PURCHASE TO EDIT)", font=("Arial", 12, "bold")).pack(anchor="w", padx=10, pady=(10, 0))
+        cols = [("type", "TYPE", 100, "center"), ("bill_no", "BILL #", 80, "center"), ("bill_date", "DATE", 110, "center"),
+                ("total_bags", "BAGS", 90, "center"), ("net_payable", "AMOUNT (Rs.)", 140, "e")]
+        self.history = VirtualTable(self.hist_f, cols, on_activate=self.open_bill)
+        self.history.pack(fill="both", expand=True, padx=10, pady=10)
 
     def load_party_data(self, pid):
         p = database.get_party_details(pid)
         k = database.get_party_kpis(pid)
-        bills = database.get_all_bills_for_party(pid)
 
         self.title.configure(text=f"{p[1]} (GST: {p[2] or 'N/A'})")
         for w in self.kpi_f.winfo_children(): w.destroy()
         
         self.add_kpi_card("TOTAL BILLS", k['total_bills'])
         self.add_kpi_card("TOTAL BUSINESS", f"Rs. {k['total_business']:,.2f}")
-        self.add_kpi_card("LAST BILL", k['last_bill_date'])
+        self.add_kpi_card("LAST BILL", k['last_bill_date'] or "-")
+        self.add_kpi_card("PURCHASES", f"{k['purchase_bills']} / Rs. {k['purchase_business']:,.0f}")
+        self.add_kpi_card("SALES", f"{k['sale_bills']} / Rs. {k['sale_business']:,.0f}")
+        self.add_kpi_card("AVG RATE / MOISTURE", f"Rs. {k['avg_rate']:,.0f} / {k['avg_moisture']:.1f}%" if k['purchase_bills'] else "-")
 
-        for w in self.hist_f.winfo_children(): w.destroy()
-        for b in bills:
-            ctk.CTkButton(self.hist_f, text=f"BILL #{b[0]} | {b[1]} | Rs. {b[2]:,.2f}", anchor="w", fg_color="gray20").pack(fill="x", pady=2)
+        self.history.set_source(TableSource(
+            lambda after, limit, sort, desc: database.get_transactions_page("ALL", "", after, limit, sort, desc, party_id=pid),
+            lambda: database.count_transactions(party_id=pid),
+            format_row=lambda b: ((b[0], b[1], b[2], b[4], f"{b[5]:,.2f}"), ()),
+            sortable=database.ARCHIVE_SORT_COLUMNS, sort="bill_date"))
+
+    def open_bill(self, row):
+        closed_until = max((a[3] for a in database.get_year_archives()), default="")  # closed years' bills are read-only
+        if row[0] == "PURCHASE" and row[2] > closed_until: self.master.master.load_bill_for_editing(row[1])
 
     def add_kpi_card(self, title, val):
         f = ctk.CTkFrame(self.kpi_f)
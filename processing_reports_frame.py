@@ -5,6 +5,7 @@ import pandas as pd
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import database
+import background_tasks
 from datetime import date, timedelta
 
 # --- Theme Colors (Matches Entry Screen) ---
@@ -34,6 +35,8 @@ class ProcessingReportsFrame(ctk.CTkFrame):
         
         # Load Button
         ctk.CTkButton(f1, text="LOAD DATA", command=self.load_data, fg_color=THEME_COLOR, hover_color=THEME_HOVER, height=32, font=("Arial", 12, "bold")).pack(side="left", padx=20)
+        self.loading_lbl = ctk.CTkLabel(f1, text="", font=("Arial", 12, "bold"), text_color="#ff9f1c")
+        self.loading_lbl.pack(side="left", padx=5)
 
         # --- KPI CARDS ROW ---
         f2 = ctk.CTkFrame(self, fg_color="transparent")
@@ -105,10 +108,34 @@ class ProcessingReportsFrame(ctk.CTkFrame):
         ax.spines['right'].set_color('none')
         ax.set_title(title, color='white', pad=15, fontweight="bold", fontsize=10)
 
+    def set_loading(self, busy):
+        self.loading_lbl.configure(text="LOADING..." if busy else "")
+
     def load_data(self):
+        # Queries run on a worker; changing the range and loading again drops the older result
+        self.set_loading(True)
+        background_tasks.submit(self, "processing.report", self.fetch_report, self.start.get(), self.end.get(),
+                                on_done=self.show_report, on_error=self.on_load_error)
+
+    @staticmethod
+    def fetch_report(start, end):
+        """Runs on a worker thread: SQL and pandas only, no widget access. KPIs and charts come from the daily rollups."""
+        df = database.get_processing_report(start, end)
+        if df.empty: return df, None, None, None
+        totals = database.get_rollup("PROCESS", start, end).iloc[0]
+        days = database.get_rollup("PROCESS", start, end, by="day")
+        trend = pd.Series(days["weight_kg"].values / 100, index=pd.to_datetime(days["day"])) # QTL
+        stats = database.get_processing_variety_stats(start, end)
+        return df, totals, trend, stats
+
+    def on_load_error(self, e):
+        self.set_loading(False)
+        messagebox.showerror("Error", f"Failed to load reports: {str(e)}")
+
+    def show_report(self, data):
         try:
-            # 1. Fetch Main Report
-            df = database.get_processing_report(self.start.get(), self.end.get())
+            self.set_loading(False)
+            df, totals, trend, stats = data
             self.tree.delete(*self.tree.get_children())
             
             if df.empty:
@@ -120,9 +147,9 @@ class ProcessingReportsFrame(ctk.CTkFrame):
                 return
 
             # 2. Update KPIs
-            self.k_batches.configure(text=str(len(df)))
-            self.k_bags.configure(text=f"{df['total_input_bags'].sum():,.0f}")
-            self.k_weight.configure(text=f"{df['total_input_weight_kg'].sum()/100:,.2f}") # KG to QTL
+            self.k_batches.configure(text=f"{totals['bills']:.0f}")
+            self.k_bags.configure(text=f"{totals['bags']:,.0f}")
+            self.k_weight.configure(text=f"{totals['weight_kg']/100:,.2f}") # KG to QTL
 
             # 3. Populate Table
             for _, r in df.iterrows():
@@ -136,9 +163,6 @@ class ProcessingReportsFrame(ctk.CTkFrame):
                 ])
 
             # 4. Chart 1: Daily Trend
-            df['date'] = pd.to_datetime(df['date'])
-            trend = df.groupby('date')['total_input_weight_kg'].sum() / 100 # QTL
-            
             fig1 = Figure(figsize=(5, 2.5), dpi=100, facecolor="#2b2b2b")
             ax1 = fig1.add_subplot(111)
             ax1.bar(trend.index.strftime('%d-%b'), trend.values, color=THEME_COLOR, alpha=0.9)
@@ -146,7 +170,6 @@ class ProcessingReportsFrame(ctk.CTkFrame):
             self.embed_chart(fig1, self.frame_chart1)
 
             # 5. Chart 2: Variety Consumption (Pie)
-            stats = database.get_processing_variety_stats(self.start.get(), self.end.get())
             fig2 = Figure(figsize=(5, 2.5), dpi=100, facecolor="#2b2b2b")
             ax2 = fig2.add_subplot(111)
             
@@ -172,8 +195,10 @@ class ProcessingReportsFrame(ctk.CTkFrame):
         if not item: return
         
         # Get Batch No from the first column of selected row
-        batch_no = self.tree.item(item[0])['values'][0]
-        
+        self.show_batch_details(self.tree.item(item[0])['values'][0])
+
+    def show_batch_details(self, batch_no):
+        """Popup with the full composition of one batch (also opened from the quick-jump search)"""
         # Fetch Detail Data
         df = database.get_batch_items_by_no(batch_no)
         if df.empty: return
@@ -5,8 +5,8 @@ import pandas as pd
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import database
+import background_tasks
 from datetime import date, timedelta
-import numpy as np
 
 class ReportsFrame(ctk.CTkFrame):
     def __init__(self, master):
@@ -47,6 +47,8 @@ class ReportsFrame(ctk.CTkFrame):
         self.end.pack(side="left", padx=5, pady=10)
         
         ctk.CTkButton(f1, text="REFRESH DASHBOARD", command=self.load_data, font=("Arial", 12, "bold"), fg_color="#1f6aa5", height=32).pack(side="left", padx=20)
+        self.loading_lbl = ctk.CTkLabel(f1, text="", font=("Arial", 12, "bold"), text_color="#ff9900")
+        self.loading_lbl.pack(side="left", padx=5)
 
         # 2. KPI Cards
         f2 = ctk.CTkFrame(self.tab_bills, fg_color="transparent")
@@ -139,9 +141,36 @@ class ReportsFrame(ctk.CTkFrame):
         ax.set_title(title, color='white', pad=15, fontweight="bold")
 
     # ================= LOGIC & DATA LOADING =================
+    def set_loading(self, busy):
+        self.loading_lbl.configure(text="LOADING..." if busy else "")
+
     def load_data(self):
+        # Query + aggregation run on a worker; a newer refresh supersedes this one
+        self.set_loading(True)
+        background_tasks.submit(self, "reports.dashboard", self.fetch_report, self.start.get(), self.end.get(),
+                                on_done=self.show_report, on_error=self.on_load_error)
+
+    @staticmethod
+    def fetch_report(start, end):
+        """Runs on a worker thread: SQL and pandas only, no widget access. Totals come from the daily rollups."""
+        df = database.get_report_bills(start, end)
+        if df.empty: return {"df": df}
+
+        totals = database.get_rollup("PURCHASE", start, end).iloc[0]
+        top_parties = database.get_rollup("PURCHASE", start, end, by="party").set_index("party")["net"].nlargest(5).sort_values()
+        days = database.get_rollup("PURCHASE", start, end, by="day")
+        trend = pd.Series(days["weight_kg"].values, index=pd.to_datetime(days["day"]))
+        return {"df": df, "totals": totals, "top_parties": top_parties, "trend": trend,
+                "variety_stats": database.get_purchase_variety_stats(start, end)}
+
+    def on_load_error(self, e):
+        self.set_loading(False)
+        messagebox.showerror("Error", f"Failed to load report data:\n{e}")
+
+    def show_report(self, data):
         try:
-            self.df = database.get_report_data_with_items(self.start.get(), self.end.get())
+            self.set_loading(False)
+            self.df = data["df"]
             
             self.tree.delete(*self.tree.get_children())
             self.v_tree.delete(*self.v_tree.get_children())
@@ -151,11 +180,11 @@ class ReportsFrame(ctk.CTkFrame):
                 return
 
             # --- 1. UPDATE BILLS TAB ---
-            df_bills = self.df.drop_duplicates('bill_no')
+            df_bills, totals = self.df, data["totals"]
             
-            self.k_bills.configure(text=str(len(df_bills)))
-            self.k_weight.configure(text=f"{df_bills['final_truck_weight_kg'].sum():,.2f}")
-            self.k_amt.configure(text=f"{df_bills['net_payable'].sum():,.0f}")
+            self.k_bills.configure(text=f"{totals['bills']:.0f}")
+            self.k_weight.configure(text=f"{totals['weight_kg']:,.2f}")
+            self.k_amt.configure(text=f"{totals['net']:,.0f}")
 
             # Define Columns (Added 'bill_total_brokerage')
             cols = ['bill_no', 'bill_date', 'party_name', 'total_bags', 'final_truck_weight_kg', 'bill_total_brokerage', 'net_payable']
@@ -185,7 +214,7 @@ class ReportsFrame(ctk.CTkFrame):
             # CHART 1: Top 5 Parties
             fig1 = Figure(figsize=(5, 3), dpi=100, facecolor="#2b2b2b")
             ax1 = fig1.add_subplot(111)
-            top_parties = df_bills.groupby('party_name')['net_payable'].sum().nlargest(5).sort_values()
+            top_parties = data["top_parties"]
             if not top_parties.empty:
                 bars = ax1.barh(top_parties.index, top_parties.values, color="#1f6aa5")
                 ax1.bar_label(bars, fmt='{:,.0f}', padding=3, color='white', fontsize=8)
@@ -195,8 +224,7 @@ class ReportsFrame(ctk.CTkFrame):
             # CHART 2: Daily Trend
             fig2 = Figure(figsize=(5, 3), dpi=100, facecolor="#2b2b2b")
             ax2 = fig2.add_subplot(111)
-            df_bills['bill_date'] = pd.to_datetime(df_bills['bill_date'])
-            trend = df_bills.groupby('bill_date')['final_truck_weight_kg'].sum()
+            trend = data["trend"]
             if not trend.empty:
                 ax2.plot(trend.index, trend.values, color="#00ffcc", marker="o", linewidth=2)
                 ax2.grid(color='gray', linestyle='--', linewidth=0.3, alpha=0.5)
@@ -204,33 +232,11 @@ class ReportsFrame(ctk.CTkFrame):
             self.embed_chart(fig2, self.frame_chart2)
 
             # --- 2. UPDATE VARIETY TAB ---
-            self.update_variety_analysis()
+            self.update_variety_analysis(data["variety_stats"])
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load report data:\n{e}")
 
-    def update_variety_analysis(self):
-        if self.df.empty: return
-
-        self.df['default_brokerage_rate'] = self.df['default_brokerage_rate'].fillna(0)
-        self.df['calc_brokerage'] = self.df['item_weight'] * self.df['default_brokerage_rate']
-        self.df['wt_rate'] = self.df['base_rate'] * self.df['item_weight']
-        self.df['wt_moist'] = self.df['moisture'] * self.df['item_weight']
-
-        grp = self.df.groupby('paddy_type')
-        
-        with np.errstate(divide='ignore', invalid='ignore'):
-            total_wt = grp['item_weight'].sum()
-            avg_rate = grp['wt_rate'].sum() / total_wt
-            avg_moist = grp['wt_moist'].sum() / total_wt
-            total_brok = grp['calc_brokerage'].sum()
-
-        stats = pd.DataFrame({
-            'wt': total_wt,
-            'rate': avg_rate.fillna(0),
-            'moist': avg_moist.fillna(0),
-            'brok': total_brok
-        }).reset_index()
-
+    def update_variety_analysis(self, stats):
         for _, r in stats.iterrows():
             self.v_tree.insert("", "end", values=[
                 r['paddy_type'], 
@@ -4,6 +4,7 @@ from tkcalendar import Calendar
 from datetime import datetime
 import os
 import database
+import bill_calculator
 import sales_pdf_generator # Ensures we use the specific Sales PDF format
 
 # ======================================================
@@ -208,46 +209,15 @@ class SalesBillingFrame(ctk.CTkFrame):
             s_float = lambda e: float(e.get()) if e.get().strip() else 0.0
             s_int = lambda e: int(e.get()) if e.get().strip() else 0
             
-            b_no = s_int(self.bill_no) 
-            weights = [s_float(self.w1), s_float(self.w2), s_float(self.w3)]
-            final_w = min([w for w in weights if w > 0]) if any(w > 0 for w in weights) else 0.0
-            
-            tot_bags = s_int(self.total_bags)
-            calc_gross = 0; items_data = []
-            tot_bags_items = sum(s_int(r['bags']) for r in self.item_rows)
-            dist_bags = tot_bags_items if tot_bags_items > 0 else (tot_bags if tot_bags > 0 else 1)
-
-            for r in self.item_rows:
-                bags = s_int(r['bags'])
-                rate = s_float(r['rate'])
-                wt = (bags / dist_bags) * final_w
-                amt = int(round(wt * rate))
-                calc_gross += amt
-                
-                # Sales Items structure matches DB needs
-                items_data.append({
-                    "paddy_type": r["type"].get().upper(),
-                    "bags": bags,
-                    "rate": rate,
-                    "calculated_weight_kg": wt, # PDF will display this as QTL
-                    "item_amount": amt
-                })
-
-            disc = int(round((calc_gross * s_float(self.discount)) / 100))
-            net = int(round((calc_gross - disc) + s_float(self.brokerage) + s_float(self.hamali) + s_float(self.others_a)))
-
-            header = {
-                "bill_no": b_no, "party_name": self.party.get().upper(), "bill_date": self.date.get(), 
-                "date": self.date.get(), "lorry_no": self.lorry.get().upper(), "total_bags": tot_bags, 
-                "final_weight_kg": final_w, # Sales DB uses this specific column name
-                "total_gross_amount": calc_gross, "discount_percent": s_float(self.discount), 
-                "brokerage": s_float(self.brokerage), "hamali": s_float(self.hamali), 
-                "others_desc": self.others_d.get().upper(), "others_amount": s_float(self.others_a),
-                "net_payable": net,
-                # Pass extra fields for PDF generation if needed
-                "gst_no": "N/A", "address": "N/A", "mobile_no": "N/A" 
+            fields = {
+                "bill_no": s_int(self.bill_no), "party_name": self.party.get(), "date": self.date.get(),
+                "lorry_no": self.lorry.get(), "total_bags": s_int(self.total_bags),
+                "truck_weight1_kg": s_float(self.w1), "truck_weight2_kg": s_float(self.w2), "truck_weight3_kg": s_float(self.w3),
+                "discount_percent": s_float(self.discount), "brokerage": s_float(self.brokerage), "hamali": s_float(self.hamali),
+                "others_desc": self.others_d.get(), "others_amount": s_float(self.others_a)
             }
-            return header, items_data
+            rows = [{"paddy_type": r["type"].get(), "bags": s_int(r['bags']), "rate": s_float(r['rate'])} for r in self.item_rows]
+            return bill_calculator.calculate_sales_bill(fields, rows)
         except Exception as e:
             messagebox.showerror("Error", f"Calculation Error: {str(e)}")
             return None, None
@@ -285,7 +255,8 @@ class SalesBillingFrame(ctk.CTkFrame):
         if header["total_bags"] == 0: return messagebox.showerror("Error", "Total Bags 0")
         
         try:
-            res = database.add_sales_bill(header, items)
+            # The number on screen is only a preview; the save takes the next free one
+            res = database.add_sales_bill(dict(header, bill_no=None), items)
             if isinstance(res, int):
                 saved_bill = database.get_sales_bill_details(res)
                 if sales_pdf_generator.generate_sales_pdf(saved_bill): 
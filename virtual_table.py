@@ -0,0 +1,144 @@
+import customtkinter as ctk
+from tkinter import ttk
+
+import background_tasks
+from paged_rows import PageCache, TableSource
+
+# ======================================================================================
+# VIRTUALIZED TABLE (ONLY THE VISIBLE ROWS EXIST AS TREEVIEW ITEMS)
+# ======================================================================================
+# VirtualTable keeps one Treeview item per visible line and re-fills those items from a
+# PageCache as the user scrolls, so a list of 500 rows and one of 500,000 cost the same
+# to open and hold.
+
+class VirtualTable(ctk.CTkFrame):
+    """Treeview + scrollbar that only materializes the visible rows of a TableSource.
+
+    columns: [(key, heading, width, anchor)]. on_activate(row) runs on double-click / Enter.
+    """
+    def __init__(self, master, columns, on_activate=None, row_height=28, **kwargs):
+        super().__init__(master, fg_color="transparent", **kwargs)
+        self.columns, self.on_activate, self.row_height = columns, on_activate, row_height
+        self.source, self.cache, self.top, self.selected = None, None, 0, None
+        self.task_key = f"virtual_table.{id(self)}"
+
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in columns], show="headings", height=1, selectmode="browse")
+        for key, heading, width, anchor in columns:
+            self.tree.heading(key, text=heading, command=lambda k=key: self.sort_by(k))
+            self.tree.column(key, width=width, anchor=anchor)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.items = []
+
+        self.tree.bind("<Configure>", lambda e: self.resize(e.height))
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1, "units", step=3))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-1, "units", step=3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(1, "units", step=3))
+        self.tree.bind("<Up>", lambda e: self.move_selection(-1))
+        self.tree.bind("<Down>", lambda e: self.move_selection(1))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-1, "pages"))
+        self.tree.bind("<Next>", lambda e: self.scroll(1, "pages"))
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Double-1>", lambda e: self.activate())
+        self.tree.bind("<Return>", lambda e: self.activate())
+
+    # --- DATA ---
+    def set_source(self, source):
+        """Shows a new source from the top (e.g. after the filter or search text changed)."""
+        self.source, self.cache = source, PageCache(source)
+        self.refresh_headings(); self.reload()
+
+    def reload(self):
+        """Re-reads the current source from the top (e.g. after new bills were saved)."""
+        if self.cache is None: return
+        epoch = self.cache.reset()
+        self.top, self.selected = 0, None
+        background_tasks.submit(self, self.task_key + ".count", self.cache.load_total, epoch, on_done=lambda total: self.render())
+        self.render()
+
+    def sort_by(self, key):
+        if self.source is None or key not in self.source.sortable: return
+        self.source.descending = not self.source.descending if self.source.sort == key else True
+        self.source.sort = key
+        self.refresh_headings(); self.reload()
+
+    def refresh_headings(self):
+        for key, heading, _, _ in self.columns:
+            arrow = (" ▼" if self.source.descending else " ▲") if self.source and self.source.sort == key else ""
+            self.tree.heading(key, text=heading + arrow)
+
+    def row_at(self, index):
+        return self.cache.get(index) if self.cache else None
+
+    # --- VIEWPORT ---
+    def visible_rows(self):
+        return len(self.items)
+
+    def resize(self, height):
+        # First line of the Treeview is the heading row
+        wanted = max(1, height // self.row_height - 1)
+        if wanted == len(self.items): return
+        self.tree.delete(*self.items)
+        self.items = [self.tree.insert("", "end", values=()) for _ in range(wanted)]
+        self.render()
+
+    def clamp(self, top):
+        total = self.cache.total if self.cache and self.cache.total is not None else 0
+        return max(0, min(top, total - len(self.items)))
+
+    def scroll(self, n, what, step=1):
+        self.top = self.clamp(self.top + n * (len(self.items) if what == "pages" else step))
+        self.render()
+
+    def on_scrollbar(self, action, *args):
+        total = (self.cache.total or 0) if self.cache else 0
+        if action == "moveto": self.top = self.clamp(int(float(args[0]) * total))
+        elif action == "scroll": self.scroll(int(args[0]), args[1]); return
+        self.render()
+
+    def render(self):
+        """Fills the visible Treeview items from the cache; pages not loaded yet are fetched in the background."""
+        if self.cache is None: return
+        total = self.cache.total
+        if total is None:
+            self.scrollbar.set(0, 1)
+            for item in self.items: self.tree.item(item, values=(), tags=())
+            return
+        self.top = self.clamp(self.top)
+        shown = min(len(self.items), total - self.top)
+        self.scrollbar.set(self.top / total if total else 0, (self.top + shown) / total if total else 1)
+        missing = self.cache.missing_pages(self.top, self.top + shown)
+        if missing:
+            background_tasks.submit(self, self.task_key + ".rows", self.cache.load, missing, self.cache.epoch, on_done=lambda _: self.render())
+        selection = None
+        for pos, item in enumerate(self.items):
+            index = self.top + pos
+            row = self.cache.get(index) if pos < shown else None
+            if row is None: self.tree.item(item, values=("…",) if pos < shown else (), tags=())
+            else:
+                values, tags = self.source.format_row(row)
+                self.tree.item(item, values=values, tags=tags)
+            if index == self.selected and pos < shown: selection = item
+        if selection: self.tree.selection_set(selection)
+        else: self.tree.selection_remove(*self.tree.selection())
+
+    # --- SELECTION & ACTIONS ---
+    def on_select(self, event=None):
+        sel = self.tree.selection()
+        if sel and sel[0] in self.items: self.selected = self.top + self.items.index(sel[0])
+
+    def move_selection(self, step):
+        if self.selected is None: self.selected = self.top
+        else: self.selected = max(0, min(self.selected + step, (self.cache.total or 1) - 1))
+        if self.selected < self.top: self.top = self.selected
+        elif self.selected >= self.top + len(self.items): self.top = self.selected - len(self.items) + 1
+        self.render()
+        return "break"
+
+    def selected_row(self):
+        return self.row_at(self.selected) if self.selected is not None else None
+
+    def activate(self):
+        row = self.selected_row()
+        if row is not None and self.on_activate: self.on_activate(row)
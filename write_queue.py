@@ -0,0 +1,111 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import database
+
+# ======================================================================================
+# SINGLE WRITER THREAD WITH GROUP COMMIT (OPTIONAL)
+# ======================================================================================
+# Once start() has run, add_bill / add_sales_bill / update_bill / add_processing_batch no longer
+# open their own transaction: database._run_write queues the save body here and waits on its
+# Future. One writer thread drains the queue and runs up to MAX_BATCH bodies in one BEGIN
+# IMMEDIATE ... COMMIT, each inside its own SAVEPOINT, so a failed save (stock short, bad data)
+# is rolled back alone and the rest of the group still commits. Futures are resolved only after
+# the COMMIT, with exactly what the direct call would have returned: the saved number or
+# "Error: ...". Grouping only helps saves made from this process (imports, several threads);
+# other counter PCs still take turns on the file lock.
+
+MAX_BATCH = 64       # saves per group commit
+MAX_WAIT_MS = 0      # how long the writer lingers for more saves once one arrived; 0 = group whatever
+                     # queued up while the previous commit ran
+
+_queue = queue.Queue()           # (body, args, future, queued_at) or None to stop
+_thread = None
+_lock = threading.Lock()
+_STATS_ZERO = {"requests": 0, "commits": 0, "failed": 0, "max_depth": 0, "max_batch": 0,
+               "commit_ms_total": 0.0, "commit_ms_max": 0.0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+_stats = dict(_STATS_ZERO)
+
+def start():
+    """Starts the writer thread and routes the save functions through it. Safe to call twice."""
+    global _thread
+    with _lock:
+        if _thread is not None: return
+        _thread = threading.Thread(target=_run, name="db-writer", daemon=True)
+        _thread.start()
+    database._writer = submit
+
+def stop():
+    """Commits what is queued, stops the writer and goes back to direct saves."""
+    global _thread
+    with _lock: thread, _thread = _thread, None
+    if thread is None: return
+    database._writer = None
+    _queue.put(None); thread.join()
+
+def is_running():
+    with _lock: return _thread is not None
+
+def submit(body, args):
+    """Queues body(cursor, *args) for the next group commit. Returns a Future of its result."""
+    if threading.current_thread() is _thread: raise RuntimeError("write_queue.submit called from the writer thread")
+    future = Future()
+    _queue.put((body, args, future, time.perf_counter()))
+    with _lock: _stats["max_depth"] = max(_stats["max_depth"], _queue.qsize())
+    return future
+
+def _run():
+    stopping = False
+    while not stopping:
+        first = _queue.get()
+        if first is None: break
+        batch, deadline = [first], time.perf_counter() + MAX_WAIT_MS / 1000
+        while len(batch) < MAX_BATCH:
+            try: request = _queue.get(timeout=max(0.0, deadline - time.perf_counter())) if MAX_WAIT_MS else _queue.get_nowait()
+            except queue.Empty: break
+            if request is None: stopping = True; break
+            batch.append(request)
+        _commit_group(batch)
+    database.close_connection()
+
+def _commit_group(batch):
+    conn = database.get_connection()
+    started = time.perf_counter()
+    try:
+        cursor = database.begin_write(conn)
+        results = []
+        for body, args, _, _ in batch:
+            cursor.execute("SAVEPOINT save")
+            try: results.append(body(cursor, *args)); cursor.execute("RELEASE save")
+            except Exception as e:
+                cursor.execute("ROLLBACK TO save"); cursor.execute("RELEASE save")
+                results.append(f"Error: {e}")
+        database.commit(conn)
+    except Exception as e:
+        conn.rollback(); results = [f"Error: {e}"] * len(batch)
+    database.bump_generation()
+    done = time.perf_counter()
+    with _lock:
+        commit_ms = (done - started) * 1000
+        _stats["requests"] += len(batch); _stats["commits"] += 1
+        _stats["failed"] += sum(isinstance(r, str) and r.startswith("Error") for r in results)
+        _stats["max_batch"] = max(_stats["max_batch"], len(batch))
+        _stats["commit_ms_total"] += commit_ms; _stats["commit_ms_max"] = max(_stats["commit_ms_max"], commit_ms)
+        for _, _, _, queued_at in batch:
+            wait_ms = (done - queued_at) * 1000
+            _stats["wait_ms_total"] += wait_ms; _stats["wait_ms_max"] = max(_stats["wait_ms_max"], wait_ms)
+    for (_, _, future, _), result in zip(batch, results): future.set_result(result)
+
+def get_stats():
+    """Queue depth, saves per group commit, commit latency and submit-to-result latency (ms)."""
+    with _lock:
+        stats = dict(_stats, depth=_queue.qsize())
+    stats["avg_batch"] = stats["requests"] / stats["commits"] if stats["commits"] else 0.0
+    stats["commit_ms_avg"] = stats["commit_ms_total"] / stats["commits"] if stats["commits"] else 0.0
+    stats["wait_ms_avg"] = stats["wait_ms_total"] / stats["requests"] if stats["requests"] else 0.0
+    return stats
+
+def reset_stats():
+    with _lock: _stats.update(_STATS_ZERO)